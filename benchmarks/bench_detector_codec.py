@@ -0,0 +1,101 @@
+"""
+Decode/encode cost of MTCNNDetector, before (PIL round trip) and after (OpenCV direct).
+
+Runs on frames of the bundled demo_rtsp_server/samples/input_files/sample.mp4 and
+reports ms per frame and transient memory per frame (tracemalloc peak above the
+steady state, i.e. how many bytes of temporary arrays a frame costs).
+
+Usage:
+    python benchmarks/bench_detector_codec.py --frames 200
+    python benchmarks/bench_detector_codec.py --with-model   # include detector inference per backend
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from common import load_sample_frames
+from stream.utils.mtcnn_detector import MTCNNDetector
+from stream.utils.analyzers import analyzer_spec, build_chain
+
+FACES = [{'box': [100, 80, 60, 70], 'confidence': 0.98}]
+
+
+def legacy_decode(image_bytes):
+    """The original bytes -> PIL -> numpy -> contiguous RGB path"""
+    image_pil = Image.open(io.BytesIO(image_bytes))
+    image_array_rgb = np.array(image_pil)
+    if image_array_rgb.dtype != np.uint8:
+        image_array_rgb = image_array_rgb.astype(np.uint8)
+    if not image_array_rgb.flags['C_CONTIGUOUS']:
+        image_array_rgb = np.ascontiguousarray(image_array_rgb, dtype=np.uint8)
+    return image_array_rgb
+
+
+def legacy_draw(image_bytes, faces):
+    """The original decode, draw with cv2, PIL JPEG save path"""
+    image_array_rgb = legacy_decode(image_bytes)
+    for face in faces:
+        x, y, w, h = face['box']
+        cv2.rectangle(image_array_rgb, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        cv2.putText(image_array_rgb, f"{face['confidence']:.2f}", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    out = io.BytesIO()
+    Image.fromarray(image_array_rgb).save(out, format='JPEG', quality=85)
+    return out.getvalue()
+
+
+def measure(name, frames, fn):
+    # Warm up caches and reused buffers before measuring
+    for frame in frames[:5]:
+        fn(frame)
+
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    ms = (time.perf_counter() - start) * 1000 / len(frames)
+
+    tracemalloc.start()
+    transient = 0
+    for frame in frames:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(frame)
+        transient += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    print(f"{name:<40} {ms:>8.2f} ms/frame  {transient / len(frames) / 1024:>10,.0f} KiB transient/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--width', type=int, default=640, help="Frame width, RTSPClient scales to 640")
+    parser.add_argument('--with-model', action='store_true', help="Also time full detection with each analyzer backend")
+    args = parser.parse_args()
+
+    frames = load_sample_frames(args.frames, width=args.width, quality=75)
+    print(f"{len(frames)} frames of {args.width}px, avg {sum(map(len, frames)) // len(frames):,} bytes")
+
+    full = MTCNNDetector(decode_scale=1)
+    half = MTCNNDetector(decode_scale=2)
+
+    measure("decode: before (PIL)", frames, legacy_decode)
+    measure("decode: after (cv2, reused RGB)", frames, full.decode)
+    measure("decode: after (cv2, 1/2 reduced)", frames, half.decode)
+    measure("draw+encode: before (PIL)", frames, lambda f: legacy_draw(f, FACES))
+    measure("draw+encode: after (cv2)", frames, lambda f: MTCNNDetector.draw_faces(f, FACES))
+
+    if args.with_model:
+        model_frames = frames[:50]
+        measure("find_faces: full size", model_frames, full.find_faces)
+        measure("find_faces: 1/2 decode", model_frames, half.find_faces)
+        haar = build_chain(analyzer_spec('haar'))
+        measure("analyzer: haar (1/2 decode, defaults)", model_frames, haar.run)
+
+
+if __name__ == '__main__':
+    main()
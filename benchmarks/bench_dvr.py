@@ -0,0 +1,87 @@
+"""
+FrameRecorder (instant replay) append and seek cost as the recording grows.
+
+Appends sample JPEG frames at simulated 15 fps capture times into a recorder with
+a small RAM tier, so most of the window lives in memory-mapped segment files,
+and times append, frame_at (random seeks in the window) and next_after
+(sequential playback). Append and lookup should stay flat as the window grows,
+and the recording must stay within its byte budget.
+
+Usage:
+    python benchmarks/bench_dvr.py --minutes 1 5 20 --budget-mb 512
+"""
+import argparse
+import random
+import tempfile
+import time
+
+from common import load_sample_frames, setup_django
+
+
+def run(frames, minutes, budget_mb, ram_mb, segment_mb, fps):
+    from stream.utils.dvr import FrameRecorder
+
+    directory = tempfile.mkdtemp(prefix='bench-dvr-')
+    recorder = FrameRecorder('bench', directory, budget_bytes=budget_mb << 20, ram_bytes=ram_mb << 20,
+                             segment_bytes=segment_mb << 20)
+    count = int(minutes * 60 * fps)
+    start = 1_700_000_000.0
+    append_s = append_max = 0.0
+    for i in range(count):
+        append_started = time.perf_counter()
+        recorder.append(start + i / fps, i, frames[i % len(frames)])
+        elapsed = time.perf_counter() - append_started
+        append_s += elapsed
+        append_max = max(append_max, elapsed)
+        # A real ingest loop waits for the next frame, which lets the DVR's I/O thread create segments
+        time.sleep(0)
+    append_us = 1e6 * append_s / count
+
+    oldest, newest = recorder.window()
+    seeks = [random.uniform(oldest, newest) for _ in range(2000)]
+    seek_started = time.perf_counter()
+    for at in seeks:
+        frame = recorder.frame_at(at)
+        assert frame.captured_at <= at + 1e-6 or at < oldest
+    seek_us = 1e6 * (time.perf_counter() - seek_started) / len(seeks)
+
+    frame = recorder.frame_at(oldest)
+    steps = 0
+    play_started = time.perf_counter()
+    while frame and steps < 2000:
+        frame = recorder.next_after(frame.captured_at)
+        steps += 1
+    play_us = 1e6 * (time.perf_counter() - play_started) / max(steps, 1)
+
+    stats = recorder.stats()
+    recorder.close()
+    return append_us, 1e6 * append_max, seek_us, play_us, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--budget-mb', type=int, default=512)
+    parser.add_argument('--ram-mb', type=int, default=32)
+    parser.add_argument('--segment-mb', type=int, default=16)
+    parser.add_argument('--fps', type=float, default=15)
+    args = parser.parse_args()
+
+    setup_django()
+    frames = load_sample_frames(100, quality=80)
+    print(f"{len(frames)} sample frames, avg {sum(map(len, frames)) / len(frames) / 1024:.0f} KiB")
+
+    ok = True
+    for minutes in args.minutes:
+        append_us, append_max_us, seek_us, play_us, stats = run(frames, minutes, args.budget_mb, args.ram_mb, args.segment_mb, args.fps)
+        used_mb = (stats['ram_bytes'] + stats['segments'] * args.segment_mb * (1 << 20)) / (1 << 20)
+        print(f"captured={minutes:>5.1f} min  window={stats['window_s']:>6.0f} s  "
+              f"ram={stats['ram_frames']:>5} frames  disk={stats['disk_frames']:>6} frames in {stats['segments']:>2} segments  "
+              f"dropped={stats['frames_dropped']:>6}  append={append_us:.1f} us (max {append_max_us:.0f})  seek={seek_us:.1f} us  next={play_us:.1f} us  "
+              f"budget used={used_mb:.0f}/{args.budget_mb} MB")
+        ok = ok and used_mb <= args.budget_mb
+    print("OK" if ok else "FAILED: recording exceeded its byte budget")
+
+
+if __name__ == '__main__':
+    main()
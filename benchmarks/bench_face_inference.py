@@ -0,0 +1,140 @@
+"""
+Per-stream MTCNN detectors vs the shared detection pool.
+
+per-stream: every stream thread owns an MTCNNDetector and runs it inline on its
+            frames (the original RTSPClient design).
+shared:     every stream offers frames through an AsyncFaceDetector to one
+            thread DetectionPool with --models workers, each owning one model.
+
+Each mode runs in a fresh subprocess and reports RSS growth and detections/s.
+
+Usage:
+    python benchmarks/bench_face_inference.py --streams 1 10 40 --duration 15
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from common import load_sample_frames, rss_mb, setup_django
+
+
+def run_per_stream(streams, duration, fps, frames):
+    from stream.utils.mtcnn_detector import MTCNNDetector
+
+    detectors = [MTCNNDetector() for _ in range(streams)]
+    loaded_rss = rss_mb()
+    counts = [0] * streams
+    stop = threading.Event()
+
+    def stream_loop(i):
+        detector, interval, n = detectors[i], 1.0 / fps, 0
+        next_frame = time.monotonic()
+        while not stop.is_set():
+            if detector.find_faces(frames[n % len(frames)]) is not None:
+                counts[i] += 1
+            n += 1
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    threads = [threading.Thread(target=stream_loop, args=(i,), daemon=True) for i in range(streams)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts), loaded_rss, {}
+
+
+def run_shared(streams, duration, fps, frames, models):
+    from stream.utils.detection_pool import AsyncFaceDetector, DetectionPool
+
+    pool = DetectionPool(executor='thread', workers=models)
+    # Load every worker's model before measuring
+    for future in [pool.executor.submit(_load_model) for _ in range(models)]:
+        future.result()
+    loaded_rss = rss_mb()
+    counts = [0] * streams
+
+    def counter(i):
+        def on_result(seq, faces):
+            counts[i] += 1
+        return on_result
+
+    detectors = [AsyncFaceDetector(str(i), pool=pool, on_result=counter(i)) for i in range(streams)]
+    stop = threading.Event()
+
+    def stream_loop(i):
+        detector, interval, n = detectors[i], 1.0 / fps, 0
+        next_frame = time.monotonic()
+        while not stop.is_set():
+            detector.submit(memoryview(frames[n % len(frames)]))
+            n += 1
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    threads = [threading.Thread(target=stream_loop, args=(i,), daemon=True) for i in range(streams)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    pool.executor.shutdown(wait=True)
+    return sum(counts), loaded_rss, {'models': models}
+
+
+def _load_model():
+    from stream.utils.analyzers import DEFAULT_ANALYZER, analyzer_spec
+    from stream.utils.detection_pool import _detect_in_worker
+    time.sleep(0.1)  # so that each worker thread takes one of these
+    _detect_in_worker(b'', time.time(), analyzer_spec(DEFAULT_ANALYZER))
+
+
+def child(args):
+    frames = load_sample_frames(60)
+    base_rss = rss_mb()
+    if args.mode == 'per-stream':
+        detections, loaded_rss, extra = run_per_stream(args.child_streams, args.duration, args.fps, frames)
+    else:
+        detections, loaded_rss, extra = run_shared(args.child_streams, args.duration, args.fps, frames, args.models)
+    print(json.dumps({
+        'mode': args.mode,
+        'streams': args.child_streams,
+        'model_rss_mb': round(loaded_rss - base_rss, 1),
+        'peak_rss_mb': round(rss_mb(), 1),
+        'detections_per_s': round(detections / args.duration, 1),
+        **extra,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 10, 40])
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--models', type=int, default=1)
+    parser.add_argument('--mode', choices=['per-stream', 'shared'], help=argparse.SUPPRESS)
+    parser.add_argument('--child-streams', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        setup_django()
+        child(args)
+        return
+
+    for streams in args.streams:
+        for mode in ('per-stream', 'shared'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--child-streams', str(streams),
+                 '--duration', str(args.duration), '--fps', str(args.fps), '--models', str(args.models)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
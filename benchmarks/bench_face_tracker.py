@@ -0,0 +1,84 @@
+"""
+Accuracy drift of FaceTracker against running MTCNN on every frame.
+
+Every frame of the sample video goes through MTCNN once to get the reference
+boxes. Then each tracker configuration replays the frames: MTCNN runs only when
+the tracker asks for a keyframe, and the tracked boxes on the other frames are
+compared with the reference (greedy IoU matching).
+
+Usage:
+    python benchmarks/bench_face_tracker.py --intervals 3 5 10
+"""
+import argparse
+import time
+
+from common import load_sample_frames
+from stream.utils.face_tracker import FaceTracker, box_iou
+from stream.utils.mtcnn_detector import MTCNNDetector
+
+
+def match(reference, predicted):
+    """Greedy IoU matching, returns (sum of matched IoU, matched, missed, spurious)"""
+    remaining = [face['box'] for face in predicted]
+    total_iou, matched = 0.0, 0
+    for face in reference:
+        best = max(remaining, key=lambda box: box_iou(box, face['box']), default=None)
+        if best is not None and box_iou(best, face['box']) > 0.3:
+            total_iou += box_iou(best, face['box'])
+            matched += 1
+            remaining.remove(best)
+    return total_iou, matched, len(reference) - matched, len(remaining)
+
+
+def replay(frames, reference, detector, method, interval):
+    tracker = FaceTracker(method=method, detect_interval=interval)
+    detector_calls = 0
+    total_iou = matched = missed = spurious = 0
+    tracking_time = 0.0
+
+    for frame, expected in zip(frames, reference):
+        start = time.perf_counter()
+        faces = tracker.track(frame)
+        tracking_time += time.perf_counter() - start
+        if tracker.needs_detection():
+            faces = detector.find_faces(frame) or []
+            detector_calls += 1
+            tracker.on_detection(faces)
+            tracker.track(frame)  # seed the tracker on the keyframe itself
+        iou, m, miss, spur = match(expected, faces)
+        total_iou += iou
+        matched += m
+        missed += miss
+        spurious += spur
+
+    return {
+        'detector_calls': f"{detector_calls}/{len(frames)}",
+        'mean_iou': round(total_iou / matched, 3) if matched else 0.0,
+        'missed': missed,
+        'spurious': spurious,
+        'track_ms_per_frame': round(tracking_time * 1000 / len(frames), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=132)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[3, 5, 10])
+    args = parser.parse_args()
+
+    frames = load_sample_frames(args.frames)
+    detector = MTCNNDetector()
+
+    start = time.perf_counter()
+    reference = [detector.find_faces(frame) or [] for frame in frames]
+    detect_ms = (time.perf_counter() - start) * 1000 / len(frames)
+    print(f"every-frame MTCNN: {len(frames)} frames, {sum(map(len, reference))} faces, {detect_ms:.1f} ms/frame")
+
+    for method in ('iou', 'flow'):
+        for interval in args.intervals:
+            result = replay(frames, reference, detector, method, interval)
+            print(f"tracker={method:<5} interval={interval:<3} " + "  ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
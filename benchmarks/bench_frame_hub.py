@@ -0,0 +1,160 @@
+"""
+Frame fan-out through the channel layer vs the in-process frame hub.
+
+Each stream publishes sample JPEG frames from an asyncio task at --fps, the way
+AsyncRTSPClient does. Every viewer is a LatestFrameSlot as RTSPConsumer creates
+it, with a send() that only counts (no sockets):
+
+channel_layer: frames are group_sent; each viewer receives its channel's
+               messages and offers them to its slot (RTSPConsumer.stream_frame).
+hub:           frames are published to the stream's FrameChannel; each viewer's
+               slot pulls the newest frame itself.
+
+Every mode/layout runs in a fresh subprocess and reports CPU, RSS growth,
+delivered frames and delivery lag.
+
+Usage:
+    python benchmarks/bench_frame_hub.py --layouts 1x500 50x10 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from common import load_sample_frames, rss_mb, setup_django
+
+
+async def publish_channel_layer(channel_layer, group, frames, fps, stop):
+    seq, interval = 0, 1.0 / fps
+    next_frame = time.monotonic()
+    while not stop.is_set():
+        seq += 1
+        await channel_layer.group_send(group, {
+            'type': 'stream_frame',
+            'frame': bytes(frames[seq % len(frames)]),  # ingest produces a new bytes object per frame
+            'annotated_frame': None,
+            'seq': seq,
+            'captured_at': time.time(),
+        })
+        next_frame += interval
+        await asyncio.sleep(max(0.0, next_frame - time.monotonic()))
+
+
+async def publish_hub(channel, frames, fps, stop):
+    seq, interval = 0, 1.0 / fps
+    next_frame = time.monotonic()
+    while not stop.is_set():
+        seq += 1
+        channel.publish(bytes(frames[seq % len(frames)]), None, seq, time.time())
+        next_frame += interval
+        await asyncio.sleep(max(0.0, next_frame - time.monotonic()))
+
+
+async def receive_channel_layer(channel_layer, channel, slot):
+    while True:
+        event = await channel_layer.receive(channel)
+        if event['type'] == 'stream_frame':
+            slot.offer(event['frame'], event.get('captured_at'))
+
+
+async def run(mode, streams, viewers, duration, fps, frames):
+    from channels.layers import get_channel_layer
+    from stream.utils.frame_hub import get_frame_hub
+    from stream.utils.frame_slot import LatestFrameSlot
+
+    channel_layer = get_channel_layer()
+    hub = get_frame_hub()
+    delivered = [0]
+
+    async def send(frame_bytes):
+        delivered[0] += 1
+
+    stop = asyncio.Event()
+    tasks, slots = [], []
+    for s in range(streams):
+        group = f'bench_stream_{s}'
+        for _ in range(viewers):
+            if mode == 'hub':
+                slot = LatestFrameSlot(send, source=hub.channel(group))
+            else:
+                slot = LatestFrameSlot(send)
+                channel = await channel_layer.new_channel()
+                await channel_layer.group_add(group, channel)
+                tasks.append(asyncio.create_task(receive_channel_layer(channel_layer, channel, slot)))
+            slot.start()
+            slots.append(slot)
+
+    base_rss = rss_mb()
+    for s in range(streams):
+        group = f'bench_stream_{s}'
+        if mode == 'hub':
+            tasks.append(asyncio.create_task(publish_hub(hub.channel(group), frames, fps, stop)))
+        else:
+            tasks.append(asyncio.create_task(publish_channel_layer(channel_layer, group, frames, fps, stop)))
+
+    await asyncio.sleep(2)  # warm up
+    delivered[0] = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    peak_rss = rss_mb()
+    end = wall_start + duration
+    while time.perf_counter() < end:
+        await asyncio.sleep(0.5)
+        peak_rss = max(peak_rss, rss_mb())
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    stop.set()
+    lag = [slot.stats()['lag_avg_ms'] for slot in slots]
+    dropped = sum(slot.frames_dropped for slot in slots)
+    for task in tasks:
+        task.cancel()
+    for slot in slots:
+        await slot.close()
+
+    return {
+        'mode': mode,
+        'layout': f'{streams}x{viewers}',
+        'delivered_per_s': round(delivered[0] / wall, 1),
+        'expected_per_s': streams * viewers * fps,
+        'cpu_percent': round(100 * cpu / wall, 1),
+        'cpu_us_per_delivery': round(1e6 * cpu / max(delivered[0], 1), 1),
+        'rss_growth_mb': round(peak_rss - base_rss, 1),
+        'avg_lag_ms': round(sum(lag) / len(lag), 1),
+        'dropped': dropped,
+    }
+
+
+def child(args):
+    setup_django()
+    frames = load_sample_frames(30)
+    streams, viewers = map(int, args.child_layout.split('x'))
+    result = asyncio.run(run(args.mode, streams, viewers, args.duration, args.fps, frames))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', nargs='+', default=['1x500', '50x10'], help="STREAMSxVIEWERS")
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--mode', choices=['channel_layer', 'hub'], help=argparse.SUPPRESS)
+    parser.add_argument('--child-layout', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args)
+        return
+
+    for layout in args.layouts:
+        for mode in ('channel_layer', 'hub'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--child-layout', layout,
+                 '--duration', str(args.duration), '--fps', str(args.fps)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Micro-benchmark for the MJPEG frame splitter used by RTSPClient.
+
+Feeds a recorded MJPEG byte stream through the legacy bytearray loop and through
+JPEGFrameSplitter, reporting frames/s and bytes copied per frame.
+
+Record a stream from the bundled sample with:
+    ffmpeg -i demo_rtsp_server/samples/input_files/sample.mp4 -an -f mjpeg -q:v 10 \
+        -vf scale=640:-1,fps=15 /tmp/sample.mjpeg
+
+Usage:
+    python benchmarks/bench_frame_splitter.py /tmp/sample.mjpeg
+    python benchmarks/bench_frame_splitter.py --synthetic 2000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream.utils.frame_splitter import JPEGFrameSplitter, JPEG_START, JPEG_END
+
+
+class PipeLike(io.RawIOBase):
+    """Raw stream over a byte string that returns at most `pipe_size` bytes per read, like a pipe"""
+
+    def __init__(self, data, pipe_size):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._pipe_size = pipe_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._pipe_size, len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        n = min(size, self._pipe_size, len(self._data) - self._pos)
+        chunk = bytes(self._data[self._pos:self._pos + n])
+        self._pos += n
+        return chunk
+
+
+def synthetic_mjpeg(frame_count, frame_size=30_000, seed=0):
+    """Build an MJPEG-like stream: SOI + marker-free payload + EOI"""
+    rng = random.Random(seed)
+    payload = bytes(rng.randrange(0, 0xFF) for _ in range(frame_size))
+    frames = []
+    for i in range(frame_count):
+        jitter = rng.randrange(0, frame_size // 4)
+        frames.append(JPEG_START + payload[jitter:] + JPEG_END)
+    return b''.join(frames)
+
+
+def run_legacy(data, pipe_size):
+    """The original RTSPClient._stream_loop splitting logic"""
+    stream = PipeLike(data, pipe_size)
+    buffer = bytearray()
+    frames = copied = 0
+    while True:
+        chunk = stream.read(8096)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        copied += len(chunk)
+        while True:
+            start_pos = buffer.find(JPEG_START)
+            if start_pos == -1:
+                break
+            end_pos = buffer.find(JPEG_END, start_pos + len(JPEG_START))
+            if end_pos == -1:
+                break
+            frame = bytes(buffer[start_pos:end_pos + len(JPEG_END)])
+            copied += len(frame)
+            remaining = len(buffer) - (end_pos + len(JPEG_END))
+            del buffer[:end_pos + len(JPEG_END)]
+            copied += remaining
+            frames += 1
+    return frames, copied
+
+
+def run_splitter(data, pipe_size, keep_frames):
+    stream = PipeLike(data, pipe_size)
+    splitter = JPEGFrameSplitter()
+    frames = kept = 0
+    while splitter.read_from(stream):
+        for frame in splitter.frames():
+            frames += 1
+            if keep_frames:
+                # What RTSPClient does when the frame must outlive the buffer
+                kept += len(bytes(frame))
+    return frames, splitter.bytes_copied + kept
+
+
+def report(name, data, fn):
+    start = time.perf_counter()
+    frames, copied = fn()
+    elapsed = time.perf_counter() - start
+    fps = frames / elapsed if elapsed else float('inf')
+    print(f"{name:<28} frames={frames:<6} frames/s={fps:>12,.0f} "
+          f"bytes copied/frame={copied / max(frames, 1):>10,.0f} ({len(data) / elapsed / 1e6:,.0f} MB/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', help="Recorded MJPEG file (ffmpeg -f mjpeg output)")
+    parser.add_argument('--synthetic', type=int, default=0, help="Generate N synthetic frames instead of reading a file")
+    parser.add_argument('--pipe-size', type=int, default=64 * 1024, help="Max bytes returned per read (Linux pipe default is 64 KiB)")
+    args = parser.parse_args()
+
+    if args.path:
+        with open(args.path, 'rb') as f:
+            data = f.read()
+    else:
+        data = synthetic_mjpeg(args.synthetic or 1000)
+
+    print(f"Input: {len(data):,} bytes, pipe reads of {args.pipe_size:,} bytes")
+    report("legacy bytearray loop", data, lambda: run_legacy(data, args.pipe_size))
+    report("splitter (views only)", data, lambda: run_splitter(data, args.pipe_size, keep_frames=False))
+    report("splitter (+copy per frame)", data, lambda: run_splitter(data, args.pipe_size, keep_frames=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Compare the threaded RTSPClient with the asyncio ingest mode (AsyncRTSPClient).
+
+Each test stream is fed by benchmarks/fake_mjpeg_source.py instead of FFmpeg and has
+one channel in its group that drains frames like an RTSPConsumer would. Face
+detection is disabled so only the ingest and fan-out path is measured.
+
+Usage:
+    python benchmarks/bench_ingest_modes.py --streams 10 50 100 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsppy.settings')
+
+import django
+
+django.setup()
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from stream.utils.rtsp_client import RTSPClient
+from stream.utils.async_rtsp_client import AsyncRTSPClient
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+logging.disable(logging.INFO)
+
+# Frames go through the channel layer here, bench_frame_hub.py compares that with the frame hub
+settings.RTSP_FRAME_FANOUT = 'channel_layer'
+
+
+def fake_command(fps, frame_size):
+    def _ffmpeg_command(self, transport):
+        return [sys.executable, FAKE_SOURCE, '--fps', str(fps), '--frame-size', str(frame_size)]
+    return _ffmpeg_command
+
+
+async def drain(channel_layer, channel, counter):
+    while True:
+        message = await channel_layer.receive(channel)
+        if message['type'] == 'stream_frame':
+            counter[0] += 1
+
+
+async def run_mode(client_class, streams, duration, warmup, fps, frame_size):
+    channel_layer = get_channel_layer()
+    client_class = type(client_class.__name__, (client_class,), {'_ffmpeg_command': fake_command(fps, frame_size)})
+
+    clients, drains, counter = [], [], [0]
+    for i in range(streams):
+        group = f'bench_{client_class.__name__}_{i}'
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(group, channel)
+        drains.append(asyncio.create_task(drain(channel_layer, channel, counter)))
+        client = client_class(str(i), 'fake://', group, analyzer='none')  # ingest only
+        client.start()
+        clients.append(client)
+
+    await asyncio.sleep(warmup)
+    counter[0] = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.sleep(duration)
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    frames = counter[0]
+    threads = threading.active_count()
+
+    for client in clients:
+        client._stop_stream()
+    for task in drains:
+        task.cancel()
+    await asyncio.sleep(1.5)
+
+    return {
+        'frames_per_s': frames / wall,
+        'expected_per_s': streams * fps,
+        'cpu_percent': 100 * cpu / wall,
+        'cpu_ms_per_frame': 1000 * cpu / max(frames, 1),
+        'threads': threads,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=4, help="Seconds to wait for the connect probe and first frames")
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--frame-size', type=int, default=30_000)
+    args = parser.parse_args()
+
+    for streams in args.streams:
+        for name, client_class in (('thread', RTSPClient), ('asyncio', AsyncRTSPClient)):
+            result = await run_mode(client_class, streams, args.duration, args.warmup, args.fps, args.frame_size)
+            print(f"streams={streams:<4} mode={name:<8} "
+                  f"delivered={result['frames_per_s']:>7.1f}/{result['expected_per_s']:.0f} fps  "
+                  f"cpu={result['cpu_percent']:>6.1f}%  cpu/frame={result['cpu_ms_per_frame']:.3f} ms  "
+                  f"threads={result['threads']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Where a frame's time goes: the latency tracer's per-stage breakdown for one ingest mode.
+
+Plays the sample video in real time in place of the RTSP input, with the rest of the
+real FFmpeg command line, and watches it with a viewer that connects with ?trace=1,
+acks every frame and echoes the traced ones after --render-ms (standing in for the
+browser drawing the frame). Then prints the stages from /api/streams/<id>/latency/,
+all of which must have samples (detection only with --analyzer).
+
+Needs ffmpeg on PATH and a migrated database.
+
+Usage:
+    python benchmarks/bench_latency_trace.py --mode asyncio --fanout channel_layer --duration 8
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import sys
+
+from common import SAMPLE_VIDEO, setup_django
+
+
+def local_input(command):
+    """The client's FFmpeg command with the RTSP input replaced by the sample video played in real time"""
+    command = list(command)
+    # nobuffer is for live input, with a file read at -re pace it can stall FFmpeg's start
+    for option in ('-rtsp_transport', '-fflags'):
+        i = command.index(option)
+        del command[i:i + 2]
+    i = command.index('-i')
+    command[i:i + 2] = ['-re', '-stream_loop', '-1', '-i', SAMPLE_VIDEO]
+    return command
+
+
+async def watch(communicator, until, render_s):
+    """Ack every frame, echo traced frames `render_s` after they arrive; returns (frames, echoes)"""
+    loop = asyncio.get_running_loop()
+    frames = echoes = 0
+    traced = None
+    while loop.time() < until:
+        try:
+            # Not receive_output(): its timeout cancels the application
+            message = await asyncio.wait_for(communicator.output_queue.get(), max(0.01, until - loop.time()))
+        except asyncio.TimeoutError:
+            break
+        if message.get('bytes') is not None:
+            frames += 1
+            await communicator.send_json_to({'type': 'ack'})
+            if traced is not None:
+                await asyncio.sleep(render_s)
+                await communicator.send_json_to({'type': 'ping', 'trace': traced})
+                traced, echoes = None, echoes + 1
+        elif message.get('text'):
+            data = json.loads(message['text'])
+            if data.get('type') == 'trace':
+                traced = data['seq']
+    return frames, echoes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['thread', 'asyncio', 'process'], default='thread')
+    parser.add_argument('--fanout', choices=['hub', 'channel_layer'], default='hub')
+    parser.add_argument('--analyzer', default='haar')
+    parser.add_argument('--duration', type=float, default=8)
+    parser.add_argument('--sample-every', type=int, default=5)
+    parser.add_argument('--render-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = args.mode
+    os.environ['RTSP_FRAME_FANOUT'] = args.fanout
+    os.environ['LATENCY_TRACE_SAMPLE_EVERY'] = str(args.sample_every)
+    setup_django()
+    logging.disable(logging.WARNING)
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from django.test import Client
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+    from stream.utils.rtsp_client import RTSPClient
+
+    command = RTSPClient._ffmpeg_command
+    RTSPClient._ffmpeg_command = lambda self, transport, outputs=None: local_input(command(self, transport, outputs))
+
+    stream = await sync_to_async(Stream.objects.create)(name='trace-bench', url='rtsp://camera', analyzer=args.analyzer)
+    stream_id = str(stream.id)
+    communicator = WebsocketCommunicator(application, f'/ws/stream/{stream_id}/?overlay=sidecar&trace=1')
+    communicator.scope['client'] = ('127.0.0.1', 1)
+    try:
+        await communicator.connect()
+        loop = asyncio.get_running_loop()
+        frames, echoes = await watch(communicator, loop.time() + args.duration, args.render_ms / 1000)
+        if args.mode == 'process':
+            await asyncio.sleep(2.5)    # The worker's stages come with its next stats message
+        response = await sync_to_async(Client().get)(f'/api/streams/{stream_id}/latency/')
+        report = response.json()
+    finally:
+        await communicator.disconnect()
+        if stream_id in active_streams:
+            active_streams[stream_id]._stop_stream()
+        await asyncio.sleep(1.5)
+        await sync_to_async(stream.delete)()
+
+    print(f"{args.mode}/{args.fanout}: viewer got {frames} frames, echoed {echoes}, 1 in {report['sample_every']} traced")
+    print(f"{'stage':<10} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for stage, values in report['stages'].items():
+        print(f"{stage:<10} {values['count']:>6} {values['p50_ms']:>8} {values['p95_ms']:>8} {values['p99_ms']:>8} {values['max_ms']:>8}")
+
+    expected = ['read', 'split', 'process', 'publish', 'hop', 'send', 'client']
+    if args.analyzer != 'none':
+        expected.append('detection')
+    missing = [stage for stage in expected if stage not in report['stages']]
+    print(f"FAILED: no samples for {missing}" if missing else "OK")
+    gc.collect()    # close the stopped FFmpeg transports while the loop still runs
+    return not missing
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
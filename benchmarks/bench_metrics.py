@@ -0,0 +1,183 @@
+"""
+Cost of the metrics instrumentation, and a scrape of /metrics for a running stream.
+
+First times what every frame costs in the ingest and send paths (the frame counter
+and fps average, the byte count, a send latency observation) against an empty loop,
+and how long rendering the exposition takes for --streams streams.
+
+Then plays the sample video in real time in place of the RTSP input, with the rest
+of the real FFmpeg command line, watches it with one acking WebSocket viewer and
+scrapes /metrics: every sample line must parse, and the stream's frame, byte, send
+and FFmpeg start counters must have moved.
+
+Needs ffmpeg on PATH and a migrated database.
+
+Usage:
+    python benchmarks/bench_metrics.py --mode process --duration 5
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import re
+import sys
+import time
+
+from common import SAMPLE_VIDEO, setup_django
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? \S+$')
+
+
+def local_input(command):
+    """The client's FFmpeg command with the RTSP input replaced by the sample video played in real time"""
+    command = list(command)
+    # nobuffer is for live input, with a file read at -re pace it can stall FFmpeg's start
+    for option in ('-rtsp_transport', '-fflags'):
+        i = command.index(option)
+        del command[i:i + 2]
+    i = command.index('-i')
+    command[i:i + 2] = ['-re', '-stream_loop', '-1', '-i', SAMPLE_VIDEO]
+    return command
+
+
+def parse(text):
+    """{(name, labels text): value} of an exposition, raises on a malformed line"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        if not SAMPLE_LINE.match(line):
+            raise ValueError(f"Malformed sample line: {line!r}")
+        name_labels, value = line.rsplit(' ', 1)
+        name, _, labels = name_labels.partition('{')
+        samples[(name, labels.rstrip('}'))] = float(value)
+    return samples
+
+
+def bench_overhead(frames, streams):
+    from stream.utils.metrics import StreamMetrics, render_metrics
+
+    metrics = StreamMetrics('bench')
+    started = time.perf_counter()
+    for i in range(frames):
+        now = time.time()
+    empty = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(frames):
+        now = time.time()
+        metrics.frame(now)
+        metrics.bytes_total += 40000
+        metrics.send_latency.observe(0.0004)
+        metrics.frames_sent_total += 1
+    instrumented = time.perf_counter() - started
+    print(f"per frame: {1e9 * (instrumented - empty) / frames:.0f} ns of instrumentation "
+          f"({frames} frames, loop alone {1e9 * empty / frames:.0f} ns)")
+
+    from stream.utils import metrics as metrics_module
+    for i in range(streams):
+        m = metrics_module.stream_metrics(f'bench-{i}')
+        m.frame(time.time())
+        m.detection_latency.observe(0.02)
+    started = time.perf_counter()
+    text = render_metrics({})
+    elapsed = time.perf_counter() - started
+    print(f"render: {1000 * elapsed:.1f} ms for {streams} streams, {len(text) / 1024:.0f} KiB")
+    parse(text)
+    with metrics_module._lock:
+        for i in range(streams):
+            metrics_module._stream_metrics.pop(f'bench-{i}', None)
+
+
+async def bench_scrape(duration):
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from django.test import Client
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+
+    stream = await sync_to_async(Stream.objects.create)(name='metrics-bench', url='rtsp://camera', analyzer='haar')
+    stream_id = str(stream.id)
+    communicator = WebsocketCommunicator(application, f'/ws/stream/{stream_id}/?overlay=sidecar')
+    communicator.scope['client'] = ('127.0.0.1', 1)
+    loop = asyncio.get_running_loop()
+    received = 0
+    try:
+        await communicator.connect()
+        until = loop.time() + duration
+        while loop.time() < until:
+            try:
+                # Not receive_output(): its timeout cancels the application
+                message = await asyncio.wait_for(communicator.output_queue.get(), max(0.01, until - loop.time()))
+            except asyncio.TimeoutError:
+                break
+            if message.get('bytes') is not None:
+                received += 1
+                await communicator.send_json_to({'type': 'ack'})
+
+        started = time.perf_counter()
+        response = await sync_to_async(Client().get)('/metrics')
+        elapsed = time.perf_counter() - started
+        text = response.content.decode()
+    finally:
+        await communicator.disconnect()
+        # Deleting through the API stops the stream and drops its metrics
+        deleted = await sync_to_async(Client().delete)(f'/api/streams/{stream_id}/')
+        await asyncio.sleep(1.5)
+        if deleted.status_code != 204:
+            await sync_to_async(stream.delete)()
+    after_delete = (await sync_to_async(Client().get)('/metrics')).content.decode()
+
+    samples = parse(text)
+    label = f'stream="{stream_id}"'
+    values = {name: value for (name, labels), value in samples.items() if labels == label}
+    print(f"scrape: HTTP {response.status_code} {response['Content-Type']!r} in {1000 * elapsed:.1f} ms, "
+          f"{len(samples)} samples; viewer got {received} frames")
+    for name in ('rtsp_stream_frames_total', 'rtsp_stream_ffmpeg_bytes_total', 'rtsp_stream_frames_sent_total',
+                 'rtsp_stream_frames_dropped_total', 'rtsp_stream_ingest_fps', 'rtsp_stream_ffmpeg_starts_total',
+                 'rtsp_stream_first_frame_seconds_sum', 'rtsp_stream_detection_latency_seconds_count',
+                 'rtsp_stream_send_latency_seconds_count'):
+        print(f"  {name} = {values.get(name)}")
+
+    failures = []
+    if response.status_code != 200:
+        failures.append(f"/metrics returned {response.status_code}")
+    for name in ('rtsp_stream_frames_total', 'rtsp_stream_ffmpeg_bytes_total', 'rtsp_stream_frames_sent_total',
+                 'rtsp_stream_ingest_fps', 'rtsp_stream_ffmpeg_starts_total'):
+        if not values.get(name):
+            failures.append(f"{name} did not move")
+    if stream_id in active_streams:
+        failures.append("the deleted stream is still running")
+    if label in after_delete:
+        failures.append("/metrics still reports the deleted stream")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['thread', 'asyncio', 'process'], default='thread')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--streams', type=int, default=100)
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = args.mode
+    setup_django()
+    logging.disable(logging.WARNING)
+    from stream.utils.rtsp_client import RTSPClient
+
+    bench_overhead(args.frames, args.streams)
+
+    command = RTSPClient._ffmpeg_command
+    RTSPClient._ffmpeg_command = lambda self, transport, outputs=None: local_input(command(self, transport, outputs))
+    failures = await bench_scrape(args.duration)
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    gc.collect()    # close the stopped FFmpeg transports while the loop still runs
+    return not failures
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
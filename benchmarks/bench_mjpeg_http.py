@@ -0,0 +1,162 @@
+"""
+MJPEG-over-HTTP viewers of one stream: shared FFmpeg, stale-frame dropping, cleanup.
+
+Drives GET /api/streams/<id>/mjpeg/ through the Django ASGI app (no server or
+socket): --viewers fast readers and one slow reader whose send takes --slow-ms,
+as a client on a bad link would make a server with flow control wait. FFmpeg is
+replaced by benchmarks/fake_mjpeg_source.py looping the sample video.
+
+Checks that all viewers share one FFmpeg process, that the slow reader gets
+fewer but current frames (its lag, in frames behind the newest, stays small
+instead of growing), and that the stream has no viewers left after they all
+disconnect.
+
+Usage:
+    python benchmarks/bench_mjpeg_http.py --viewers 20 --seconds 5 --slow-ms 300
+    python benchmarks/bench_mjpeg_http.py --fanout channel_layer
+
+Needs a migrated database (python manage.py migrate).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+
+from common import ROOT, load_sample_frames, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+class Viewer:
+    """An HTTP client talking ASGI to the app, recording which sample frames it got"""
+
+    def __init__(self, app, path, frame_index, client, delay=0.0):
+        self.app = app
+        self.path = path
+        self.frame_index = frame_index
+        self.client = client
+        self.delay = delay
+        self.status = None
+        self.content_type = None
+        self.frames = 0
+        self.lags = []
+        self._buffer = b''
+        self._disconnect = asyncio.Event()
+
+    async def run(self):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': self.path, 'raw_path': self.path.encode(), 'query_string': b'',
+            'headers': [(b'host', b'127.0.0.1')], 'client': ('127.0.0.1', 1), 'server': ('127.0.0.1', 8000),
+        }
+        await self.app(scope, self.receive, self.send)
+
+    async def receive(self):
+        if not hasattr(self, '_requested'):
+            self._requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self._disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.content_type = {name.lower(): value for name, value in message['headers']}.get(b'content-type', b'').decode()
+            return
+        # Django sends a multipart part in chunks of at most 64 KiB
+        self._buffer += message.get('body', b'')
+        while b'\r\n\r\n' in self._buffer:
+            header, _, rest = self._buffer.partition(b'\r\n\r\n')
+            length = int(header.rsplit(b'Content-Length: ', 1)[1])
+            if len(rest) < length + 2:
+                return
+            self._on_frame(rest[:length])
+            self._buffer = rest[length + 2:]
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    def _on_frame(self, frame):
+        index = self.frame_index.get(frame)
+        if index is not None:
+            self.lags.append((self.client().frame_seq - 1 - index) % len(self.frame_index))
+        self.frames += 1
+
+    def disconnect(self):
+        self._disconnect.set()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--viewers', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--slow-ms', type=float, default=300)
+    parser.add_argument('--fanout', choices=['hub', 'channel_layer'], default='hub')
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = 'asyncio'
+    os.environ['RTSP_FRAME_FANOUT'] = args.fanout
+    setup_django()
+    logging.disable(logging.WARNING)
+    from asgiref.sync import sync_to_async
+    from django.core.asgi import get_asgi_application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+    from stream.utils.async_rtsp_client import AsyncRTSPClient
+
+    ffmpeg_starts = []
+
+    def fake_command(self, transport):
+        ffmpeg_starts.append(transport)
+        return [sys.executable, FAKE_SOURCE, '--fps', '15', '--sample']
+    AsyncRTSPClient._ffmpeg_command = fake_command
+
+    frame_index = {frame: i for i, frame in enumerate(load_sample_frames(100))}
+    stream = await sync_to_async(Stream.objects.create)(name='mjpeg-bench', url='rtsp://fake', analyzer='none')
+    stream_id = str(stream.id)
+    app = get_asgi_application()
+    path = f'/api/streams/{stream_id}/mjpeg/'
+    client = lambda: active_streams[stream_id]
+    viewers = [Viewer(app, path, frame_index, client) for _ in range(args.viewers)]
+    slow = Viewer(app, path, frame_index, client, delay=args.slow_ms / 1000)
+
+    failures = []
+    try:
+        tasks = [asyncio.create_task(viewer.run()) for viewer in viewers + [slow]]
+        await asyncio.sleep(args.seconds)
+        viewer_count = client().client_count
+        for viewer in viewers + [slow]:
+            viewer.disconnect()
+        await asyncio.wait_for(asyncio.gather(*tasks), 10)
+        await asyncio.sleep(0.5)    # MJPEGStream.close() leaves the stream on the event loop
+
+        fast_fps = [viewer.frames / args.seconds for viewer in viewers]
+        print(f"{args.viewers} fast viewers + 1 slow: {len(ffmpeg_starts)} FFmpeg process(es), "
+              f"{viewer_count} viewers counted, content-type {viewers[0].content_type!r}")
+        print(f"fast: median {statistics.median(fast_fps):.1f} fps, "
+              f"lag median {statistics.median(viewers[0].lags or [0])} max {max(viewers[0].lags or [0])} frames")
+        print(f"slow: {slow.frames / args.seconds:.1f} fps at {args.slow_ms:.0f} ms per send, "
+              f"lag median {statistics.median(slow.lags or [0])} max {max(slow.lags or [0])} frames")
+        print(f"after disconnect: {client().client_count} viewers")
+
+        if len(ffmpeg_starts) != 1:
+            failures.append("viewers did not share one FFmpeg process")
+        if viewer_count != args.viewers + 1 or client().client_count != 0:
+            failures.append("viewer reference counting is off")
+        if not slow.lags or max(slow.lags) > 2:
+            failures.append("the slow viewer fell behind instead of skipping frames")
+        if any(viewer.status != 200 for viewer in viewers):
+            failures.append("a viewer did not get 200")
+    finally:
+        if stream_id in active_streams:
+            active_streams[stream_id]._stop_stream()
+        await sync_to_async(stream.delete)()
+        await asyncio.sleep(1)
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    return not failures
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,180 @@
+"""
+MJPEG transcoding vs H.264 passthrough: FFmpeg CPU and bytes sent per viewer.
+
+A local H.264 file (the sample video re-encoded with a 1 s GOP, standing in for a
+camera) is played in real time in place of the RTSP input, with the rest of each
+mode's real FFmpeg command line. One WebSocket viewer per mode acks every message.
+
+mjpeg:       decode, scale to 640 px and re-encode as JPEG (Stream.delivery='mjpeg')
+passthrough: remux with -c copy into fragmented MP4, plus the keyframe-only analysis
+             branch when --analyzer is set
+
+Also checks what a late joiner of the passthrough stream gets first: the codec
+announcement, the cached init segment, then a fragment starting with a keyframe.
+
+Needs ffmpeg (with libx264 to prepare the source) on PATH and a migrated database.
+
+Usage:
+    python benchmarks/bench_passthrough.py --duration 10 --analyzer haar
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import SAMPLE_VIDEO, setup_django
+
+
+def process_cpu_seconds(pid):
+    """utime + stime of one process from /proc, children not included"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except FileNotFoundError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def prepare_source(directory):
+    path = os.path.join(directory, 'camera.mp4')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-i', SAMPLE_VIDEO, '-an', '-c:v', 'libx264',
+                    '-preset', 'veryfast', '-g', '25', '-keyint_min', '25', '-sc_threshold', '0', path], check=True)
+    return path
+
+
+def local_input(command, path):
+    """The client's FFmpeg command with the RTSP input replaced by `path` played in real time"""
+    command = list(command)
+    if '-rtsp_transport' in command:
+        i = command.index('-rtsp_transport')
+        del command[i:i + 2]
+    i = command.index('-i')
+    command[i:i + 2] = ['-re', '-stream_loop', '-1', '-i', path]
+    return command
+
+
+async def watch(communicator, until, result):
+    """Receive as a viewer until `until` (loop time), acking every binary message"""
+    loop = asyncio.get_running_loop()
+    while loop.time() < until:
+        try:
+            # Not receive_output(): its timeout cancels the application
+            message = await asyncio.wait_for(communicator.output_queue.get(), max(0.01, until - loop.time()))
+        except asyncio.TimeoutError:
+            break
+        if message.get('bytes') is not None:
+            result['bytes'] += len(message['bytes'])
+            result['messages'] += 1
+            result.setdefault('first', []).append(('bytes', message['bytes']))
+            await communicator.send_json_to({'type': 'ack'})
+        elif message.get('text'):
+            result.setdefault('first', []).append(('text', json.loads(message['text'])))
+            if json.loads(message['text']).get('type') == 'viewer_stats':
+                result['stats'] = json.loads(message['text'])
+
+
+async def run_mode(delivery, analyzer, duration, warmup):
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+
+    stream = await sync_to_async(Stream.objects.create)(
+        name=f'bench-{delivery}', url='rtsp://camera', analyzer=analyzer, delivery=delivery)
+    stream_id = str(stream.id)
+    communicator = WebsocketCommunicator(application, f'/ws/stream/{stream_id}/?overlay=sidecar')
+    communicator.scope['client'] = ('127.0.0.1', 1)
+    loop = asyncio.get_running_loop()
+    result = {'bytes': 0, 'messages': 0}
+    try:
+        await communicator.connect()
+        await watch(communicator, loop.time() + warmup, {'bytes': 0, 'messages': 0})
+        client = active_streams[stream_id]
+        pids = [client.process.pid]
+        analysis = getattr(client, 'analysis', None)
+        if analysis and analysis.process:
+            pids.append(analysis.process.pid)
+        cpu_before = sum(map(process_cpu_seconds, pids))
+        started = time.monotonic()
+        await watch(communicator, loop.time() + duration, result)
+        elapsed = time.monotonic() - started
+        result['cpu'] = 100 * (sum(map(process_cpu_seconds, pids)) - cpu_before) / elapsed
+        result['kbps'] = 8 * result['bytes'] / elapsed / 1000
+        result['rate'] = result['messages'] / elapsed
+        result['client'] = client.stats()
+
+        if delivery == 'passthrough':
+            late = WebsocketCommunicator(application, f'/ws/stream/{stream_id}/?overlay=sidecar')
+            late.scope['client'] = ('127.0.0.1', 2)
+            joined = loop.time()
+            await late.connect()
+            late_result = {'bytes': 0, 'messages': 0}
+            while late_result['messages'] < 2 and loop.time() - joined < 5:
+                await watch(late, loop.time() + 0.05, late_result)
+            result['late_ms'] = 1000 * (loop.time() - joined)
+            result['late'] = late_result.get('first', [])
+            await late.disconnect()
+    finally:
+        await communicator.disconnect()
+        if stream_id in active_streams:
+            active_streams[stream_id]._stop_stream()
+        await asyncio.sleep(1)
+        await sync_to_async(stream.delete)()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--analyzer', default='none', help="Stream analyzer for both modes, e.g. haar")
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = 'asyncio'
+    setup_django()
+    logging.disable(logging.WARNING)
+    from stream.utils.async_rtsp_client import AsyncRTSPClient
+    from stream.utils.fmp4 import default_sample_flags, fragment_starts_with_keyframe, is_init_segment
+    from stream.utils.passthrough import PassthroughRTSPClient
+
+    directory = tempfile.mkdtemp(prefix='bench-passthrough-')
+    source = prepare_source(directory)
+    for client_class in (AsyncRTSPClient, PassthroughRTSPClient):
+        command = client_class._ffmpeg_command
+        client_class._ffmpeg_command = lambda self, transport, command=command: local_input(command(self, transport), source)
+
+    failures = []
+    for delivery in ('mjpeg', 'passthrough'):
+        result = await run_mode(delivery, args.analyzer, args.duration, args.warmup)
+        analysis = (result['client'].get('passthrough') or {}).get('analysis')
+        detection = result['client'].get('detection') or {}
+        print(f"{delivery:<12} ffmpeg cpu={result['cpu']:5.1f}%  to viewer={result['kbps']:7.0f} kbit/s "
+              f"({result['rate']:.1f} msg/s)  analysis={analysis or detection.get('frames_submitted', '-')}")
+        if delivery == 'passthrough':
+            late = result['late']
+            kinds = [kind for kind, _ in late[:4]]
+            init = next((data for kind, data in late if kind == 'bytes' and is_init_segment(data)), None)
+            fragments = [data for kind, data in late if kind == 'bytes' and not is_init_segment(data)]
+            keyframe = fragments and fragment_starts_with_keyframe(fragments[0], default_sample_flags(init or b''))
+            announcement = next((data for kind, data in late if kind == 'text' and data.get('type') == 'passthrough'), {})
+            print(f"late joiner: {kinds} in {result['late_ms']:.0f} ms, mime={announcement.get('mime')!r}, "
+                  f"first fragment keyframe={bool(keyframe)}")
+            if init is None or not fragments or not keyframe:
+                failures.append("late joiner did not get the init segment and a keyframe fragment first")
+            if result['messages'] == 0:
+                failures.append("passthrough viewer got no fragments")
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    gc.collect()    # close the stopped FFmpeg transports while the loop still runs
+    return not failures
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
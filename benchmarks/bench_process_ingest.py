@@ -0,0 +1,131 @@
+"""
+Event loop health with the asyncio ingest mode vs process-per-stream ingest.
+
+Every stream is fed real sample frames by benchmarks/fake_mjpeg_source.py --sample
+(in place of FFmpeg) and runs face detection, and one viewer per stream pulls frames
+from the frame hub. Meanwhile a probe task sleeps 10 ms in a loop on the same event
+loop and records how late it wakes up: that lateness is what every WebSocket of the
+server sees on top of its own work.
+
+asyncio: ingest and detection share this process (and its GIL) with the event loop.
+process: each stream runs in an ingest worker (ProcessRTSPClient), only the copy out
+         of the shared-memory ring and the fan-out happen here.
+
+CPU is reported for this process and, in process mode, for the workers (sources
+excluded in both modes).
+
+Usage:
+    python benchmarks/bench_process_ingest.py --streams 1 4 --duration 15 --analyzer mtcnn
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+from common import ROOT, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+def process_cpu_seconds(pid):
+    """utime + stime of one process from /proc, children not included"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def probe_loop_lag(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def view(channel, counter):
+    version = 0
+    while True:
+        frame = await channel.next_frame(version)
+        version = frame.version
+        counter[0] += 1
+
+
+async def run_mode(client_class, streams, duration, warmup, fps, analyzer):
+    from stream.utils.frame_hub import get_frame_hub
+
+    def _ffmpeg_command(self, transport):
+        return [sys.executable, FAKE_SOURCE, '--fps', str(fps), '--sample']
+    client_class = type(client_class.__name__, (client_class,), {'_ffmpeg_command': _ffmpeg_command})
+
+    hub = get_frame_hub()
+    clients, viewers, counter = [], [], [0]
+    for i in range(streams):
+        stream_id = f'bench_{client_class.__name__}_{i}'
+        channel = hub.channel(stream_id)
+        channel.subscribe()
+        viewers.append(asyncio.create_task(view(channel, counter)))
+        client = client_class(stream_id, 'fake://', f'group_{stream_id}', analyzer=analyzer)
+        client.start()
+        clients.append(client)
+
+    await asyncio.sleep(warmup)
+    workers = [client.worker.pid for client in clients if getattr(client, 'worker', None)]
+    lags, stop = [], asyncio.Event()
+    counter[0] = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    workers_start = sum(process_cpu_seconds(pid) for pid in workers)
+    probe = asyncio.create_task(probe_loop_lag(lags, stop))
+    await asyncio.sleep(duration)
+    stop.set()
+    await probe
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    workers_cpu = sum(process_cpu_seconds(pid) for pid in workers) - workers_start
+    frames = counter[0]
+
+    for client in clients:
+        client._stop_stream()
+    for task in viewers:
+        task.cancel()
+    await asyncio.sleep(3)
+
+    lags_ms = sorted(1000 * lag for lag in lags)
+    return {
+        'frames_per_s': frames / wall,
+        'expected_per_s': streams * fps,
+        'lag_p50_ms': statistics.median(lags_ms),
+        'lag_p99_ms': lags_ms[int(0.99 * (len(lags_ms) - 1))],
+        'lag_max_ms': lags_ms[-1],
+        'cpu_percent': 100 * cpu / wall,
+        'workers_cpu_percent': 100 * workers_cpu / wall,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=8, help="Seconds for worker start, connect probe and model load")
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--analyzer', default='mtcnn', help="Stream analyzer backend, 'none' for ingest only")
+    args = parser.parse_args()
+
+    setup_django()
+    logging.disable(logging.WARNING)
+    from stream.utils.async_rtsp_client import AsyncRTSPClient
+    from stream.utils.process_rtsp_client import ProcessRTSPClient
+
+    for streams in args.streams:
+        for name, client_class in (('asyncio', AsyncRTSPClient), ('process', ProcessRTSPClient)):
+            result = await run_mode(client_class, streams, args.duration, args.warmup, args.fps, args.analyzer)
+            print(f"streams={streams:<3} mode={name:<8} "
+                  f"delivered={result['frames_per_s']:>6.1f}/{result['expected_per_s']:.0f} fps  "
+                  f"loop lag p50={result['lag_p50_ms']:.2f} p99={result['lag_p99_ms']:.2f} "
+                  f"max={result['lag_max_ms']:.1f} ms  "
+                  f"cpu here={result['cpu_percent']:.0f}% workers={result['workers_cpu_percent']:.0f}%")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,186 @@
+"""
+Quality ladder: one decode, extra renditions only while watched, switches without a gap.
+
+The sample video is played in real time in place of the RTSP input, with the rest
+of the real FFmpeg command line. Viewer A watches the default rendition the whole
+time; viewer B joins with ?rendition=low, switches to high, then leaves.
+
+Reports per phase the FFmpeg CPU, the frame width each viewer gets, and A's
+longest gap between frames (the FFmpeg swap happens behind A's back). After B
+leaves, the extra rendition must stop being encoded once IDLE_S has passed.
+
+Needs ffmpeg on PATH and a migrated database.
+
+Usage:
+    python benchmarks/bench_renditions.py --mode thread --phase 6
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import struct
+import sys
+import time
+
+from common import SAMPLE_VIDEO, setup_django
+
+
+def process_cpu_seconds(pid):
+    """utime + stime of one process from /proc, children not included"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except FileNotFoundError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def jpeg_width(data):
+    """Width from the baseline SOF0 header of a JPEG, 0 if there is none"""
+    pos = data.find(b'\xff\xc0')
+    return struct.unpack_from('>H', data, pos + 7)[0] if pos != -1 and pos + 9 <= len(data) else 0
+
+
+def local_input(command):
+    """The client's FFmpeg command with the RTSP input replaced by the sample video played in real time"""
+    command = list(command)
+    # nobuffer is for live input, with a file read at -re pace it can stall FFmpeg's start
+    for option in ('-rtsp_transport', '-fflags'):
+        i = command.index(option)
+        del command[i:i + 2]
+    i = command.index('-i')
+    command[i:i + 2] = ['-re', '-stream_loop', '-1', '-i', SAMPLE_VIDEO]
+    return command
+
+
+class Viewer:
+    """A WebSocket viewer acking every frame and recording (arrival time, width)"""
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.frames = []
+        self.messages = []
+        self.task = None
+
+    async def run(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message.get('bytes') is not None:
+                self.frames.append((time.monotonic(), jpeg_width(message['bytes'])))
+                await self.communicator.send_json_to({'type': 'ack'})
+            elif message.get('text'):
+                self.messages.append(message['text'])
+
+    def widths(self, since):
+        return sorted({width for at, width in self.frames if at >= since})
+
+    def max_gap(self, since):
+        times = [at for at, _ in self.frames if at >= since]
+        return max((b - a for a, b in zip(times, times[1:])), default=0.0)
+
+    def fps(self, since, until):
+        return sum(since <= at < until for at, _ in self.frames) / (until - since)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--phase', type=float, default=6, help="Seconds per phase")
+    parser.add_argument('--idle', type=float, default=3, help="IDLE_S for this run")
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = args.mode
+    setup_django()
+    logging.disable(logging.WARNING)
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from django.conf import settings
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+    from stream.utils.rtsp_client import RTSPClient
+
+    settings.RTSP_RENDITIONS['IDLE_S'] = args.idle
+    command = RTSPClient._ffmpeg_command
+    RTSPClient._ffmpeg_command = lambda self, transport, outputs=None: local_input(command(self, transport, outputs))
+
+    stream = await sync_to_async(Stream.objects.create)(name='renditions-bench', url='rtsp://camera', analyzer='none')
+    stream_id = str(stream.id)
+    path = f'/ws/stream/{stream_id}/?overlay=sidecar'
+    viewers = []
+
+    async def connect(query=''):
+        communicator = WebsocketCommunicator(application, path + query)
+        communicator.scope['client'] = ('127.0.0.1', len(viewers) + 1)
+        await communicator.connect()
+        viewer = Viewer(communicator)
+        viewer.task = asyncio.create_task(viewer.run())
+        viewers.append(viewer)
+        return viewer
+
+    async def phase(name, *viewers):
+        client = active_streams[stream_id]
+        started, pid = time.monotonic(), client.process.pid
+        cpu = process_cpu_seconds(pid)
+        await asyncio.sleep(args.phase)
+        if client.process and client.process.pid == pid:
+            cpu = 100 * (process_cpu_seconds(pid) - cpu) / args.phase
+            cpu_text = f"{cpu:5.1f}%"
+        else:
+            cpu_text = '  (swap)'
+        encoded = client.stats()['renditions']['encoded']
+        print(f"{name:<28} ffmpeg cpu={cpu_text} encoded={encoded}  " + "  ".join(
+            f"{label}: widths={viewer.widths(started + args.phase / 2)} {viewer.fps(started, time.monotonic()):.1f} fps"
+            for label, viewer in zip('AB', viewers)))
+        return started
+
+    failures = []
+    try:
+        a = await connect()
+        await asyncio.sleep(2)
+        await phase('A on default', a)
+
+        b = await connect('&rendition=low')
+        joined = time.monotonic()
+        await phase('B joins on low', a, b)
+        first_low = next((at for at, width in b.frames if width == 320), None)
+        print(f"  B's first low frame after {1000 * (first_low - joined):.0f} ms" if first_low else "  B got no low frame")
+        print(f"  A's longest gap while FFmpeg was swapped: {1000 * a.max_gap(joined):.0f} ms")
+        if not first_low:
+            failures.append("no frames of the low rendition")
+        if a.max_gap(joined) > 0.5:
+            failures.append("the default rendition stalled during the swap")
+
+        switched = time.monotonic()
+        await b.communicator.send_json_to({'type': 'rendition', 'name': 'high'})
+        await phase('B switches to high', a, b)
+        if 1280 not in b.widths(switched):
+            failures.append("no frames of the high rendition")
+
+        await phase('B on high', a, b)
+
+        b.task.cancel()
+        await b.communicator.disconnect()
+        left = time.monotonic()
+        await asyncio.sleep(args.idle + 1)
+        await phase('B left, after IDLE_S', a)
+        print(f"  A's longest gap since B left: {1000 * a.max_gap(left):.0f} ms")
+        if active_streams[stream_id].encoded_renditions:
+            failures.append("the unwatched rendition is still encoded")
+    finally:
+        for viewer in viewers:
+            viewer.task.cancel()
+            await viewer.communicator.disconnect()
+        if stream_id in active_streams:
+            active_streams[stream_id]._stop_stream()
+        await asyncio.sleep(1.5)
+        await sync_to_async(stream.delete)()
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    gc.collect()    # close the replaced FFmpeg transports while the loop still runs
+    return not failures
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
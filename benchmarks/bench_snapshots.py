@@ -0,0 +1,85 @@
+"""
+Snapshot endpoint for stream grids: cost of a thumbnail of a running stream.
+
+cold:    --requests concurrent requests for a stream that is not running, which
+         share one grab (FFmpeg replaced by benchmarks/fake_mjpeg_source.py
+         writing one sample frame); how long until all of them are answered.
+running: a thumbnail of a running stream's latest frame, first request (downscale)
+         vs cached requests within the TTL.
+
+Sharing the grab, the ETag revalidation and the cache's byte budget are covered
+by stream/tests/test_snapshots.py.
+
+Usage:
+    python benchmarks/bench_snapshots.py --requests 50 --width 160
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from common import ROOT, load_sample_frames, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(1e6 * (time.perf_counter() - started))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--width', type=int, default=160)
+    args = parser.parse_args()
+
+    setup_django()
+    logging.disable(logging.WARNING)
+    from stream.utils import snapshots as snapshots_module
+    from stream.utils.snapshots import Snapshots
+
+    snapshots_module.grab_command = lambda url, transport, max_width: [
+        sys.executable, FAKE_SOURCE, '--sample', '--count', '1']
+
+    # Cold: concurrent requesters share one grab
+    snapshots = Snapshots({'TTL_S': 1.0, 'COLD_TTL_S': 10.0, 'GRAB_TIMEOUT_S': 10.0})
+    cold_stream = SimpleNamespace(id='cold', url='rtsp://fake', last_transport='tcp')
+    barrier = threading.Barrier(args.requests)
+
+    def request():
+        barrier.wait()
+        snapshots.get(cold_stream, None, args.width)
+
+    threads = [threading.Thread(target=request) for _ in range(args.requests)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_ms = 1000 * (time.perf_counter() - started)
+    print(f"cold:    {args.requests} concurrent requests -> {snapshots.stats()['grabs_started']} grab(s), "
+          f"all answered in {elapsed_ms:.0f} ms")
+
+    # Running: thumbnail of the client's latest frame
+    frames = load_sample_frames(20)
+    client = SimpleNamespace(is_running=True, frame_channel=None, frame_buffer=frames[0])
+    running = SimpleNamespace(id='running', url='rtsp://fake', last_transport='tcp')
+    miss_us = timed(lambda: Snapshots({}).get(running, client, args.width), 20)
+    snapshots = Snapshots({'TTL_S': 60.0})
+    snapshot = snapshots.get(running, client, args.width)
+    hit_us = timed(lambda: snapshots.get(running, client, args.width), 2000)
+    print(f"running: {len(frames[0]) / 1024:.0f} KiB frame -> {len(snapshot.data) / 1024:.1f} KiB at width {args.width}  "
+          f"first request={miss_us:.0f} us  cached={hit_us:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
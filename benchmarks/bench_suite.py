@@ -0,0 +1,333 @@
+"""
+End-to-end benchmark suite of the streaming pipeline, runs without a camera.
+
+Every scenario runs in a fresh subprocess: it creates STREAMS streams, connects
+VIEWERS WebSocket viewers per stream through the Channels test communicator (each
+acks every frame, like the bundled UI) and lets the real ingest client run the
+stream's FFmpeg command line with the RTSP input replaced by a local source:
+
+testsrc: FFmpeg's testsrc2 pattern at 1280x720/25 fps, the real decode/scale/encode
+sample:  the bundled sample.mp4 in real time (has faces, for the detection scenarios)
+fake:    benchmarks/fake_mjpeg_source.py instead of FFmpeg, for many streams on one box
+
+Reported per scenario, as JSON: ingest and delivered frames/s, capture-to-viewer
+latency percentiles, frames dropped for busy viewers, CPU% of this process and its
+children (FFmpeg, ingest workers) and resident memory.
+
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json      # exit code 1 on a regression
+    python benchmarks/bench_suite.py --scenarios viewers-100 detect-haar --mode asyncio
+
+Frames reach viewers through the frame hub (RTSP_FRAME_FANOUT='hub'). Needs ffmpeg
+on PATH and a migrated database.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from common import ROOT, SAMPLE_VIDEO, rss_mb, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+SCENARIOS = {
+    # Fan-out: one stream, more and more viewers
+    'viewers-1': {'streams': 1, 'viewers': 1, 'source': 'testsrc', 'analyzer': 'none'},
+    'viewers-100': {'streams': 1, 'viewers': 100, 'source': 'testsrc', 'analyzer': 'none'},
+    'viewers-1000': {'streams': 1, 'viewers': 1000, 'source': 'testsrc', 'analyzer': 'none'},
+    # Ingest: more and more streams, one viewer each
+    'streams-10': {'streams': 10, 'viewers': 1, 'source': 'testsrc', 'analyzer': 'none'},
+    'streams-100': {'streams': 100, 'viewers': 1, 'source': 'fake', 'analyzer': 'none'},
+    # Detection off and on, on real faces
+    'detect-off': {'streams': 1, 'viewers': 1, 'source': 'sample', 'analyzer': 'none'},
+    'detect-haar': {'streams': 1, 'viewers': 1, 'source': 'sample', 'analyzer': 'haar'},
+    'detect-haar-10': {'streams': 10, 'viewers': 1, 'source': 'sample', 'analyzer': 'haar'},
+}
+
+# Metric -> (+1 if higher is better, -1 if lower is better, change ignored below this much)
+COMPARED = {
+    'ingest_fps': (1, 1.0),
+    'delivered_fps': (1, 1.0),
+    'latency_p50_ms': (-1, 2.0),
+    'latency_p95_ms': (-1, 5.0),
+    'latency_p99_ms': (-1, 10.0),
+    'cpu_percent': (-1, 5.0),
+    'rss_mb': (-1, 10.0),
+    'tree_rss_mb': (-1, 20.0),
+}
+
+
+def source_command(command, source):
+    """The client's FFmpeg command with the RTSP input replaced by `source`"""
+    if source == 'fake':
+        return [sys.executable, FAKE_SOURCE, '--fps', '15', '--frame-size', '30000']
+    command = list(command)
+    # nobuffer is for live input, with a local source read at -re pace it can stall FFmpeg's start
+    for option in ('-rtsp_transport', '-fflags'):
+        if option in command:
+            i = command.index(option)
+            del command[i:i + 2]
+    i = command.index('-i')
+    if source == 'testsrc':
+        command[i:i + 2] = ['-re', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25']
+    else:
+        command[i:i + 2] = ['-re', '-stream_loop', '-1', '-i', SAMPLE_VIDEO]
+    return command
+
+
+def process_tree():
+    """{pid: (ppid, cpu seconds, rss bytes)} of every process, from /proc"""
+    ticks, page = os.sysconf('SC_CLK_TCK'), os.sysconf('SC_PAGE_SIZE')
+    processes = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        processes[int(name)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks, int(fields[21]) * page)
+    return processes
+
+
+def tree_usage(root):
+    """(cpu seconds, rss bytes) of `root` and all its descendants"""
+    processes = process_tree()
+    children = {}
+    for pid, (ppid, _, _) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    cpu = rss = 0
+    pending = [root]
+    while pending:
+        pid = pending.pop()
+        if pid in processes:
+            cpu += processes[pid][1]
+            rss += processes[pid][2]
+        pending.extend(children.get(pid, ()))
+    return cpu, rss
+
+
+def percentile(samples, p):
+    return round(1000 * samples[min(len(samples) - 1, int(p * len(samples)))], 1) if samples else None
+
+
+class Viewer:
+    """A WebSocket viewer acking every frame, recording how long after capture each frame arrived"""
+
+    def __init__(self, communicator, captured):
+        self.communicator = communicator
+        self.captured = captured
+        self.frames = 0
+        self.latencies = []
+        self.measuring = False
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            data = message.get('bytes')
+            if data is None:
+                continue
+            await self.communicator.send_json_to({'type': 'ack'})
+            if not self.measuring:
+                continue
+            self.frames += 1
+            captured_at = self.captured.get(id(data))
+            if captured_at is not None:
+                self.latencies.append(time.time() - captured_at)
+
+
+async def run_scenario(scenario, duration, warmup):
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+    from stream.utils.frame_hub import FrameChannel
+    from stream.utils.metrics import stream_metrics
+    from stream.utils.rtsp_client import RTSPClient
+
+    command = RTSPClient._ffmpeg_command
+    RTSPClient._ffmpeg_command = lambda self, transport, outputs=None: source_command(
+        command(self, transport, outputs), scenario['source'])
+
+    # Capture time of every published frame by the identity of its bytes, which reach
+    # the communicator's output queue as the same object
+    captured = {}
+    publish = FrameChannel.publish
+
+    def recording_publish(self, data, annotated=None, seq=0, captured_at=None):
+        captured[id(data)] = captured_at
+        if len(captured) > 4096:
+            del captured[next(iter(captured))]
+        return publish(self, data, annotated, seq, captured_at)
+
+    FrameChannel.publish = recording_publish
+
+    streams = [
+        await sync_to_async(Stream.objects.create)(name=f'suite-{i}', url=f'rtsp://bench/{i}', analyzer=scenario['analyzer'])
+        for i in range(scenario['streams'])
+    ]
+    viewers = []
+    base_rss = rss_mb()
+    try:
+        for stream in streams:
+            for _ in range(scenario['viewers']):
+                communicator = WebsocketCommunicator(application, f'/ws/stream/{stream.id}/?overlay=sidecar')
+                communicator.scope['client'] = ('127.0.0.1', len(viewers) + 1)
+                await communicator.connect(timeout=30)
+                viewers.append(Viewer(communicator, captured))
+        await asyncio.sleep(warmup)
+
+        metrics = [stream_metrics(str(stream.id)) for stream in streams]
+        frames_before = sum(m.frames_total for m in metrics)
+        dropped_before = sum(m.frames_dropped_total for m in metrics)
+        cpu_before, _ = tree_usage(os.getpid())
+        for viewer in viewers:
+            viewer.measuring = True
+        started = time.monotonic()
+        await asyncio.sleep(duration)
+        for viewer in viewers:
+            viewer.measuring = False
+        elapsed = time.monotonic() - started
+        cpu_after, tree_rss = tree_usage(os.getpid())
+        frames = sum(m.frames_total for m in metrics) - frames_before
+        dropped = sum(m.frames_dropped_total for m in metrics) - dropped_before
+        running = sum(1 for stream in streams if str(stream.id) in active_streams and active_streams[str(stream.id)].is_running)
+        rss = rss_mb()
+    finally:
+        for viewer in viewers:
+            viewer.task.cancel()
+        for viewer in viewers:
+            await viewer.communicator.disconnect()
+        for stream in streams:
+            client = active_streams.get(str(stream.id))
+            if client and client.is_running:
+                client._stop_stream()
+        await asyncio.sleep(1.5)
+        for stream in streams:
+            await sync_to_async(stream.delete)()
+
+    latencies = sorted(latency for viewer in viewers for latency in viewer.latencies)
+    delivered = sum(viewer.frames for viewer in viewers)
+    return {
+        **scenario,
+        'streams_running': running,
+        'ingest_fps': round(frames / elapsed, 1),
+        'delivered_fps': round(delivered / elapsed, 1),
+        'viewer_fps': round(delivered / elapsed / len(viewers), 2),
+        'dropped_per_s': round(dropped / elapsed, 1),
+        'latency_p50_ms': percentile(latencies, 0.50),
+        'latency_p95_ms': percentile(latencies, 0.95),
+        'latency_p99_ms': percentile(latencies, 0.99),
+        'cpu_percent': round(100 * (cpu_after - cpu_before) / elapsed, 1),
+        'rss_mb': round(rss, 1),
+        'rss_growth_mb': round(rss - base_rss, 1),
+        'tree_rss_mb': round(tree_rss / (1024 * 1024), 1),
+    }
+
+
+def child(args):
+    os.environ['RTSP_INGEST_MODE'] = args.mode
+    os.environ['RTSP_FRAME_FANOUT'] = 'hub'
+    setup_django()
+    logging.disable(logging.WARNING)
+    result = asyncio.run(run_scenario(SCENARIOS[args.child], args.duration, args.warmup))
+    print(json.dumps(result))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print each compared metric against the baseline, returns the regressions"""
+    regressions = []
+    print(f"{'scenario':<16} {'metric':<16} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old or 'error' in result or 'error' in old:
+            continue
+        for metric, (direction, slack) in COMPARED.items():
+            before, now = old.get(metric), result.get(metric)
+            if before is None or now is None:
+                continue
+            change = (now - before) / before if before else 0.0
+            worse = direction * (before - now)
+            regressed = worse > slack and worse > tolerance * abs(before)
+            print(f"{name:<16} {metric:<16} {before:>10} {now:>10} {100 * change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--mode', choices=['thread', 'asyncio', 'process'], default='thread', help="RTSP_INGEST_MODE")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds measured per scenario")
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier --output run")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Relative change that counts as a regression")
+    parser.add_argument('--child', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return 0
+
+    results = {
+        'meta': {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'host': platform.node(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'mode': args.mode,
+            'duration': args.duration,
+        },
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        process = subprocess.run(
+            [sys.executable, __file__, '--child', name, '--mode', args.mode,
+             '--duration', str(args.duration), '--warmup', str(args.warmup)],
+            capture_output=True, text=True,
+        )
+        try:
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            result = {'error': (process.stderr.strip().splitlines() or ['no output'])[-1]}
+        results['scenarios'][name] = result
+        print(f"{name}: {json.dumps(result)}", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if not args.compare:
+        print(text)
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('cpus') != results['meta']['cpus']:
+        print(f"Note: the baseline ran on {baseline.get('meta', {}).get('cpus')} CPUs, this run on {results['meta']['cpus']}")
+    regressions = compare(results, baseline, args.tolerance)
+    print("REGRESSIONS: " + ", ".join(regressions) if regressions else "No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
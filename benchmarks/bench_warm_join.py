@@ -0,0 +1,104 @@
+"""
+Time until a joining viewer gets its first frame, cold vs warm stream.
+
+cold: the stream is not running, the viewer's join starts FFmpeg (here
+      benchmarks/fake_mjpeg_source.py) and waits for the first frame.
+warm: the stream kept running after its last viewer left (Stream.keep_warm),
+      the viewer gets the cached latest frame from the frame hub.
+
+Then checks the WARM_STREAMS cap: with MAX_IDLE=2, a third stream going idle
+must stop the one that has been idle longest.
+
+Usage:
+    python benchmarks/bench_warm_join.py --joins 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from common import ROOT, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+async def join(manager, stream_id, idle_timeout):
+    """Join a stream as a viewer, returns (ms to first frame, client)"""
+    from stream.utils.frame_hub import get_frame_hub
+
+    channel = get_frame_hub().channel(stream_id)
+    started = time.perf_counter()
+    channel.subscribe()
+    try:
+        client, _ = await manager.join(SimpleNamespace(id=stream_id, idle_timeout=idle_timeout))
+        await channel.next_frame(0)
+        return 1000 * (time.perf_counter() - started), client
+    finally:
+        channel.unsubscribe()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--joins', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    logging.disable(logging.WARNING)
+    from django.conf import settings
+    from stream.utils.async_rtsp_client import AsyncRTSPClient
+    from stream.utils.stream_manager import StreamManager
+    from stream.utils.warm_streams import get_idle_streams
+
+    settings.RTSP_STARTUP = {'FIRST_FRAME_TIMEOUT_S': 5.0}
+    client_class = type('AsyncRTSPClient', (AsyncRTSPClient,), {
+        '_ffmpeg_command': lambda self, transport: [sys.executable, FAKE_SOURCE, '--fps', '15'],
+    })
+    manager = StreamManager(lambda stream: client_class(
+        stream.id, 'fake://', f'group_{stream.id}', analyzer='none', idle_timeout=stream.idle_timeout,
+    ), lambda stream: {})
+
+    results = {'cold': [], 'warm': []}
+    for i in range(args.joins):
+        # Cold: on-demand stream stopped right after its last viewer
+        elapsed, client = await join(manager, f'cold_{i}', idle_timeout=0)
+        results['cold'].append(elapsed)
+        manager.leave(client)
+        await asyncio.sleep(0.2)
+
+    for i in range(args.joins):
+        elapsed, warm = await join(manager, 'warm', idle_timeout=60)
+        if i:  # the first join starts the stream
+            results['warm'].append(elapsed)
+        manager.leave(warm)
+        await asyncio.sleep(0.3)
+    await manager.stop(warm)
+
+    for name, values in results.items():
+        print(f"{name:<5} join -> first frame: median={statistics.median(values):.1f} ms "
+              f"max={max(values):.1f} ms  ({len(values)} joins)")
+
+    # LRU cap: three streams go idle one after the other with room for two
+    idle = get_idle_streams()
+    idle.max_idle = 2
+    clients = []
+    for i in range(3):
+        _, client = await join(manager, f'lru_{i}', idle_timeout=60)
+        clients.append(client)
+    for client in clients:
+        manager.leave(client)
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1.5)
+    running = [client.stream_id for client in clients if client.is_running]
+    print(f"idle cap 2, 3 streams idle: running={running} evictions={idle.evictions}")
+    ok = running == ['lru_1', 'lru_2']
+    await manager.close()
+    print("OK" if ok else "FAILED: expected the longest idle stream (lru_0) to be stopped")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
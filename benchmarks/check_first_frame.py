@@ -0,0 +1,105 @@
+"""
+Time to first frame (TTFF) of stream startup with each probe strategy.
+
+For every ingest mode the stream is started several ways: transports tried one by
+one (TCP first), the same with the Stream's remembered transport first, and TCP and
+UDP probed in parallel. Each start reports the transport that won and the
+client's measured first_frame_ms; the check fails if a start does not connect or
+the remembered transport is not stored on the Stream.
+
+Against a local RTSP source (needs ffmpeg, e.g. demo_rtsp_server/docker-compose.yaml
+with its local-loop publisher):
+    python benchmarks/check_first_frame.py --url rtsp://127.0.0.1:8554/local-loop
+
+Without --url, FFmpeg is replaced by benchmarks/fake_mjpeg_source.py and the
+--broken transport (default TCP, as behind a firewall that drops interleaved RTSP)
+connects but never delivers a frame, so only the fallback transport works.
+
+Needs a migrated database (python manage.py migrate).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from common import ROOT, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+def fake_command(broken):
+    def _ffmpeg_command(self, transport):
+        if transport == broken:
+            return [sys.executable, '-c', 'import time; time.sleep(60)']
+        return [sys.executable, FAKE_SOURCE, '--fps', '15']
+    return _ffmpeg_command
+
+
+async def start_once(client_class, stream, timeout):
+    from asgiref.sync import sync_to_async
+
+    await sync_to_async(stream.refresh_from_db)()
+    client = client_class(stream.id, stream.url, f'check_ttff_{stream.id}', analyzer='none',
+                          transport=stream.last_transport)
+    started = time.monotonic()
+    client.start()
+    try:
+        while client.first_frame_ms is None and client.is_running and time.monotonic() - started < timeout:
+            await asyncio.sleep(0.02)
+        return client.connected_transport, client.first_frame_ms
+    finally:
+        client._stop_stream()
+        await asyncio.sleep(1.5)
+
+
+async def check(url, broken, first_frame_timeout):
+    setup_django()
+    logging.disable(logging.WARNING)
+    from asgiref.sync import sync_to_async
+    from django.conf import settings
+    from stream.models import Stream
+    from stream.utils.rtsp_client import RTSPClient
+    from stream.utils.async_rtsp_client import AsyncRTSPClient
+
+    modes = [('thread', RTSPClient), ('asyncio', AsyncRTSPClient)]
+    if not url:
+        modes = [(name, type(cls.__name__, (cls,), {'_ffmpeg_command': fake_command(broken)})) for name, cls in modes]
+    stream = await sync_to_async(Stream.objects.create)(name='ttff-check', url=url or 'rtsp://fake', analyzer='none')
+
+    failures = []
+    try:
+        for mode, client_class in modes:
+            for strategy, parallel, remembered in (('sequential', False, False), ('remembered', False, True),
+                                                   ('parallel', True, False)):
+                settings.RTSP_STARTUP = {'FIRST_FRAME_TIMEOUT_S': first_frame_timeout, 'PARALLEL_PROBE': parallel}
+                if not remembered:
+                    await sync_to_async(Stream.objects.filter(id=stream.id).update)(last_transport='')
+                transport, first_frame_ms = await start_once(client_class, stream, 3 * first_frame_timeout)
+                await sync_to_async(stream.refresh_from_db)()
+                print(f"mode={mode:<8} probe={strategy:<11} transport={transport or '-':<4} "
+                      f"first_frame={f'{first_frame_ms:.0f} ms' if first_frame_ms else 'none'}  "
+                      f"remembered={stream.last_transport or '-'}")
+                if transport is None:
+                    failures.append(f"{mode}/{strategy} did not connect")
+                elif stream.last_transport != transport:
+                    failures.append(f"{mode}/{strategy} did not remember {transport}")
+    finally:
+        await sync_to_async(stream.delete)()
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="RTSP URL of a local test source (default: fake source, no FFmpeg)")
+    parser.add_argument('--broken', choices=['tcp', 'udp'], default='tcp', help="Fake source only: transport that never delivers")
+    parser.add_argument('--first-frame-timeout', type=float, default=5.0)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(check(args.url, args.broken, args.first_frame_timeout)) else 1)
+
+
+if __name__ == '__main__':
+    main()
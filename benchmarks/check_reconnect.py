@@ -0,0 +1,280 @@
+"""
+Fault injection for the reconnect supervisor: break a stream's source and its FFmpeg, and
+check that a watching viewer rides it out.
+
+A local "camera" (FFmpeg serving testsrc2 as MJPEG in NUT on a TCP port) stands in for the RTSP
+input. One WebSocket viewer watches the stream while these faults are injected:
+
+- camera: the camera goes away for --outage seconds, then comes back
+- kill: the stream's FFmpeg is killed with SIGKILL
+- stall: the stream's FFmpeg is frozen with SIGSTOP, the stall watchdog has to notice
+
+After each one the viewer must still be connected, must have been told the stream is
+reconnecting, and must get frames again; the time from the fault to the first new frame
+is the recovery time. The counters must show up in the client's stats and in /metrics.
+
+Needs ffmpeg on PATH and a migrated database.
+
+Usage:
+    python benchmarks/check_reconnect.py --mode asyncio --outage 3
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from common import ffmpeg_processes, setup_django
+
+# Tags the stream's FFmpeg processes, see ffmpeg_processes()
+TAG = f'reconnect-{os.getpid()}'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Camera:
+    """FFmpeg serving a test pattern on a TCP port, one client per run; restarted while it is up"""
+
+    def __init__(self, port):
+        self.port = port
+        self.up = True
+        self.process = None
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-re', '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=15',
+             '-c:v', 'mjpeg', '-f', 'nut', f'tcp://127.0.0.1:{self.port}?listen=1'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    async def run(self):
+        """Keep a camera listening while it is up"""
+        while True:
+            if self.up and (self.process is None or self.process.poll() is not None):
+                self._start()
+            await asyncio.sleep(0.05)
+
+    async def listening(self, timeout=10.0):
+        """Wait until the camera accepts connections, without taking its one client slot"""
+        entry = f':{self.port:04X} '
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with open('/proc/net/tcp') as f:
+                # Local address and state 0A (LISTEN)
+                if any(entry in line and line.split()[3] == '0A' for line in f):
+                    return True
+            await asyncio.sleep(0.05)
+        return False
+
+    def down(self):
+        self.up = False
+        self.kill()
+
+    def kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def camera_command(command, port, stream_id):
+    """The client's FFmpeg command reading the local camera instead of RTSP, tagged with the stream"""
+    command = list(command)
+    i = command.index('-rtsp_transport')
+    del command[i:i + 2]
+    i = command.index('-i')
+    command[i + 1] = f'tcp://127.0.0.1:{port}'
+    return command[:-1] + ['-metadata', f'comment={TAG}-{stream_id}', command[-1]]
+
+
+class Viewer:
+    """A WebSocket viewer that acks frames and keeps a timeline of what it got"""
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.events = []    # (monotonic time, kind, status state or None)
+        self.closed = False
+
+    async def run(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            now = time.monotonic()
+            if message['type'] == 'websocket.close':
+                self.closed = True
+                self.events.append((now, 'close', None))
+                return
+            if message.get('bytes') is not None:
+                self.events.append((now, 'frame', None))
+                await self.communicator.send_json_to({'type': 'ack'})
+            elif message.get('text'):
+                data = json.loads(message['text'])
+                if data.get('type') == 'stream_status':
+                    self.events.append((now, 'status', data.get('state')))
+
+    def since(self, t):
+        return [event for event in self.events if event[0] >= t]
+
+    async def recovered(self, t, timeout):
+        """Wait for 'reconnecting', then 'live', then a frame, all after `t`; returns the frame's time or None"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self.closed:
+            phase = 'reconnecting'
+            for at, kind, state in self.since(t):
+                if phase == 'reconnecting' and kind == 'status' and state == 'reconnecting':
+                    phase = 'live'
+                elif phase == 'live' and kind == 'status' and state == 'live':
+                    phase = 'frame'
+                elif phase == 'frame' and kind == 'frame':
+                    return at
+            await asyncio.sleep(0.05)
+        return None
+
+    async def frames(self, t, count, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(kind == 'frame' for _, kind, _ in self.since(t)) >= count:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+
+async def check(args):
+    from asgiref.sync import sync_to_async
+    from channels.testing import WebsocketCommunicator
+    from django.test import Client
+    from rtsppy.asgi import application
+    from stream.consumer import active_streams
+    from stream.models import Stream
+    from stream.utils.rtsp_client import RTSPClient
+
+    port = free_port()
+    command = RTSPClient._ffmpeg_command
+    RTSPClient._ffmpeg_command = lambda self, transport, outputs=None: camera_command(
+        command(self, transport, outputs), port, self.stream_id)
+
+    camera = Camera(port)
+    camera_task = asyncio.create_task(camera.run())
+    await camera.listening()
+    stream = await sync_to_async(Stream.objects.create)(name='reconnect-check', url='rtsp://camera', analyzer='none')
+    stream_id = str(stream.id)
+    communicator = WebsocketCommunicator(application, f'/ws/stream/{stream_id}/')
+    communicator.scope['client'] = ('127.0.0.1', 1)
+    viewer = Viewer(communicator)
+    failures = []
+    recoveries = {}
+    try:
+        await communicator.connect(timeout=30)
+        viewer_task = asyncio.create_task(viewer.run())
+        if not await viewer.frames(0, 5, 30):
+            failures.append("no frames before injecting faults")
+            return failures
+
+        async def fault(name, inject, restore=None):
+            await viewer.frames(time.monotonic(), 5, 10)
+            t = time.monotonic()
+            inject()
+            if restore:
+                await asyncio.sleep(args.outage)
+                restore()
+            recovered_at = await viewer.recovered(t, args.timeout)
+            if recovered_at is None:
+                failures.append(f"{name}: no frames within {args.timeout:.0f}s" + (" (viewer disconnected)" if viewer.closed else ""))
+                return
+            recoveries[name] = recovered_at - t
+            if not await viewer.frames(recovered_at, 10, 10):
+                failures.append(f"{name}: frames did not keep coming after recovering")
+
+        def client_ffmpeg():
+            pids = ffmpeg_processes(TAG).get(stream_id, [])
+            return pids[0] if len(pids) == 1 else None
+
+        def camera_down():
+            camera.down()
+
+        def camera_up():
+            camera.up = True
+
+        await fault('camera', camera_down, camera_up)
+
+        pid = client_ffmpeg()
+        if pid:
+            await fault('kill', lambda: os.kill(pid, signal.SIGKILL))
+        else:
+            failures.append("kill: no single FFmpeg process for the stream")
+
+        pid = client_ffmpeg()
+        if pid:
+            await fault('stall', lambda: os.kill(pid, signal.SIGSTOP))
+            if pid in ffmpeg_processes(TAG).get(stream_id, []):
+                failures.append(f"stall: the frozen FFmpeg {pid} was not killed")
+        else:
+            failures.append("stall: no single FFmpeg process for the stream")
+
+        if args.mode == 'process':
+            await asyncio.sleep(2.5)    # The worker's counters come with its next stats message
+        stats = active_streams[stream_id].stats()['reconnect'] or {}
+        metrics = (await sync_to_async(Client().get)('/metrics')).content.decode()
+        viewer_task.cancel()
+    finally:
+        await communicator.disconnect()
+        if stream_id in active_streams:
+            active_streams[stream_id]._stop_stream()
+        await asyncio.sleep(1.5)
+        await sync_to_async(stream.delete)()
+        camera_task.cancel()
+        camera.kill()
+        for pids in ffmpeg_processes(TAG).values():
+            for pid in pids:
+                os.kill(pid, signal.SIGKILL)
+
+    print(f"{args.mode}: recovery " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in recoveries.items()))
+    print(f"client stats: {stats}")
+    print('\n'.join(line for line in metrics.splitlines()
+                    if line.startswith(('rtsp_stream_reconnects_total', 'rtsp_stream_stalls_total', 'rtsp_stream_recovery_seconds_count'))
+                    and f'stream="{stream_id}"' in line))
+    if stats.get('reconnects', 0) < len(recoveries):
+        failures.append(f"client counted {stats.get('reconnects')} reconnects for {len(recoveries)} recoveries")
+    if 'stall' in recoveries and not stats.get('stalls'):
+        failures.append("client counted no stall")
+    if f'rtsp_stream_reconnects_total{{stream="{stream_id}"}} {len(recoveries)}' not in metrics:
+        failures.append("/metrics does not count the reconnects")
+    if viewer.closed:
+        failures.append("the viewer was disconnected")
+    gc.collect()    # close the stopped FFmpeg transports while the loop still runs
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['thread', 'asyncio', 'process'], default='thread')
+    parser.add_argument('--fanout', choices=['hub', 'channel_layer'], default='hub')
+    parser.add_argument('--outage', type=float, default=3.0, help="Seconds the camera stays away")
+    parser.add_argument('--stall', type=float, default=2.0, help="Stall watchdog timeout in seconds")
+    parser.add_argument('--reset', type=float, default=1.0,
+                        help="Seconds a connection must last for the backoff to start over, the faults come a few seconds apart")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Longest acceptable recovery in seconds")
+    args = parser.parse_args()
+
+    os.environ['RTSP_INGEST_MODE'] = args.mode
+    os.environ['RTSP_FRAME_FANOUT'] = args.fanout
+    os.environ['RTSP_STALL_S'] = str(args.stall)
+    os.environ['RTSP_RETRY_RESET_S'] = str(args.reset)
+    setup_django()
+    logging.disable(logging.ERROR)
+
+    failures = asyncio.run(check(args))
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
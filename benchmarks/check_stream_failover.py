@@ -0,0 +1,162 @@
+"""
+End-to-end check of STREAM_CLUSTER: two Daphne workers share one lease file.
+
+A viewer on worker A makes A the owner of the stream (FFmpeg is replaced by
+benchmarks/fake_mjpeg_source.py). A viewer on worker B must then get frames
+relayed from A while only one source process runs. A is then killed with
+SIGKILL; B must take the lease over once it expires and keep its viewer going.
+
+Needs a migrated database (python manage.py migrate). Usage:
+    python benchmarks/check_stream_failover.py --ports 8101 8102
+"""
+import argparse
+import asyncio
+import base64
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, setup_django
+
+FAKE_SOURCE = os.path.join(ROOT, 'benchmarks', 'fake_mjpeg_source.py')
+
+
+def run_node(port):
+    """Child: a Daphne worker whose FFmpeg is the fake MJPEG source"""
+    setup_django()
+    from stream.utils.rtsp_client import RTSPClient
+    from daphne.cli import CommandLineInterface
+
+    RTSPClient._ffmpeg_command = lambda self, transport: [sys.executable, FAKE_SOURCE, '--fps', '15']
+    CommandLineInterface().run(['-b', '127.0.0.1', '-p', str(port), 'rtsppy.asgi:application'])
+
+
+class Viewer:
+    """Just enough of a WebSocket client to count binary frames"""
+
+    def __init__(self, port, stream_id):
+        self.port = port
+        self.stream_id = stream_id
+        self.frames = 0
+        self.last_frame_at = None
+        self.task = None
+
+    async def run(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(
+            f"GET /ws/stream/{self.stream_id}/?overlay=sidecar HTTP/1.1\r\nHost: 127.0.0.1:{self.port}\r\n"
+            f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+            f"Sec-WebSocket-Version: 13\r\n\r\n".encode()
+        )
+        await writer.drain()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), 'big')
+                await reader.readexactly(length)
+                if head[0] & 0x0F == 0x2:
+                    self.frames += 1
+                    self.last_frame_at = time.monotonic()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+
+def source_processes():
+    output = subprocess.run(['pgrep', '-f', FAKE_SOURCE], capture_output=True, text=True).stdout
+    return len(output.split())
+
+
+async def check(ports, lease_ttl):
+    setup_django()
+    from asgiref.sync import sync_to_async
+    from stream.models import Stream
+    from stream.utils.stream_leases import SQLiteLeaseStore
+
+    stream, _ = await sync_to_async(Stream.objects.get_or_create)(
+        name='failover-check', defaults={'url': 'rtsp://fake', 'analyzer': 'none'}
+    )
+    lease_db = os.path.join(tempfile.mkdtemp(), 'leases.sqlite3')
+    leases = SQLiteLeaseStore(lease_db, ttl=lease_ttl)
+
+    relay_token = secrets.token_hex(16)
+    nodes = []
+    for port in ports:
+        env = {**os.environ, 'STREAM_CLUSTER_ENABLED': '1', 'STREAM_CLUSTER_LEASE_DB': lease_db,
+               'STREAM_NODE_ADDRESS': f'127.0.0.1:{port}', 'STREAM_RELAY_TOKEN': relay_token}
+        nodes.append(subprocess.Popen([sys.executable, __file__, '--node', str(port)], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    await asyncio.sleep(3)
+
+    failures = []
+    try:
+        viewer_a = Viewer(ports[0], stream.id)
+        viewer_a.start()
+        await asyncio.sleep(4)
+        viewer_b = Viewer(ports[1], stream.id)
+        viewer_b.start()
+        await asyncio.sleep(4)
+
+        owner = leases.holder(str(stream.id))
+        print(f"owner={owner.address if owner else None} viewer_a={viewer_a.frames} viewer_b={viewer_b.frames} "
+              f"sources={source_processes()}")
+        if not owner or owner.address != f'127.0.0.1:{ports[0]}':
+            failures.append("worker A does not hold the lease")
+        if viewer_b.frames == 0:
+            failures.append("viewer on worker B got no relayed frames")
+        if source_processes() != 1:
+            failures.append("expected exactly one source process")
+
+        killed_at = time.monotonic()
+        nodes[0].send_signal(signal.SIGKILL)
+        frames_before = viewer_b.frames
+        deadline = killed_at + lease_ttl + 10
+        while time.monotonic() < deadline and viewer_b.frames < frames_before + 15:
+            await asyncio.sleep(0.2)
+        resumed = viewer_b.frames >= frames_before + 15
+        owner = leases.holder(str(stream.id))
+        print(f"after SIGKILL of A: owner={owner.address if owner else None} "
+              f"viewer_b resumed={resumed} in {time.monotonic() - killed_at:.1f} s (lease TTL {lease_ttl:.0f} s)")
+        if not resumed or not owner or owner.address != f'127.0.0.1:{ports[1]}':
+            failures.append("worker B did not take over")
+    finally:
+        for node in nodes:
+            node.terminate()
+        for node in nodes:
+            node.wait()
+        await sync_to_async(stream.delete)()
+
+    print("FAILED: " + "; ".join(failures) if failures else "OK")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ports', type=int, nargs=2, default=[8101, 8102])
+    parser.add_argument('--lease-ttl', type=float, default=10.0, help="Must match STREAM_CLUSTER['LEASE_TTL_S']")
+    parser.add_argument('--node', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.node:
+        run_node(args.node)
+        return
+    sys.exit(0 if asyncio.run(check(args.ports, args.lease_ttl)) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_VIDEO = os.path.join(ROOT, 'demo_rtsp_server', 'samples', 'input_files', 'sample.mp4')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsppy.settings')
+    import django
+    django.setup()
+
+
+def load_sample_frames(count=100, width=640, quality=90, path=SAMPLE_VIDEO):
+    """
+        Decode up to `count` frames of the bundled sample video and return them as JPEG
+        bytes scaled to `width`, roughly what FFmpeg hands RTSPClient.
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, image = capture.read()
+        if not ok:
+            break
+        height = int(image.shape[0] * width / image.shape[1])
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            frames.append(encoded.tobytes())
+    capture.release()
+    if not frames:
+        raise RuntimeError(f"Could not decode frames from {path}")
+    return frames
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def ffmpeg_processes(tag):
+    """{stream id: [pid]} of the running FFmpeg processes tagged `comment=<tag>-<stream id>` on their command line"""
+    processes = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/cmdline', 'rb') as f:
+                args = f.read().split(b'\0')
+            with open(f'/proc/{name}/stat') as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except OSError:
+            continue
+        if state == 'Z' or not args or not args[0].endswith(b'ffmpeg'):
+            continue
+        for arg in args:
+            if arg.startswith(f'comment={tag}-'.encode()):
+                processes.setdefault(arg.decode().rsplit('-', 1)[1], []).append(int(name))
+    return processes
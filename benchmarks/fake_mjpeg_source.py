@@ -0,0 +1,55 @@
+"""
+Stand-in for the FFmpeg process: writes synthetic MJPEG frames to stdout at a fixed rate.
+
+Used by the benchmarks so they can drive RTSPClient without a camera or FFmpeg.
+    python benchmarks/fake_mjpeg_source.py --fps 15 --frame-size 30000
+    python benchmarks/fake_mjpeg_source.py --fps 15 --sample   # real frames, for face detection
+"""
+import argparse
+import os
+import sys
+import time
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--frame-size', type=int, default=30_000)
+    parser.add_argument('--duration', type=float, default=0, help="Exit after N seconds (0 = run until killed)")
+    parser.add_argument('--count', type=int, default=0, help="Exit after N frames (0 = no limit)")
+    parser.add_argument('--sample', action='store_true', help="Loop over frames of the sample video instead")
+    args = parser.parse_args()
+
+    if args.sample:
+        from common import load_sample_frames
+        frames = load_sample_frames(100)
+    else:
+        # Payload bytes stay below 0xFF so they never contain a JPEG marker
+        payload = bytes(i % 0xFF for i in range(args.frame_size))
+        frames = [JPEG_START + payload + JPEG_END]
+    interval = 1.0 / args.fps
+    out = sys.stdout.buffer
+    started = next_frame = time.monotonic()
+    count = 0
+
+    try:
+        while (not args.duration or time.monotonic() - started < args.duration) and (not args.count or count < args.count):
+            out.write(frames[count % len(frames)])
+            count += 1
+            out.flush()
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        try:
+            os.close(sys.stdout.fileno())
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -150,6 +151,182 @@ CHANNEL_LAYERS = {
     }
 }
 
+# RTSP ingest: 'thread' runs one reader thread per stream, 'asyncio' runs FFmpeg
+# on the Daphne event loop and sends frames without a thread hop, 'process' runs
+# each stream's FFmpeg reader and face detection in a worker process of its own
+RTSP_INGEST_MODE = os.environ.get('RTSP_INGEST_MODE', 'thread')
+
+# 'process' ingest: workers hand frames back through a shared-memory ring of
+# RING_SLOTS slots of RING_SLOT_BYTES (must fit one JPEG plus its annotated copy).
+# A crashed worker is restarted after RESTART_S, doubling up to RESTART_MAX_S while
+# it keeps crashing within RESTART_RESET_S of being started
+RTSP_PROCESS_INGEST = {
+    'RING_SLOTS': 4,
+    'RING_SLOT_BYTES': 1024 * 1024,
+    'RESTART_S': 1.0,
+    'RESTART_MAX_S': 30.0,
+    'RESTART_RESET_S': 30.0,
+    'STATS_S': 2.0,
+}
+
+# Stream startup: FFmpeg counts as connected once it delivers its first JPEG, a
+# transport that has not within FIRST_FRAME_TIMEOUT_S fails. Transports are tried
+# one after the other, the Stream's last working one first; with PARALLEL_PROBE
+# TCP and UDP are started together and the first to deliver a frame wins (the
+# camera briefly sees two sessions)
+RTSP_STARTUP = {
+    'FIRST_FRAME_TIMEOUT_S': float(os.environ.get('RTSP_FIRST_FRAME_TIMEOUT_S', 10.0)),
+    'PARALLEL_PROBE': os.environ.get('RTSP_PARALLEL_PROBE', '0') == '1',
+}
+
+# Reconnect: when FFmpeg exits, its pipe breaks or no frame came for STALL_S (0 =
+# no stall watchdog), the stream restarts FFmpeg after RETRY_S, doubling up to
+# RETRY_MAX_S while attempts keep failing, each delay picked at random from its
+# upper half so cameras behind one switch do not all retry at once. A connection
+# that lasted RETRY_RESET_S starts over at RETRY_S. Viewers stay attached, keep the
+# last frame and get a 'reconnecting' status. A stream that never connected is not
+# retried
+RTSP_RECONNECT = {
+    'ENABLED': os.environ.get('RTSP_RECONNECT_ENABLED', '1') == '1',
+    'RETRY_S': 0.5,
+    'RETRY_MAX_S': 30.0,
+    'RETRY_RESET_S': float(os.environ.get('RTSP_RETRY_RESET_S', 30.0)),
+    'STALL_S': float(os.environ.get('RTSP_STALL_S', 10.0)),
+}
+
+# H.264 passthrough (Stream.delivery='passthrough'): FFmpeg remuxes the camera's
+# video with -c copy into fragmented MP4, one fragment per keyframe or every
+# FRAG_DURATION_MS, and viewers play it with MediaSource. The last MAX_FRAGMENTS
+# are kept so late joiners start at the newest keyframe; a viewer with
+# MAX_IN_FLIGHT unacked fragments that falls MAX_BEHIND fragments behind skips to
+# the newest keyframe. Analysis decodes keyframes only, at most ANALYSIS_FPS,
+# scaled to ANALYSIS_WIDTH
+RTSP_PASSTHROUGH = {
+    'FRAG_DURATION_MS': 500,
+    'MAX_FRAGMENTS': 120,
+    'MAX_IN_FLIGHT': 4,
+    'MAX_BEHIND': 4,
+    'ANALYSIS_FPS': 2.0,
+    'ANALYSIS_WIDTH': 640,
+}
+
+# Quality ladder: FFmpeg's main output (640 px at 15 fps, the one analysis, the
+# DVR and snapshots use) is listed as the DEFAULT rendition. The EXTRA renditions
+# (at most WIDTH px, never upscaled, FPS, JPEG QUALITY as -q:v) are split from
+# the same decode, but only encoded while viewers watch them (?rendition=<name>
+# or {"type": "rendition", "name"}) and for IDLE_S after the last one left.
+# Changing the set starts a new FFmpeg next to the running one, so the camera
+# briefly sees two sessions; if it delivers nothing the change is retried after RETRY_S
+RTSP_RENDITIONS = {
+    'DEFAULT': 'medium',
+    'EXTRA': {
+        'low': {'WIDTH': 320, 'FPS': 5, 'QUALITY': 12},
+        'high': {'WIDTH': 1280, 'FPS': 15, 'QUALITY': 5},
+    },
+    'IDLE_S': 30.0,
+    'RETRY_S': 10.0,
+}
+
+# Keep-warm (Stream.keep_warm): a stream without viewers keeps FFmpeg running and
+# its latest frame fresh, so a joining viewer sees a picture at once. 'on_demand'
+# streams stop ON_DEMAND_GRACE_S after their last viewer, 'idle' streams after
+# Stream.idle_timeout. At most MAX_IDLE such streams idle at a time; one more stops
+# the stream that has been idle longest. 'always' streams are started by the stream
+# manager (once the first viewer connects after a restart, or when saved as always
+# on), never stopped for idling, and restarted ALWAYS_ON_RESTART_S after FFmpeg exits
+WARM_STREAMS = {
+    'MAX_IDLE': int(os.environ.get('WARM_STREAMS_MAX_IDLE', 8)),
+    'ON_DEMAND_GRACE_S': float(os.environ.get('WARM_STREAMS_ON_DEMAND_GRACE_S', 5.0)),
+    'ALWAYS_ON_RESTART_S': 30.0,
+}
+
+# Instant replay (DVR): each running stream records its frames by capture time,
+# the newest RAM_MB in memory and older ones in memory-mapped SEGMENT_MB files in
+# DIRECTORY, at most BUDGET_MB per stream (the oldest segment is dropped first).
+# Viewers seek with {"type": "seek", "at": <unix time>, "speed": 1|2|4}
+DVR = {
+    'ENABLED': os.environ.get('DVR_ENABLED', '0') == '1',
+    'BUDGET_MB': int(os.environ.get('DVR_BUDGET_MB', 256)),
+    'RAM_MB': 32,
+    'SEGMENT_MB': 16,
+    'DIRECTORY': os.environ.get('DVR_DIRECTORY', str(BASE_DIR / 'dvr')),
+}
+
+# Snapshots (/api/streams/<id>/snapshot/?width=): a running stream's latest frame,
+# downscaled variants cached for TTL_S (at most CACHE_MB, least recently used
+# dropped first). A stream that is not running gets one FFmpeg grab of at most
+# GRAB_TIMEOUT_S, shared by concurrent requests; its result (or failure) is kept
+# for COLD_TTL_S. Snapshots are never wider than MAX_WIDTH
+SNAPSHOTS = {
+    'TTL_S': float(os.environ.get('SNAPSHOT_TTL_S', 1.0)),
+    'COLD_TTL_S': float(os.environ.get('SNAPSHOT_COLD_TTL_S', 10.0)),
+    'GRAB_TIMEOUT_S': 5.0,
+    'CACHE_MB': int(os.environ.get('SNAPSHOT_CACHE_MB', 32)),
+    'MAX_WIDTH': 640,
+    'QUALITY': 80,
+}
+
+# Frame fan-out: 'hub' hands every viewer in this process the same frame object
+# through stream/utils/frame_hub.py and keeps frames off the channel layer;
+# 'channel_layer' group_sends every frame (needed if viewers of a stream can be
+# served by another process)
+RTSP_FRAME_FANOUT = os.environ.get('RTSP_FRAME_FANOUT', 'hub')
+
+# Several Daphne workers (or hosts): with STREAM_CLUSTER enabled, exactly one worker
+# holds a renewable lease per stream (LEASE_TTL_S, renewed every RENEW_S) in a
+# SQLite file all workers share, and runs FFmpeg. Workers with viewers of a stream
+# they don't own relay it from the owner's NODE_ADDRESS; when the owner dies its
+# lease expires and one of them takes over. RELAY_TOKEN protects the relay endpoint;
+# every worker needs the same one, the endpoint refuses all requests without it.
+STREAM_CLUSTER = {
+    'ENABLED': os.environ.get('STREAM_CLUSTER_ENABLED', '') == '1',
+    'LEASE_DB': os.environ.get('STREAM_CLUSTER_LEASE_DB', str(BASE_DIR / 'stream_leases.sqlite3')),
+    'LEASE_TTL_S': 10.0,
+    'RENEW_S': 3.0,
+    'RETRY_S': 1.0,
+    'NODE_ADDRESS': os.environ.get('STREAM_NODE_ADDRESS', '127.0.0.1:8000'),
+    'RELAY_TOKEN': os.environ.get('STREAM_RELAY_TOKEN', ''),
+}
+
+# Face detection shared by all streams. Frames are skipped, never queued, when
+# the backend is busy. WORKERS 'thread' or 'process' workers each own one model,
+# which serves every stream. DECODE_SCALE (1, 2, 4 or 8) decodes frames at 1/N
+# size for the MTCNN input unless the stream's analyzer_params set it. Which
+# analyzer runs (or none) is chosen per stream, see stream/utils/analyzers.py;
+# YUNET_MODEL is the ONNX file for the 'yunet' backend. The motion gate only lets a frame through when
+# more than MOTION_THRESHOLD of it changed (per-stream override on Stream), or
+# every MOTION_REFRESH_S seconds. The gate and the face tracker run on
+# PREP_WORKERS threads, not on the ingest thread or the event loop.
+FACE_DETECTION = {
+    'EXECUTOR': os.environ.get('FACE_DETECTION_EXECUTOR', 'thread'),  # 'thread' or 'process'
+    'WORKERS': int(os.environ.get('FACE_DETECTION_WORKERS', 1)),
+    'DECODE_SCALE': int(os.environ.get('FACE_DETECTION_DECODE_SCALE', 1)),
+    'YUNET_MODEL': os.environ.get('FACE_DETECTION_YUNET_MODEL', ''),
+    'MOTION_THRESHOLD': 0.01,
+    'MOTION_REFRESH_S': 5.0,
+    'PREP_WORKERS': 2,
+}
+
+# Prometheus metrics at /metrics: per-stream ingest fps, bytes read from FFmpeg,
+# splitter backlog, detection and send latency histograms, dropped frames, viewers,
+# FFmpeg starts and time to first frame, plus this process's CPU and memory. Each
+# Daphne worker reports its own streams. With TOKEN set, scrapes must send
+# "Authorization: Bearer <TOKEN>"
+METRICS = {
+    'ENABLED': os.environ.get('METRICS_ENABLED', '1') == '1',
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+
+# Latency tracing: every SAMPLE_EVERY-th frame (0 = off) has its time per stage
+# recorded, from the pipe read through detection submit, publish, the hop to each
+# viewer and the WebSocket send, the last RING_SIZE samples per stage. Viewers that
+# connect with ?trace=1 echo those frames once drawn. Percentiles per stage at
+# /api/streams/<id>/latency/
+LATENCY_TRACE = {
+    'SAMPLE_EVERY': int(os.environ.get('LATENCY_TRACE_SAMPLE_EVERY', 30)),
+    'RING_SIZE': 1024,
+}
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -18,7 +18,7 @@ import os
 from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from stream.views import StreamViewSet
+from stream.views import StreamViewSet, metrics
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 from django.views.static import serve
 
@@ -34,6 +34,7 @@ urlpatterns = [
     #Serve Index.html 
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
+    path('metrics', metrics, name='metrics'),
     
     # API Schema documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -1,40 +1,94 @@
 # streams/consumers.py
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
+from urllib.parse import parse_qs
 from .utils.rtsp_client import RTSPClient
+from .utils.async_rtsp_client import AsyncRTSPClient
+from .utils.clustered_rtsp_client import ClusteredRTSPClient
+from .utils.process_rtsp_client import ProcessRTSPClient
+from .utils.passthrough import FragmentSlot, PassthroughRTSPClient, passthrough_config
+from .utils.frame_slot import LatestFrameSlot
+from .utils.frame_hub import get_frame_hub
+from .utils.rtsp_client import frame_fanout
+from .utils.renditions import default_rendition
+from .utils.metrics import stream_metrics
+from .utils.frame_trace import frame_tracer
+from .utils.warm_streams import idle_timeout_for
+from .utils.stream_manager import StreamManager
 from .models import Stream
+from django.conf import settings
 from asgiref.sync import sync_to_async
 import logging
-import threading
 import asyncio
+import time
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('rtsp_consumer')
 
-# Simple global dict to track active streams
-active_streams : dict[str, RTSPClient] = {}
-
-# Background task to clean up streams that should be removed
-async def cleanup_streams():
-    """Periodically check and remove streams marked for removal"""
-    while True:
-        logger.info(f"Periodic cleanup of streams")
-        await asyncio.sleep(30)  # Check every 5 seconds
-        to_remove = []
-        for stream_id, client in active_streams.items():
-            if client.client_count == 0:
-                to_remove.append(stream_id)
-        
-        for stream_id in to_remove:
-            logger.info(f"Cleanup: Removing stream {stream_id} from active streams")
-            if active_streams[stream_id]:
-                logger.info(f"Shutting down stream {stream_id} with client count {active_streams[stream_id].client_count}")
-                active_streams[stream_id]._shutdown()
-            logger.info(f"Deleting stream {stream_id} from active streams")
-            del active_streams[stream_id]
+# Replay speeds a viewer may ask for with a 'seek' message
+PLAYBACK_SPEEDS = (1, 2, 4)
+
+def get_client_class():
+    """
+        Pick the ingest implementation: ClusteredRTSPClient when STREAM_CLUSTER is enabled,
+        otherwise the one configured by RTSP_INGEST_MODE ('thread', 'asyncio' or 'process')
+    """
+    if getattr(settings, 'STREAM_CLUSTER', {}).get('ENABLED'):
+        return ClusteredRTSPClient
+    ingest_mode = getattr(settings, 'RTSP_INGEST_MODE', 'thread')
+    if ingest_mode == 'asyncio':
+        return AsyncRTSPClient
+    if ingest_mode == 'process':
+        return ProcessRTSPClient
+    return RTSPClient
+
+def stream_options(stream):
+    """RTSPClient keyword arguments from a Stream's settings"""
+    return {
+        'motion_threshold': stream.motion_threshold,
+        'tracker': stream.tracker or None,
+        'detection_interval': stream.detection_interval,
+        'analyzer': stream.analyzer,
+        'analyzer_params': stream.analyzer_params,
+        'transport': stream.last_transport,
+        'idle_timeout': idle_timeout_for(stream),
+    }
+
+def create_client(stream):
+    stream_id = str(stream.id)
+    # Passthrough streams remux on the event loop whatever the ingest mode, there is nothing to transcode
+    client_class = PassthroughRTSPClient if stream.delivery == 'passthrough' else get_client_class()
+    return client_class(stream_id, stream.url, f'stream_{stream_id}', **stream_options(stream))
+
+def client_settings(stream):
+    """The Stream fields a running client was built from, saving different ones restarts it"""
+    options = stream_options(stream)
+    # The remembered transport only orders the probe, and a new idle timeout applies in place
+    del options['transport'], options['idle_timeout']
+    return {'url': stream.url, 'delivery': stream.delivery, **options}
+
+# Starts, stops and counts the viewers of every stream of this process
+stream_manager = StreamManager(create_client, client_settings)
+
+# Stream id -> running client, owned by the stream manager
+active_streams : dict[str, RTSPClient] = stream_manager.clients
+
+async def join_stream(stream, burned_in=True):
+    """
+        Count one viewer on the stream's shared client, starting the client if it is
+        not running. Must be called on the event loop; returns (client, started).
+        Every viewer (WebSocket, MJPEG over HTTP) leaves with stream_manager.leave(client)
+    """
+    return await stream_manager.join(stream, burned_in=burned_in)
 
 class RTSPConsumer(AsyncWebsocketConsumer):
+    client = None
+    frame_slot = None
+    playback_task = None
+    playback_slot = None
+    rendition_task = None
+
     async def connect(self):
         """Handle new client connection"""
         logger.info('RTSP Consumer connect initiated')
@@ -43,6 +97,18 @@ class RTSPConsumer(AsyncWebsocketConsumer):
 
         self.group_name = f'stream_{self.stream_id}'
 
+        # ?overlay=sidecar sends untouched frames plus detection messages, the default burns boxes in
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.burned_in = query.get('overlay', ['burned'])[0] != 'sidecar'
+        # Quality ladder: ?rendition=<name> picks one of settings.RTSP_RENDITIONS. The rendition
+        # asked for, and the one whose frames are sent (they differ until it is being encoded)
+        requested_rendition = query.get('rendition', [None])[0]
+        self.rendition = self.frame_rendition = default_rendition()
+        # ?trace=1: the viewer echoes the frames sampled for latency tracing (settings.LATENCY_TRACE)
+        # once it has drawn them, adding network and render time to the traced stages
+        self.trace_echo = query.get('trace', ['0'])[0] == '1'
+        self._trace_sent = {}
+
         client_id = self.scope['client'][1]
         print(f"RTSP Consumer connect initiated for stream {client_id}")
         
@@ -53,10 +119,9 @@ class RTSPConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
         logger.info(f'Client connected to stream {self.stream_id}')
-        
+
         try:
             stream = await sync_to_async(Stream.objects.get)(id=self.stream_id, is_active=True)
-            url = stream.url
         except Stream.DoesNotExist:
             await self.send(text_data=json.dumps({
                 'type': 'error',
@@ -64,31 +129,50 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             }))
             await self.close()
             return
-        
-        if self.stream_id in active_streams:
-            client = active_streams[self.stream_id]
-            client.add_client()
+
+        if stream.delivery == 'passthrough':
+            # Nothing can be burned into passed-through video, boxes always come as detections
+            self.burned_in = False
+        try:
+            client, started = await join_stream(stream, burned_in=self.burned_in)
+        except RuntimeError:
+            # The server is shutting down; 1012 (service restart) tells the viewer to reconnect
             await self.send(text_data=json.dumps({
-                'type': 'status',
-                'message': 'Joined existing stream'
+                'type': 'error',
+                'message': 'Server is restarting'
             }))
+            await self.close(code=1012)
+            return
+        # The client this viewer counts on, which it leaves even if the stream restarted since
+        self.client = client
+
+        fragments = getattr(client, 'fragments', None)
+        if fragments:
+            # Init segment, then fMP4 fragments in order from the newest keyframe
+            config = passthrough_config()
+            self.frame_slot = FragmentSlot(
+                self._send_frame_bytes, fragments, on_init=self._send_passthrough_info,
+                max_in_flight=config.get('MAX_IN_FLIGHT', 4), max_behind=config.get('MAX_BEHIND', 4),
+                metrics=client.metrics,
+            )
+        # Frames for this viewer go through a latest-frame-wins slot, fed by the frame hub
+        # or by stream_frame messages from the channel layer
+        elif frame_fanout() == 'hub':
+            self.frame_slot = LatestFrameSlot(
+                self._send_frame_bytes, source=get_frame_hub().channel(self.stream_id), pick=self._pick_frame,
+                metrics=client.metrics, **self._trace_options(),
+            )
         else:
-            client = RTSPClient(self.stream_id, url, self.group_name)
-            active_streams[self.stream_id] = client
-            client.start()
-            await self.send(text_data=json.dumps({
-                    'type': 'status',
-                    'message': 'Started new stream'
-                }))
-            
-        # Make sure cleanup task is running
-        for task in asyncio.all_tasks():
-            if task.get_name() == 'cleanup_streams':
-                break
-        else:
-            # Start cleanup task if not already running
-            cleanup_task = asyncio.create_task(cleanup_streams())
-            cleanup_task.set_name('cleanup_streams')
+            self.frame_slot = LatestFrameSlot(self._send_frame_bytes, metrics=client.metrics, **self._trace_options())
+        self.frame_slot.start()
+
+        await self.send(text_data=json.dumps({
+            'type': 'status',
+            'message': 'Started new stream' if started else 'Joined existing stream',
+            'renditions': [default_rendition(), *client.extra_renditions],
+        }))
+        if requested_rendition and requested_rendition != self.rendition:
+            await self._select_rendition(requested_rendition)
 
     async def disconnect(self, close_code):
         """Handle client disconnection"""
@@ -99,16 +183,24 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
+
+        if self.playback_task:
+            self.playback_task.cancel()
+        if self.rendition_task:
+            self.rendition_task.cancel()
+        if self.playback_slot:
+            await self.playback_slot.close()
+
+        if getattr(self, 'frame_slot', None):
+            logger.info(f'Viewer stats for stream {self.stream_id}: {self.frame_slot.stats()}')
+            await self.frame_slot.close()
         
-        # Remove client from stream
-        def remove_client():
-            if self.stream_id in active_streams:
-                client = active_streams[self.stream_id]
-            client.remove_client()
-            if client.client_count == 0:
-                del active_streams[self.stream_id]
-                
-        await sync_to_async(remove_client)()
+        # Leave the stream; the stream manager stops it after its idle timeout
+        client = self.client
+        if client:
+            if self.rendition in client.extra_renditions:
+                client.rendition_demand.remove(self.rendition)
+            stream_manager.leave(client, burned_in=self.burned_in)
         logger.info(f'Client disconnected from stream {self.stream_id}')
     
     async def receive(self, text_data):
@@ -118,25 +210,222 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             message_type = text_data_json.get('type')
             
             if message_type == 'ping':
-                # Simple keepalive response
+                # Simple keepalive response, with "trace": <seq> also the echo of a traced frame
+                sent_at = self._trace_sent.pop(text_data_json.get('trace'), None)
+                if sent_at is not None:
+                    frame_tracer(self.stream_id).record('client', time.perf_counter() - sent_at)
                 await self.send(text_data=json.dumps({
                     'type': 'pong'
                 }))
+
+            elif message_type == 'ack':
+                # Viewer confirms received frames, enables ack-gated delivery
+                slot = self.playback_slot or self.frame_slot
+                if slot:
+                    slot.ack(int(text_data_json.get('count', 1)))
+
+            elif message_type == 'seek':
+                # Replay recorded frames from a unix timestamp, see settings.DVR
+                await self._start_playback(float(text_data_json.get('at', 0)), text_data_json.get('speed', 1))
+
+            elif message_type == 'live':
+                await self._stop_playback()
+
+            elif message_type == 'rendition':
+                await self._select_rendition(text_data_json.get('name'))
+
+            elif message_type == 'stats' and self.frame_slot:
+                await self.send(text_data=json.dumps({
+                    'type': 'viewer_stats',
+                    'stream_id': self.stream_id,
+                    **self.frame_slot.stats(),
+                    'rendition': self.frame_rendition,
+                    'stream': active_streams[self.stream_id].stats() if self.stream_id in active_streams else None,
+                }))
             
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, TypeError, ValueError):
             pass
     
+    async def _start_playback(self, at, speed):
+        """Pause the live feed and play recorded frames from `at` at 1x, 2x or 4x"""
+        client = active_streams.get(self.stream_id)
+        recorder = getattr(client, 'recorder', None)
+        if recorder is None or recorder.window() is None:
+            await self.send(text_data=json.dumps({
+                'type': 'stream_error',
+                'message': 'No recording available for this stream',
+                'stream_id': self.stream_id,
+            }))
+            return
+        if speed not in PLAYBACK_SPEEDS:
+            speed = 1
+
+        await self._stop_playback(resume_live=False)
+        if not self.playback_slot:
+            await self.frame_slot.close()
+            self.playback_slot = LatestFrameSlot(self._send_frame_bytes)
+            self.playback_slot.start()
+        self.playback_task = asyncio.create_task(self._playback(recorder, at, speed))
+
+    async def _stop_playback(self, resume_live=True):
+        task, self.playback_task = self.playback_task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if resume_live:
+            await self._resume_live()
+
+    async def _resume_live(self):
+        if self.playback_slot:
+            await self.playback_slot.close()
+            self.playback_slot = None
+            self.frame_slot.start()
+            await self.send(text_data=json.dumps({'type': 'playback', 'live': True, 'stream_id': self.stream_id}))
+
+    async def _playback(self, recorder, at, speed):
+        """Feed recorded frames to the playback slot at their recorded pace / speed, until caught up with live"""
+        frame = recorder.frame_at(at)
+        oldest, newest = recorder.window() or (None, None)
+        await self.send(text_data=json.dumps({
+            'type': 'playback',
+            'live': False,
+            'at': frame.captured_at if frame else None,
+            'speed': speed,
+            'window': [oldest, newest],
+            'stream_id': self.stream_id,
+        }))
+        loop = asyncio.get_running_loop()
+        started, first_capture = loop.time(), frame.captured_at if frame else 0.0
+        while frame:
+            delay = (frame.captured_at - first_capture) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.playback_slot.offer(frame.data, frame.captured_at)
+            frame = recorder.next_after(frame.captured_at)
+        # Caught up with the newest recorded frame: back to the live feed
+        self.playback_task = None
+        await self._resume_live()
+
+    async def _select_rendition(self, name):
+        """
+            Move this viewer to another rendition. Its frames keep coming from the current
+            one until the new one is being encoded, which may take FFmpeg a moment to start
+        """
+        client = active_streams.get(self.stream_id)
+        if client is None:
+            return
+        if name != default_rendition() and name not in client.extra_renditions:
+            await self.send(text_data=json.dumps({
+                'type': 'stream_error',
+                'message': f'Unknown rendition {name!r}',
+                'stream_id': self.stream_id,
+            }))
+            return
+        if name == self.rendition:
+            return
+
+        if self.rendition in client.extra_renditions:
+            client.rendition_demand.remove(self.rendition)
+        if name in client.extra_renditions:
+            client.rendition_demand.add(name)
+        self.rendition = name
+        if self.rendition_task:
+            self.rendition_task.cancel()
+            self.rendition_task = None
+        if frame_fanout() == 'hub':
+            self.rendition_task = asyncio.create_task(self._follow_rendition(name))
+        # With channel layer fan-out stream_frame switches on the first frame of the new rendition
+
+    async def _follow_rendition(self, name):
+        """Wait for the rendition's first frame, then feed this viewer from its hub channel"""
+        channel = get_frame_hub().channel(self.stream_id, None if name == default_rendition() else name)
+        channel.subscribe()
+        try:
+            await channel.next_frame(0)
+        finally:
+            channel.unsubscribe()
+        slot = LatestFrameSlot(self._send_frame_bytes, source=channel, pick=self._pick_frame,
+                               metrics=stream_metrics(self.stream_id),
+                               # Frames of other renditions share the main output's seq, only it is traced
+                               **(self._trace_options() if name == default_rendition() else {}))
+        previous, self.frame_slot = self.frame_slot, slot
+        if not self.playback_slot:
+            # During a replay the new slot starts when the viewer returns to live
+            await previous.close()
+            slot.start()
+        self.rendition_task = None
+        await self._rendition_switched(name)
+
+    async def _rendition_switched(self, name):
+        self.frame_rendition = name
+        client = active_streams.get(self.stream_id)
+        await self.send(text_data=json.dumps({
+            'type': 'rendition',
+            'name': name,
+            # Detection boxes are in pixels of the main output
+            'detection_width': client.width if client else None,
+            'stream_id': self.stream_id,
+        }))
+
+    def _pick_frame(self, frame):
+        """Choose the bytes of a shared hub Frame this viewer gets"""
+        if self.burned_in and frame.annotated:
+            return frame.annotated
+        return frame.data
+
     async def stream_frame(self, event):
-        """Send a video frame to the client"""
+        """Hand a video frame to this viewer's delivery slot, never blocking the channel layer"""
+        rendition = event.get('rendition') or default_rendition()
+        if rendition != self.frame_rendition:
+            if rendition != self.rendition:
+                return
+            await self._rendition_switched(rendition)
+        frame = event['frame']
+        if self.burned_in and event.get('annotated_frame'):
+            frame = event['annotated_frame']
+        self.frame_slot.offer(frame, event.get('captured_at'), None if event.get('rendition') else event.get('seq'))
+
+    async def stream_detections(self, event):
+        """Forward face detections to sidecar viewers, which draw the overlay themselves"""
+        # Boxes are only burned into the main output, viewers of other renditions get them as messages
+        if self.burned_in and self.frame_rendition == default_rendition():
+            return
         try:
-            # await self.send(text_data=json.dumps({
-            #     'type': 'stream_frame',
-            #     'frame': event['frame'],
-            #     'stream_id': event['stream_id']
-            # }))
-            await self.send(bytes_data=event['frame'])
+            await self.send(text_data=json.dumps({
+                'type': 'detections',
+                'seq': event['seq'],
+                'faces': event['faces'],
+                'stream_id': event['stream_id']
+            }))
         except Exception as e:
-            logger.error(f"Error sending frame to client: {str(e)}")
+            logger.error(f"Error sending detections to client: {str(e)}")
+
+    def _trace_options(self):
+        """LatestFrameSlot options that trace this viewer's hop and send of the sampled frames"""
+        return {
+            'tracer': frame_tracer(self.stream_id),
+            'on_traced': self._send_trace if self.trace_echo else None,
+        }
+
+    async def _send_trace(self, seq):
+        """Sent right before a sampled frame, the viewer pings back with its seq once it drew it"""
+        self._trace_sent[seq] = time.perf_counter()
+        if len(self._trace_sent) > 8:
+            # Echoes that never came
+            del self._trace_sent[next(iter(self._trace_sent))]
+        await self.send(text_data=json.dumps({'type': 'trace', 'seq': seq}))
+
+    async def _send_frame_bytes(self, frame_bytes):
+        await self.send(bytes_data=frame_bytes)
+
+    async def _send_passthrough_info(self, mime):
+        """Tell a passthrough viewer to (re)create its MediaSource buffer, the init segment follows"""
+        await self.send(text_data=json.dumps({
+            'type': 'passthrough',
+            'mime': mime,
+            'analysis_width': passthrough_config().get('ANALYSIS_WIDTH', 640),
+            'stream_id': self.stream_id,
+        }))
     
     async def stream_status(self, event):
         """Send status message to client"""
@@ -144,11 +433,21 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({
                 'type': 'stream_status',
                 'message': event['message'],
+                'state': event.get('state'),
                 'stream_id': event['stream_id']
             }))
         except Exception as e:
             logger.error(f"Error sending status to client: {str(e)}")
     
+    async def stream_restarted(self, event):
+        """The stream now delivers in another format, this viewer has to connect again"""
+        await self.send(text_data=json.dumps({
+            'type': 'stream_error',
+            'message': 'Stream settings changed, reconnect to watch it',
+            'stream_id': event['stream_id']
+        }))
+        await self.close()
+
     async def stream_error(self, event):
         """Send error message to client"""
         try:
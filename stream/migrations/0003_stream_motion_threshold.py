@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0002_alter_stream_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='motion_threshold',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
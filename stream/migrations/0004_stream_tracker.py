@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0003_stream_motion_threshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='detection_interval',
+            field=models.PositiveSmallIntegerField(default=5),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='tracker',
+            field=models.CharField(blank=True, choices=[('', 'None (detect every frame)'), ('iou', 'IoU association'), ('flow', 'Optical flow')], default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0004_stream_tracker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='analyzer',
+            field=models.CharField(choices=[('none', 'Disabled (view only)'), ('mtcnn', 'MTCNN'), ('haar', 'Haar cascade'), ('yunet', 'YuNet (OpenCV DNN)')], default='mtcnn', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='analyzer_params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0005_stream_analyzer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='last_transport',
+            field=models.CharField(blank=True, default='', editable=False, max_length=8),
+        ),
+    ]
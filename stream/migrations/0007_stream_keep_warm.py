@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0006_stream_last_transport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='idle_timeout',
+            field=models.PositiveIntegerField(default=60),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='keep_warm',
+            field=models.CharField(choices=[('on_demand', 'On demand'), ('idle', 'Keep warm for idle_timeout'), ('always', 'Always on')], default='on_demand', max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0007_stream_keep_warm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='delivery',
+            field=models.CharField(choices=[('mjpeg', 'MJPEG (transcoded)'), ('passthrough', 'H.264 passthrough (fMP4)')], default='mjpeg', max_length=16),
+        ),
+    ]
@@ -6,6 +6,42 @@ class Stream(models.Model):
     name = models.CharField(max_length=255)
     url = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
+    # Fraction of the frame that must change before face detection runs again.
+    # Empty uses FACE_DETECTION['MOTION_THRESHOLD'], 0 runs detection on every opportunity.
+    motion_threshold = models.FloatField(null=True, blank=True)
+    # Move face boxes with a cheap tracker between detector keyframes
+    tracker = models.CharField(max_length=16, blank=True, default='', choices=[
+        ('', 'None (detect every frame)'),
+        ('iou', 'IoU association'),
+        ('flow', 'Optical flow'),
+    ])
+    detection_interval = models.PositiveSmallIntegerField(default=5)
+    # Analyzer backend and its keyword arguments (see stream/utils/analyzers.py), 'none' only views the stream
+    analyzer = models.CharField(max_length=16, default='mtcnn', choices=[
+        ('none', 'Disabled (view only)'),
+        ('mtcnn', 'MTCNN'),
+        ('haar', 'Haar cascade'),
+        ('yunet', 'YuNet (OpenCV DNN)'),
+    ])
+    analyzer_params = models.JSONField(default=dict, blank=True)
+    # What happens after the last viewer leaves: 'on_demand' stops after a short grace period,
+    # 'idle' keeps the stream running (latest frame ready, no analysis) for idle_timeout seconds,
+    # 'always' runs it without viewers too. See WARM_STREAMS in settings.
+    keep_warm = models.CharField(max_length=16, default='on_demand', choices=[
+        ('on_demand', 'On demand'),
+        ('idle', 'Keep warm for idle_timeout'),
+        ('always', 'Always on'),
+    ])
+    idle_timeout = models.PositiveIntegerField(default=60)
+    # How viewers get the video: 'mjpeg' transcodes to JPEG frames (boxes can be burned in),
+    # 'passthrough' remuxes the camera's H.264 into fragmented MP4 for MediaSource playback,
+    # analysis then only sees keyframes. See RTSP_PASSTHROUGH in settings.
+    delivery = models.CharField(max_length=16, default='mjpeg', choices=[
+        ('mjpeg', 'MJPEG (transcoded)'),
+        ('passthrough', 'H.264 passthrough (fMP4)'),
+    ])
+    # RTSP transport that last delivered frames, tried first on the next start
+    last_transport = models.CharField(max_length=8, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
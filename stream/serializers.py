@@ -1,8 +1,22 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Stream
+from .utils.analyzers import analyzer_defaults, validate_analyzer
 
 class StreamSerializer(serializers.ModelSerializer):
     class Meta:
         model = Stream
-        fields = ['id', 'name', 'url', 'is_active', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at'] 
\ No newline at end of file
+        fields = ['id', 'name', 'url', 'is_active', 'motion_threshold', 'tracker', 'detection_interval',
+                  'analyzer', 'analyzer_params', 'keep_warm', 'idle_timeout', 'delivery', 'last_transport',
+                  'created_at', 'updated_at']
+        read_only_fields = ['last_transport', 'created_at', 'updated_at']
+
+    def validate(self, attrs):
+        analyzer = attrs.get('analyzer', getattr(self.instance, 'analyzer', 'mtcnn'))
+        params = attrs.get('analyzer_params', getattr(self.instance, 'analyzer_params', {}))
+        if analyzer != 'none':
+            try:
+                validate_analyzer(analyzer, params, analyzer_defaults(getattr(settings, 'FACE_DETECTION', {})))
+            except ValueError as e:
+                raise serializers.ValidationError({'analyzer_params': str(e)})
+        return attrs
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from stream.utils.frame_hub import FrameHub
+from stream.utils.frame_slot import LatestFrameSlot
+
+
+def test_every_viewer_gets_the_same_frame_object():
+    async def run():
+        hub = FrameHub()
+        received = [[], [], []]
+        slots = []
+        for frames in received:
+            async def send(frame_bytes, frames=frames):
+                frames.append(frame_bytes)
+            slot = LatestFrameSlot(send, source=hub.channel('1'))
+            slot.start()
+            slots.append(slot)
+        await asyncio.sleep(0)
+
+        frame = b'\xff\xd8frame\xff\xd9'
+        hub.channel('1').publish(frame, seq=1)
+        await asyncio.sleep(0.01)
+        stats = hub.stats()
+        for slot in slots:
+            await slot.close()
+        return frame, received, stats, hub.stats()
+
+    frame, received, stats, after = asyncio.run(run())
+    assert all(len(frames) == 1 and frames[0] is frame for frames in received)
+    assert stats == {'1': {'version': 1, 'subscribers': 3}}
+    assert after['1']['subscribers'] == 0
+
+
+def test_publishing_from_another_thread_wakes_viewers_with_the_newest_frame():
+    async def run():
+        hub = FrameHub()
+        channel = hub.channel('1')
+        got = []
+
+        async def send(frame_bytes):
+            got.append(frame_bytes)
+
+        slot = LatestFrameSlot(send, source=channel)
+        slot.start()
+        await asyncio.sleep(0)
+
+        def ingest():
+            # Published faster than the loop picks them up, viewers only see the last one
+            for seq in range(1, 11):
+                channel.publish(str(seq).encode(), seq=seq)
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.01)
+        await slot.close()
+        return got, slot.stats()
+
+    got, stats = asyncio.run(run())
+    assert got == [b'10']
+    assert stats['frames_delivered'] == 1
+
+
+def test_forget_drops_every_rendition_of_a_stream():
+    hub = FrameHub()
+    hub.channel('1')
+    hub.channel('1', 'low')
+    hub.channel('2')
+    hub.forget('1')
+    assert list(hub.stats()) == ['2']
@@ -0,0 +1,71 @@
+import asyncio
+
+from stream.utils.frame_slot import LatestFrameSlot
+
+
+class BlockingSend:
+    """send() for a slot that records frames and holds each one until released"""
+
+    def __init__(self):
+        self.sent = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, frame_bytes):
+        self.sent.append(frame_bytes)
+        self.started.set()
+        await self.release.wait()
+        self.release.clear()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_slow_viewer_gets_the_newest_frame_and_counts_drops():
+    async def run():
+        send = BlockingSend()
+        slot = LatestFrameSlot(send)
+        slot.start()
+        slot.offer(b'1')
+        await send.started.wait()
+        # Frame 1 is being sent, 2 and 3 arrive meanwhile: only 3 is kept
+        slot.offer(b'2')
+        slot.offer(b'3')
+        send.release.set()
+        await settle()
+        send.release.set()
+        await settle()
+        await slot.close()
+        return send.sent, slot.stats()
+
+    sent, stats = asyncio.run(run())
+    assert sent == [b'1', b'3']
+    assert stats['frames_delivered'] == 2
+    assert stats['frames_dropped'] == 1
+
+
+def test_acks_limit_frames_in_flight():
+    async def run():
+        sent = []
+
+        async def send(frame_bytes):
+            sent.append(frame_bytes)
+
+        slot = LatestFrameSlot(send, max_in_flight=2)
+        slot.ack(0)    # The viewer acks, from now on at most 2 frames go unacked
+        slot.start()
+        for frame in (b'1', b'2', b'3'):
+            slot.offer(frame)
+            await settle()
+        stalled = list(sent)
+        slot.ack()
+        await settle()
+        await slot.close()
+        return stalled, sent, slot.stats()
+
+    stalled, sent, stats = asyncio.run(run())
+    assert stalled == [b'1', b'2']
+    assert sent == [b'1', b'2', b'3']
+    assert stats['acks_enabled'] and stats['in_flight'] == 2
@@ -0,0 +1,22 @@
+from stream.utils.reconnect import ReconnectBackoff
+
+
+def test_delays_double_up_to_the_maximum_with_jitter():
+    backoff = ReconnectBackoff(initial=0.5, maximum=4.0, reset_after=30.0)
+    for ceiling in (0.5, 1.0, 2.0, 4.0, 4.0, 4.0):
+        delay = backoff.next_delay(ran_for=0.1)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_a_connection_that_lasted_starts_over():
+    backoff = ReconnectBackoff(initial=0.5, maximum=30.0, reset_after=10.0)
+    for _ in range(5):
+        backoff.next_delay(ran_for=1.0)
+    assert backoff.failures == 5
+    assert backoff.next_delay(ran_for=10.0) <= 0.5
+    assert backoff.failures == 1
+
+
+def test_streams_that_broke_together_do_not_retry_together():
+    delays = {ReconnectBackoff(initial=8.0).next_delay() for _ in range(20)}
+    assert len(delays) > 1
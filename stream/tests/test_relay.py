@@ -0,0 +1,26 @@
+import pytest
+from django.test import RequestFactory
+
+from stream import views
+from stream.utils.stream_relay import RELAY_TOKEN_HEADER
+
+HEADER = f'HTTP_{RELAY_TOKEN_HEADER.upper().replace("-", "_")}'
+
+
+@pytest.fixture
+def relay():
+    view = views.StreamViewSet.as_view({'get': 'relay'})
+    return lambda **headers: view(RequestFactory().get('/api/streams/1/relay/', **headers), pk=1)
+
+
+def test_relay_is_refused_without_a_configured_token(settings, relay):
+    settings.STREAM_CLUSTER = {**settings.STREAM_CLUSTER, 'ENABLED': True, 'RELAY_TOKEN': ''}
+    assert relay().status_code == 403
+    assert relay(**{HEADER: ''}).status_code == 403
+
+
+def test_relay_checks_the_token(settings, relay):
+    settings.STREAM_CLUSTER = {**settings.STREAM_CLUSTER, 'ENABLED': True, 'RELAY_TOKEN': 'secret'}
+    assert relay(**{HEADER: 'wrong'}).status_code == 403
+    # Right token, but this worker does not own stream 1
+    assert relay(**{HEADER: 'secret'}).status_code == 409
@@ -0,0 +1,99 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+from django.test import RequestFactory
+
+from stream import views
+from stream.models import Stream
+from stream.utils import snapshots as snapshots_module
+from stream.utils.snapshots import Snapshots
+
+
+def jpeg(width=640, height=360, shade=128):
+    ok, encoded = cv2.imencode('.jpg', np.full((height, width, 3), shade, np.uint8))
+    return encoded.tobytes()
+
+
+@pytest.fixture
+def grabs(monkeypatch):
+    """Replaces the FFmpeg grab of a stream that is not running, counts the calls"""
+    calls = []
+
+    def grab_frame(stream, timeout, max_width):
+        calls.append(stream.id)
+        time.sleep(0.1)
+        return grabs.frame
+    grabs = SimpleNamespace(calls=calls, frame=jpeg())
+    monkeypatch.setattr(snapshots_module, 'grab_frame', grab_frame)
+    return grabs
+
+
+def test_concurrent_cold_requests_share_one_grab(grabs):
+    snapshots = Snapshots({'COLD_TTL_S': 10.0})
+    stream = SimpleNamespace(id='cold', url='rtsp://camera', last_transport='tcp')
+    results = [None] * 20
+    barrier = threading.Barrier(len(results))
+
+    def request(i):
+        barrier.wait()
+        results[i] = snapshots.get(stream, None, 160)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert grabs.calls == ['cold']
+    assert None not in results and len({snapshot.etag for snapshot in results}) == 1
+    assert snapshots.stats()['grabs_started'] == 1
+
+
+def test_failed_grab_is_not_retried_within_the_cold_ttl(grabs):
+    grabs.frame = None
+    snapshots = Snapshots({'COLD_TTL_S': 10.0})
+    stream = SimpleNamespace(id='dead', url='rtsp://camera', last_transport='tcp')
+    assert snapshots.get(stream) is None
+    assert snapshots.get(stream) is None
+    assert grabs.calls == ['dead']
+
+
+def test_running_stream_thumbnail_is_cached_per_width():
+    client = SimpleNamespace(is_running=True, frame_channel=None, frame_buffer=jpeg())
+    stream = SimpleNamespace(id='running', url='', last_transport='')
+    snapshots = Snapshots({'TTL_S': 60.0})
+    small = snapshots.get(stream, client, 160)
+    assert cv2.imdecode(np.frombuffer(small.data, np.uint8), cv2.IMREAD_COLOR).shape[1] == 160
+    client.frame_buffer = jpeg(shade=0)
+    assert snapshots.get(stream, client, 160) is small
+    assert snapshots.get(stream, client, 320) is not small
+
+
+def test_cache_stays_within_its_byte_budget():
+    client = SimpleNamespace(is_running=True, frame_channel=None, frame_buffer=None)
+    snapshots = Snapshots({'TTL_S': 60.0, 'CACHE_MB': 0.05})
+    for i in range(50):
+        client.frame_buffer = jpeg(shade=i * 5)
+        snapshots.get(SimpleNamespace(id=f'grid_{i}', url='', last_transport=''), client, 320)
+    stats = snapshots.stats()
+    assert stats['bytes'] <= stats['max_bytes']
+    assert stats['evictions'] > 0
+
+
+@pytest.mark.django_db
+def test_if_none_match_answers_304(monkeypatch):
+    stream = Stream.objects.create(name='snapshot', url='rtsp://camera', analyzer='none')
+    client = SimpleNamespace(is_running=True, frame_channel=None, frame_buffer=jpeg())
+    monkeypatch.setitem(views.active_streams, str(stream.id), client)
+    view = views.StreamViewSet.as_view({'get': 'snapshot'})
+    factory = RequestFactory()
+    path = f'/api/streams/{stream.id}/snapshot/'
+
+    first = view(factory.get(path, {'width': 160}), pk=stream.id)
+    again = view(factory.get(path, {'width': 160}, HTTP_IF_NONE_MATCH=first['ETag']), pk=stream.id)
+    assert first.status_code == 200 and first['Content-Type'] == 'image/jpeg'
+    assert again.status_code == 304 and again.content == b''
+    assert again['ETag'] == first['ETag']
@@ -0,0 +1,35 @@
+import time
+
+from stream.utils.stream_leases import SQLiteLeaseStore
+
+
+def test_one_owner_per_stream(tmp_path):
+    leases = SQLiteLeaseStore(str(tmp_path / 'leases.sqlite3'), ttl=10.0)
+    assert leases.acquire('1', 'a', 'host-a:8000').owner == 'a'
+    lease = leases.acquire('1', 'b', 'host-b:8000')
+    assert (lease.owner, lease.address) == ('a', 'host-a:8000')
+    assert leases.renew('1', 'a')
+    assert not leases.renew('1', 'b')
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / 'leases.sqlite3')
+    # Two workers sharing one lease file
+    worker_a, worker_b = SQLiteLeaseStore(path, ttl=0.2), SQLiteLeaseStore(path, ttl=0.2)
+    worker_a.acquire('1', 'a', 'host-a:8000')
+    time.sleep(0.3)
+    assert worker_b.holder('1') is None
+    assert worker_b.acquire('1', 'b', 'host-b:8000').owner == 'b'
+    # The old owner finds out on its next renewal
+    assert not worker_a.renew('1', 'a')
+    assert worker_a.holder('1').owner == 'b'
+
+
+def test_released_lease_is_free(tmp_path):
+    leases = SQLiteLeaseStore(str(tmp_path / 'leases.sqlite3'), ttl=10.0)
+    leases.acquire('1', 'a', 'host-a:8000')
+    leases.release('1', 'b')
+    assert leases.holder('1').owner == 'a'
+    leases.release('1', 'a')
+    assert leases.holder('1') is None
+    assert leases.acquire('1', 'b', 'host-b:8000').owner == 'b'
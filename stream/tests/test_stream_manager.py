@@ -0,0 +1,174 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from stream.utils import frame_trace, metrics, passthrough
+from stream.utils.frame_hub import get_frame_hub
+from stream.utils.snapshots import get_snapshots
+from stream.utils.stream_manager import StreamManager
+from stream.utils.warm_streams import idle_timeout_for
+
+
+class FakeClient:
+    """Stands in for an RTSPClient; `events` records when each stream's "FFmpeg" starts and stops"""
+
+    def __init__(self, stream, events):
+        self.stream_id = str(stream.id)
+        self.idle_timeout = idle_timeout_for(stream)
+        self.events = events
+        self.is_running = False
+        self.client_count = 0
+        self.burned_in_clients = 0
+        self.rendition_demand = set()
+        self.on_stopped = None
+
+    def start(self, burned_in=True):
+        self.add_client(burned_in)
+        self.start_warm()
+
+    def start_warm(self):
+        if not self.is_running:
+            self.is_running = True
+            self.events.append(('start', self))
+
+    def add_client(self, burned_in=True):
+        self.client_count += 1
+        self.burned_in_clients += int(burned_in)
+
+    def remove_client(self, burned_in=True):
+        self.client_count = max(0, self.client_count - 1)
+        if burned_in:
+            self.burned_in_clients = max(0, self.burned_in_clients - 1)
+
+    async def stop(self):
+        if self.is_running:
+            await asyncio.sleep(0.01)    # FFmpeg takes a moment to exit
+            self.is_running = False
+            self.events.append(('stop', self))
+
+    def shutdown(self):
+        self.is_running = False
+
+
+def make_stream(**fields):
+    return SimpleNamespace(**{'id': 1, 'url': 'rtsp://camera/1', 'keep_warm': 'idle', 'idle_timeout': 0.05,
+                              'delivery': 'mjpeg', **fields})
+
+
+@pytest.fixture
+def manager():
+    events = []
+    manager = StreamManager(lambda stream: FakeClient(stream, events),
+                            lambda stream: {'url': stream.url, 'delivery': stream.delivery})
+    manager.events = events
+
+    async def start_always_on():
+        pass
+    manager.start_always_on = start_always_on
+    yield manager
+    manager._closed = True
+
+
+def test_viewers_share_one_client_until_the_idle_timeout(manager):
+    async def run():
+        stream = make_stream()
+        first, started = await manager.join(stream)
+        second, joined_started = await manager.join(stream)
+        assert (started, joined_started) == (True, False)
+        assert first is second and first.client_count == 2
+        manager.leave(first)
+        manager.leave(first)
+        assert manager.stats()['idle_timers'] == ['1']
+        await asyncio.sleep(0.1)
+        return first
+
+    client = asyncio.run(run())
+    assert not client.is_running
+    assert manager.clients == {}
+    assert manager.stops == 1
+
+
+def test_viewer_coming_back_cancels_the_idle_timeout(manager):
+    async def run():
+        stream = make_stream()
+        client, _ = await manager.join(stream)
+        manager.leave(client)
+        again, started = await manager.join(stream)
+        await asyncio.sleep(0.1)
+        return client, again, started
+
+    client, again, started = asyncio.run(run())
+    assert again is client and not started
+    assert client.is_running
+    assert manager.stats()['idle_timers'] == []
+
+
+def test_settings_change_restarts_the_stream_and_keeps_its_viewers(manager):
+    async def run():
+        stream = make_stream()
+        old, _ = await manager.join(stream)
+        await manager.join(stream)
+        await manager.apply(make_stream(url='rtsp://camera/moved'))
+        new = manager.clients['1']
+        counts = new.client_count
+        # The viewers leave the client they joined, the count moves with them
+        manager.leave(old)
+        manager.leave(old)
+        await asyncio.sleep(0.1)
+        return old, new, counts
+
+    old, new, counts = asyncio.run(run())
+    assert new is not old and counts == 2
+    # One FFmpeg per camera: the old one stops before the new one starts
+    assert manager.events == [('start', old), ('stop', old), ('start', new), ('stop', new)]
+    assert manager.restarts == 1
+    assert manager.clients == {}
+
+
+def test_keep_warm_change_applies_in_place(manager):
+    async def run():
+        client, _ = await manager.join(make_stream(idle_timeout=60))
+        manager.leave(client)
+        await manager.apply(make_stream(keep_warm='always'))
+        return client
+
+    client = asyncio.run(run())
+    assert manager.clients['1'] is client and client.is_running
+    assert client.idle_timeout is None
+    assert manager.stats()['idle_timers'] == []
+    assert manager.restarts == 0
+
+
+def test_no_stream_starts_after_close(manager):
+    async def run():
+        client, _ = await manager.join(make_stream(idle_timeout=60))
+        await manager.close()
+        with pytest.raises(RuntimeError):
+            await manager.join(make_stream(id=2))
+        return client
+
+    client = asyncio.run(run())
+    assert not client.is_running
+    assert manager.clients == {}
+
+
+def test_deleted_stream_is_stopped_and_forgotten(manager):
+    async def run():
+        client, _ = await manager.join(make_stream(id=9001))
+        get_frame_hub().channel('9001', 'low')
+        metrics.stream_metrics('9001')
+        frame_trace.frame_tracer('9001')
+        passthrough.fragment_log('9001')
+        get_snapshots()._failed['9001'] = float('inf')
+        manager.stream_deleted(9001)
+        await asyncio.sleep(0.1)
+        return client
+
+    client = asyncio.run(run())
+    assert not client.is_running
+    assert '9001' not in get_frame_hub().stats() and '9001:low' not in get_frame_hub().stats()
+    assert '9001' not in metrics._stream_metrics
+    assert '9001' not in frame_trace._tracers
+    assert '9001' not in passthrough._fragment_logs
+    assert '9001' not in get_snapshots()._failed
@@ -0,0 +1,236 @@
+import inspect
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from .mtcnn_detector import MTCNNDetector, _REDUCED_DECODE_FLAGS
+
+logger = logging.getLogger('analyzers')
+
+_REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class AnalysisResult:
+    """Everything a chain of analyzers produced for one frame"""
+    __slots__ = ('faces', 'frame', 'annotations')
+
+    def __init__(self):
+        self.faces = []           # [{'box': [x, y, w, h], 'confidence': float}] in frame coordinates
+        self.frame = None         # Modified JPEG, None while no analyzer changed the frame
+        self.annotations = {}     # Anything else, keyed by analyzer name
+
+
+class Analyzer:
+    """
+        A step of the analysis pipeline. `analyze` gets the JPEG frame (the
+        modified one if an earlier analyzer replaced it) and the result so far,
+        adds its annotations and/or sets result.frame, and returns False when the
+        frame could not be analyzed at all.
+
+        Instances are not shared between threads: every detection worker builds
+        its own chain, so analyzers may keep models and buffers in `self`.
+    """
+    name = None
+
+    def analyze(self, frame, result):
+        raise NotImplementedError
+
+
+class MTCNNAnalyzer(Analyzer):
+    """MTCNN face detector, accurate but the slowest backend on CPU"""
+    name = 'mtcnn'
+
+    def __init__(self, decode_scale=1, min_confidence=0.7):
+        self.detector = MTCNNDetector(decode_scale=decode_scale, min_confidence=min_confidence)
+
+    def analyze(self, frame, result):
+        faces = self.detector.find_faces(frame)
+        if faces is None:
+            return False
+        result.faces.extend(faces)
+        return True
+
+
+class HaarCascadeAnalyzer(Analyzer):
+    """
+        OpenCV Viola-Jones cascade using the models bundled with opencv-python, so
+        it works without any download. Cost scales with the image area and the
+        scale_factor/min_size search, and with how busy the scene is; it only finds
+        frontal, reasonably lit faces. The default cascade's window is 24 px, so at
+        the default half-size decode faces under 48 px are never found anyway.
+        Cascades have no calibrated score, so the confidence reported is the share
+        of neighbouring windows that voted for the face.
+    """
+    name = 'haar'
+
+    def __init__(self, decode_scale=2, cascade='haarcascade_frontalface_default.xml',
+                 scale_factor=1.2, min_neighbors=5, min_size=48):
+        if decode_scale not in _REDUCED_GRAYSCALE_FLAGS:
+            raise ValueError(f"decode_scale must be one of {sorted(_REDUCED_GRAYSCALE_FLAGS)}")
+        path = cascade if os.path.isabs(cascade) else os.path.join(cv2.data.haarcascades, cascade)
+        self.classifier = cv2.CascadeClassifier(path)
+        if self.classifier.empty():
+            raise ValueError(f"Could not load Haar cascade {path}")
+        self.decode_scale = decode_scale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # min_size is in full frame pixels, the cascade runs on the reduced decode
+        self.min_size = max(1, int(min_size) // decode_scale)
+
+    def analyze(self, frame, result):
+        gray = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), _REDUCED_GRAYSCALE_FLAGS[self.decode_scale])
+        if gray is None or gray.size == 0:
+            logger.error("Failed to decode image from bytes (corrupted JPEG?).")
+            return False
+        gray = cv2.equalizeHist(gray)
+        boxes, neighbours = self.classifier.detectMultiScale2(
+            gray,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=(self.min_size, self.min_size),
+        )
+        scale = self.decode_scale
+        for box, votes in zip(boxes, neighbours):
+            result.faces.append({
+                'box': [int(v) * scale for v in box],
+                'confidence': round(float(votes) / (votes + self.min_neighbors), 2),
+            })
+        return True
+
+
+class YuNetAnalyzer(Analyzer):
+    """
+        OpenCV's DNN face detector (cv2.FaceDetectorYN). The YuNet ONNX model is not
+        part of opencv-python; download face_detection_yunet_2023mar.onnx from
+        opencv_zoo and point FACE_DETECTION['YUNET_MODEL'] (or `model`) at it.
+    """
+    name = 'yunet'
+
+    def __init__(self, model='', decode_scale=1, min_confidence=0.7, nms_threshold=0.3, top_k=50):
+        if decode_scale not in _REDUCED_DECODE_FLAGS:
+            raise ValueError(f"decode_scale must be one of {sorted(_REDUCED_DECODE_FLAGS)}")
+        if not model or not os.path.exists(model):
+            raise ValueError(f"YuNet model not found at '{model}'")
+        self.detector = cv2.FaceDetectorYN.create(model, '', (320, 320), min_confidence, nms_threshold, top_k)
+        self.decode_scale = decode_scale
+        self._input_size = None
+
+    def analyze(self, frame, result):
+        image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), _REDUCED_DECODE_FLAGS[self.decode_scale])
+        if image is None or image.size == 0:
+            logger.error("Failed to decode image from bytes (corrupted JPEG?).")
+            return False
+        size = (image.shape[1], image.shape[0])
+        if size != self._input_size:
+            self.detector.setInputSize(size)
+            self._input_size = size
+        _, faces = self.detector.detect(image)
+        scale = self.decode_scale
+        # Rows are x, y, w, h, five landmark points, score
+        for row in faces if faces is not None else []:
+            result.faces.append({
+                'box': [int(v) * scale for v in row[:4]],
+                'confidence': float(row[14]),
+            })
+        return True
+
+
+class AnalyzerChain:
+    """Runs analyzers in order over a frame, each one seeing the result of the previous ones"""
+
+    def __init__(self, analyzers):
+        self.analyzers = list(analyzers)
+
+    def run(self, frame):
+        """Returns an AnalysisResult, or None if an analyzer failed on the frame"""
+        result = AnalysisResult()
+        for analyzer in self.analyzers:
+            if not analyzer.analyze(result.frame or frame, result):
+                return None
+        return result
+
+
+ANALYZER_BACKENDS = {
+    MTCNNAnalyzer.name: MTCNNAnalyzer,
+    HaarCascadeAnalyzer.name: HaarCascadeAnalyzer,
+    YuNetAnalyzer.name: YuNetAnalyzer,
+}
+
+# Default chain when a stream does not pick one
+DEFAULT_ANALYZER = 'mtcnn'
+
+
+def analyzer_spec(backend, params=None):
+    """
+        Hashable, picklable description of a one-step chain, used as the cache key
+        for chains in the detection workers. Chains are tuples of these steps.
+    """
+    return ((backend, json.dumps(params or {}, sort_keys=True)),)
+
+
+def analyzer_defaults(config):
+    """Process-wide analyzer keyword arguments from settings.FACE_DETECTION"""
+    return {
+        'mtcnn': {'decode_scale': config.get('DECODE_SCALE', 1)},
+        'yunet': {'model': config.get('YUNET_MODEL', '')},
+    }
+
+
+def validate_analyzer(backend, params, defaults=None):
+    """
+        Raise ValueError if the backend is unknown, does not take these parameters,
+        or needs a model file that is not there. `defaults` as for build_chain.
+    """
+    if backend not in ANALYZER_BACKENDS:
+        raise ValueError(f"Unknown analyzer '{backend}', expected one of {sorted(ANALYZER_BACKENDS)}")
+    if not isinstance(params, dict):
+        raise ValueError("Analyzer parameters must be an object")
+    accepted = inspect.signature(ANALYZER_BACKENDS[backend]).parameters
+    unknown = sorted(set(params) - set(accepted))
+    if unknown:
+        raise ValueError(f"Analyzer '{backend}' does not take {', '.join(unknown)}; it takes {', '.join(accepted)}")
+    if backend == YuNetAnalyzer.name:
+        model = {**(defaults or {}).get(backend, {}), **params}.get('model', '')
+        if not model or not os.path.isfile(model):
+            raise ValueError(
+                f"YuNet needs its ONNX model, which opencv-python does not include: download "
+                f"face_detection_yunet_2023mar.onnx from opencv_zoo and set FACE_DETECTION_YUNET_MODEL "
+                f"(or the 'model' parameter) to its path" + (f"; '{model}' does not exist" if model else ""))
+
+
+def build_chain(spec, defaults=None):
+    """
+        Instantiate an AnalyzerChain from a spec. `defaults` maps a backend to
+        process-wide keyword arguments that the stream's own parameters override,
+        e.g. {'mtcnn': {'decode_scale': FACE_DETECTION['DECODE_SCALE']}}.
+    """
+    analyzers = []
+    for backend, params_json in spec:
+        params = json.loads(params_json)
+        validate_analyzer(backend, params, defaults)
+        params = {**(defaults or {}).get(backend, {}), **params}
+        analyzers.append(ANALYZER_BACKENDS[backend](**params))
+    logger.info(f"Built analyzer chain {' -> '.join(backend for backend, _ in spec)}")
+    return AnalyzerChain(analyzers)
+
+
+def cached_chain(cache, spec, defaults=None):
+    """
+        Chain for `spec` from a per-thread cache, building it on first use. A spec
+        that cannot be built is logged once and cached as None.
+    """
+    if spec not in cache:
+        try:
+            cache[spec] = build_chain(spec, defaults)
+        except ValueError as e:
+            logger.error(f"Cannot build analyzer chain {spec}: {e}")
+            cache[spec] = None
+    return cache[spec]
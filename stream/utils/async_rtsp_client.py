@@ -0,0 +1,458 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from .rtsp_client import READ_POLL_S, RTSPClient, remember_transport, startup_config
+from .reconnect import ReconnectBackoff, reconnect_config
+from .dvr import build_recorder
+from .frame_splitter import JPEGFrameSplitter
+from .renditions import renditions_config
+
+logger = logging.getLogger('rtsp_client')
+
+
+class AsyncRTSPClient(RTSPClient):
+    """
+        RTSPClient that runs FFmpeg with asyncio.create_subprocess_exec on the
+        Daphne event loop and sends frames to the channel layer directly from a
+        coroutine, with no ingest thread and no async_to_sync hop per frame.
+
+        start/add_client/remove_client keep the RTSPClient behaviour. start(),
+        start_warm() and stop() must be called from the event loop thread, the
+        StreamManager does.
+    """
+
+    def __init__(self, stream_id, url, group_name, **options):
+        super().__init__(stream_id, url, group_name, **options)
+        self.loop = None
+        self.task = None
+        self._stderr_tail = collections.deque(maxlen=16)
+        self._rendition_readers = set()
+        self._stalled = False       # The stall watchdog killed FFmpeg
+
+    def _start_ingest(self):
+        self.is_running = True
+        self.recorder = build_recorder(self.stream_id)
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self._stream_loop_async(), name=f"rtsp_ingest_{self.stream_id}")
+        logger.info(f"Started stream {self.stream_id} (asyncio ingest)")
+
+    def _call_in_loop(self, callback, *args):
+        """Run a callback on the ingest event loop, whichever thread we are on"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    async def stop(self):
+        """Stop the stream and wait until the ingest task has terminated FFmpeg"""
+        self._stop_stream()
+        if self.task:
+            await asyncio.wait({self.task})
+
+    def shutdown(self):
+        """At process exit: the loop has stopped, run it until the ingest task terminated FFmpeg"""
+        self._stop_stream()
+        if self.task and not self.task.done() and not self.loop.is_running():
+            self.loop.run_until_complete(asyncio.wait({self.task}, timeout=5.0))
+
+    def _stop_stream(self):
+        # The ingest task owns the process and terminates it on its way out
+        self.is_running = False
+        self.frame_buffer = None
+        self.annotated_frame_buffer = None
+        self._close_recorder()
+        if self.frame_channel:
+            self.frame_channel.clear()
+        if self.task and not self.task.done():
+            self._call_in_loop(self.task.cancel)
+
+    def _group_send(self, message):
+        """Schedule a group send on the event loop without blocking the caller"""
+        self._call_in_loop(self.loop.create_task, self.channel_layer.group_send(self.group_name, message))
+
+    async def _send_status_async(self, message, state=None):
+        try:
+            await self.channel_layer.group_send(self.group_name, {
+                "type": "stream_status",
+                "message": message,
+                "state": state,
+                "stream_id": self.stream_id
+            })
+        except Exception as e:
+            logger.error(f"Error sending status for {self.stream_id}: {str(e)}")
+
+    async def _send_error_async(self, message):
+        try:
+            await self.channel_layer.group_send(self.group_name, {
+                "type": "stream_error",
+                "message": message,
+                "stream_id": self.stream_id
+            })
+        except Exception as e:
+            logger.error(f"Error sending error message for {self.stream_id}: {str(e)}")
+
+    async def _drain_stderr(self, process, tail):
+        """Keep FFmpeg's stderr flowing so it never blocks, remembering its last output for errors"""
+        # Fixed size reads: progress lines end in \r, readline() gives up on a long enough run of them
+        while chunk := await process.stderr.read(4096):
+            tail.append(chunk.decode(errors='ignore'))
+
+    async def _read_first_frames(self, process, splitter):
+        """Read stdout until the splitter has a complete JPEG; returns copies of the frames, or None on EOF"""
+        while True:
+            chunk = await process.stdout.read(splitter.read_size)
+            if not chunk:
+                return None
+            splitter.feed(chunk)
+            # The views die with the next feed, keep copies until the loop takes over
+            first_frames = [bytes(frame_view) for frame_view in splitter.frames()]
+            if first_frames:
+                return first_frames
+
+    async def _probe(self, transports):
+        """
+            Start FFmpeg for each transport and wait for the first complete JPEG.
+            Returns (transport, process, stderr_task, splitter, first_frames) for the first
+            one that delivers within FIRST_FRAME_TIMEOUT_S and stops the others, or None.
+        """
+        timeout = startup_config().get('FIRST_FRAME_TIMEOUT_S', 10.0)
+        attempts = {}  # first frame task -> (transport, process, stderr_task, splitter, stderr tail)
+        try:
+            for transport in transports:
+                logger.info(f"Attempting to connect to {self.stream_id} via {transport.upper()}...")
+                await self._send_status_async(f"Connecting via {transport.upper()}...")
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *self._ffmpeg_command(transport),
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE,
+                        start_new_session=True,
+                    )
+                except Exception as e:
+                    logger.error(f"Connection failed for {self.stream_id} via {transport.upper()}: {str(e)}")
+                    await self._send_error_async(f"Connection failed (transport: {transport.upper()}): {str(e)}")
+                    continue
+                tail = collections.deque(maxlen=16)
+                splitter = self.splitter_class()
+                first_frame = asyncio.create_task(self._read_first_frames(process, splitter))
+                attempts[first_frame] = (transport, process, asyncio.create_task(self._drain_stderr(process, tail)), splitter, tail)
+
+            deadline = asyncio.get_running_loop().time() + timeout
+            while attempts:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(attempts, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for first_frame in done:
+                    transport, process, stderr_task, splitter, tail = attempts.pop(first_frame)
+                    first_frames = first_frame.result()
+                    if first_frames:
+                        self._stderr_tail = tail
+                        return transport, process, stderr_task, splitter, first_frames
+                    await process.wait()
+                    await stderr_task
+                    stderr_output = ''.join(tail)
+                    logger.error(f"FFmpeg failed to start for {self.stream_id} via {transport.upper()}. Exit code: {process.returncode}. Stderr: {stderr_output}")
+                    await self._send_error_async(f"FFmpeg failed (transport: {transport.upper()}): {stderr_output[:200]}")
+
+            for transport, *_ in attempts.values():
+                logger.error(f"No frame from {self.stream_id} via {transport.upper()} within {timeout}s")
+                await self._send_error_async(f"No video (transport: {transport.upper()}) within {timeout:.0f}s")
+            return None
+        finally:
+            # Losers of a parallel probe, timed out attempts, or everything if the stream was stopped
+            for first_frame, (_, process, stderr_task, _, _) in attempts.items():
+                first_frame.cancel()
+                stderr_task.cancel()
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+    async def _stream_loop_async(self):
+        logger.info(f"Starting asyncio stream loop for {self.stream_id}")
+        try:
+            await self._run()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error in stream loop for {self.stream_id}: {str(e)}", exc_info=True)
+        finally:
+            self.is_running = False
+            self.frame_buffer = None
+            self.annotated_frame_buffer = None
+            self._close_recorder()
+            if self.frame_channel:
+                self.frame_channel.clear()
+            self._renditions_swapped(frozenset())
+            logger.info(f"Stream loop for {self.stream_id} ended.")
+            self._ingest_ended()
+
+    async def _run(self):
+        """Body of the stream task: ingest from FFmpeg until the stream stops"""
+        await self._ingest_supervised()
+
+    async def _ingest_supervised(self):
+        """_ingest, started again with a backoff each time FFmpeg ends mid-stream"""
+        backoff = ReconnectBackoff.from_settings()
+        started_at = time.monotonic()
+        reason = await self._ingest()
+        while reason and self.is_running and reconnect_config().get('ENABLED', True):
+            # Viewers stay subscribed and keep the last frame while FFmpeg is restarted
+            if not self._outage:
+                self._outage_began(reason)
+            delay, message = self._next_attempt(backoff, time.monotonic() - started_at)
+            await self._send_status_async(message, state='reconnecting')
+            await asyncio.sleep(delay)
+            started_at = time.monotonic()
+            reason = await self._ingest()
+
+    async def _watch_stall(self):
+        """Kill FFmpeg once no frame came for STALL_S, so _ingest sees it end and reconnects"""
+        stall_s = reconnect_config().get('STALL_S', 10.0)
+        if not stall_s:
+            return
+        while True:
+            await asyncio.sleep(min(READ_POLL_S, stall_s))
+            if time.time() - self.last_frame_time > stall_s and self.process:
+                logger.error(f"No frame from FFmpeg for {self.stream_id} in {stall_s:.0f}s, restarting it")
+                self._stalled = True
+                self.process.kill()
+                return
+
+    async def _ingest(self):
+        """
+            Connect FFmpeg and publish its frames until it ends. Returns why it ended
+            ('exited', 'stalled', or 'unreachable' while reconnecting), or None once the
+            stream stopped or the first connection failed.
+        """
+        logger.info(f"RTSP URL: {self.url}")
+
+        stderr_task = watchdog = None
+        self._stalled = False
+        try:
+            started_at = time.monotonic()
+            connected = None
+            for transports in self._probe_batches():
+                if not self.is_running:
+                    return None
+                connected = await self._probe(transports)
+                if connected:
+                    break
+            if not connected:
+                if self._outage:
+                    return 'unreachable'
+                if self.is_running:
+                    logger.error(f"FFmpeg unable to connect to {self.url}")
+                    await self._send_error_async(f"FFmpeg unable to connect to {self.url}")
+                return None
+            transport, self.process, stderr_task, splitter, first_frames = connected
+            process, self.splitter = self.process, splitter
+            if self._on_first_frame(transport, started_at):
+                await asyncio.to_thread(remember_transport, self.stream_id, transport)
+            await self._send_status_async(self._connected_message(transport), state='live')
+            watchdog = asyncio.create_task(self._watch_stall())
+            for first_frame in first_frames:
+                frame_bytes, annotated_frame_bytes = self._process_frame(memoryview(first_frame))
+                await self._publish_frame_async(frame_bytes, annotated_frame_bytes, time.time())
+
+            loop = asyncio.get_running_loop()
+            partial_since = None    # When the first bytes of the frame being assembled were read
+
+            while self.is_running:
+                switched = self._check_renditions_in_loop(transport)
+                if switched:
+                    previous, previous_stderr_task = process, stderr_task
+                    process, stderr_task, splitter, first_frames = switched
+                    self.splitter, partial_since = splitter, None
+                    previous_stderr_task.cancel()
+                    # Not _terminate: its output is not needed, and waiting for it would stall the new one
+                    previous.kill()
+                    await previous.wait()
+                    for first_frame in first_frames:
+                        frame_bytes, annotated_frame_bytes = self._process_frame(memoryview(first_frame))
+                        await self._publish_frame_async(frame_bytes, annotated_frame_bytes, time.time())
+
+                chunk = await process.stdout.read(splitter.read_size)
+                read_at = time.perf_counter()
+                if not chunk:
+                    await process.wait()
+                    if self._stalled:
+                        return 'stalled'
+                    logger.error(f"FFmpeg process for {self.stream_id} terminated unexpectedly. Stderr: {''.join(self._stderr_tail)}")
+                    await self._send_error_async("FFmpeg process terminated.")
+                    return 'exited'
+
+                self.metrics.bytes_total += len(chunk)
+                splitter.feed(chunk)
+                for frame_view in splitter.frames():
+                    trace = self.tracer.begin(self.frame_seq + 1, partial_since or read_at, read_at)
+                    partial_since = None
+                    captured_at = time.time()
+                    if self.face_detector and self.face_detector.latest_faces and self.burned_in_clients:
+                        # Drawing boxes decodes and re-encodes the frame, keep it off the event loop
+                        frame_bytes, annotated_frame_bytes = await loop.run_in_executor(None, self._process_frame, frame_view)
+                    else:
+                        frame_bytes, annotated_frame_bytes = self._process_frame(frame_view)
+                    if trace:
+                        trace.mark('process')
+                        trace.handoff()
+                    await self._publish_frame_async(frame_bytes, annotated_frame_bytes, captured_at)
+                    if trace:
+                        trace.mark('publish')
+                # A partial frame left over began in this read, unless it was already pending
+                partial_since = (partial_since or read_at) if splitter.buffered else None
+            return None
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            switch, self._rendition_switch = self._rendition_switch, None
+            if switch:
+                switch.cancel()
+                started = (await asyncio.gather(switch, return_exceptions=True))[0]
+                if isinstance(started, tuple):
+                    started[1].cancel()
+                    await self._terminate(started[0])
+            process, self.process = self.process, None
+            self.splitter = None
+            if process:
+                await self._terminate(process)
+            if stderr_task:
+                stderr_task.cancel()
+            # A reconnect starts FFmpeg with the main output only
+            self._renditions_swapped(frozenset())
+
+    def _check_renditions_in_loop(self, transport):
+        """
+            _check_renditions on the event loop. Returns (process, stderr_task, splitter,
+            first_frames) of the FFmpeg that took over, the caller stops the previous one.
+        """
+        switch = self._rendition_switch
+        if switch is None:
+            wanted = self.rendition_demand.wanted(self.encoded_renditions)
+            if wanted != self.encoded_renditions and time.monotonic() >= self._rendition_retry_at:
+                self._rendition_switch = asyncio.create_task(self._start_renditions_async(transport, wanted))
+            return None
+        if not switch.done():
+            return None
+
+        self._rendition_switch = None
+        started = switch.result()
+        if started is None:
+            self._rendition_retry_at = time.monotonic() + renditions_config().get('RETRY_S', 10.0)
+            return None
+        process, stderr_task, self._stderr_tail, splitter, renditions, first_frames = started
+        self.process = process
+        self._renditions_swapped(renditions)
+        return process, stderr_task, splitter, first_frames
+
+    async def _start_renditions_async(self, transport, renditions):
+        """
+            Start FFmpeg with the extra `renditions` and wait for its first frame. Returns
+            (process, stderr_task, stderr tail, splitter, renditions, first_frames), or None
+        """
+        timeout = startup_config().get('FIRST_FRAME_TIMEOUT_S', 10.0)
+        logger.info(f"Starting FFmpeg with renditions {sorted(renditions)} for stream {self.stream_id}")
+        pipes = {self.extra_renditions[name]: os.pipe() for name in sorted(renditions)}
+        started_at = time.monotonic()
+        process = stderr_task = started = None
+        try:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *self._ffmpeg_command(transport, {rendition: write_fd for rendition, (_, write_fd) in pipes.items()}),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                    pass_fds=[write_fd for _, write_fd in pipes.values()],
+                )
+            finally:
+                # FFmpeg holds the write ends now, so the readers see EOF when it exits
+                for _, write_fd in pipes.values():
+                    os.close(write_fd)
+            for rendition, (read_fd, _) in pipes.items():
+                reader = asyncio.create_task(self._read_rendition_async(process, rendition.name, read_fd))
+                self._rendition_readers.add(reader)
+                reader.add_done_callback(self._rendition_readers.discard)
+            pipes = {}
+            tail = collections.deque(maxlen=16)
+            stderr_task = asyncio.create_task(self._drain_stderr(process, tail))
+            splitter = self.splitter_class()
+            first_frames = await asyncio.wait_for(self._read_first_frames(process, splitter), timeout)
+            if first_frames:
+                self.metrics.ffmpeg_started(time.monotonic() - started_at)
+                started = (process, stderr_task, tail, splitter, renditions, first_frames)
+                return started
+            logger.error(f"FFmpeg with renditions {sorted(renditions)} exited for stream {self.stream_id}: {''.join(tail)}")
+        except asyncio.TimeoutError:
+            logger.error(f"FFmpeg with renditions {sorted(renditions)} delivered no frame for stream {self.stream_id} within {timeout}s")
+        except Exception as e:
+            logger.error(f"Could not start renditions {sorted(renditions)} for stream {self.stream_id}: {e}")
+        finally:
+            for read_fd, _ in pipes.values():
+                os.close(read_fd)
+            if started is None:
+                if stderr_task:
+                    stderr_task.cancel()
+                if process and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        return None
+
+    async def _read_rendition_async(self, process, name, read_fd):
+        """Read one extra output, its frames are published while `process` is the stream's FFmpeg"""
+        reader = asyncio.StreamReader()
+        transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb', buffering=0)
+        )
+        splitter = JPEGFrameSplitter()
+        try:
+            while chunk := await reader.read(splitter.read_size):
+                splitter.feed(chunk)
+                for frame_view in splitter.frames():
+                    if process is self.process:
+                        self._publish_rendition(name, bytes(frame_view), time.time())
+        finally:
+            transport.close()
+
+    async def _publish_frame_async(self, frame_bytes, annotated_frame_bytes, captured_at):
+        """Buffer a frame and hand it to the viewers, through the frame hub or the channel layer"""
+        self.last_frame_time = captured_at
+        self.metrics.frame(captured_at)
+        self.frame_buffer = frame_bytes
+        self.annotated_frame_buffer = annotated_frame_bytes
+        if self.recorder:
+            self.recorder.append(captured_at, self.frame_seq, frame_bytes)
+        if self.frame_channel:
+            self.frame_channel.publish(frame_bytes, annotated_frame_bytes, self.frame_seq, captured_at)
+            return
+        if not self.client_count:
+            return
+        try:
+            await self.channel_layer.group_send(self.group_name, {
+                "type": "stream_frame",
+                "frame": frame_bytes,
+                "annotated_frame": annotated_frame_bytes,
+                "seq": self.frame_seq,
+                "captured_at": captured_at,
+            })
+        except Exception as e:
+            logger.error(f"Error sending frame for {self.stream_id}: {str(e)}")
+
+    async def _terminate(self, process):
+        pid = process.pid
+        if process.returncode is None:
+            logger.info(f"Attempting to stop FFmpeg process for stream {self.stream_id} (PID: {pid}).")
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                logger.warning(f"FFmpeg process {pid} (stream {self.stream_id}) didn't terminate quickly. Killing.")
+                process.kill()
+                await process.wait()
+        logger.info(f"FFmpeg process {pid} (stream {self.stream_id}) stopped. Return code: {process.returncode}")
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from django.conf import settings
+
+from .async_rtsp_client import AsyncRTSPClient
+from .stream_leases import get_lease_store
+from .stream_relay import read_relay
+
+logger = logging.getLogger('rtsp_client')
+
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ClusteredRTSPClient(AsyncRTSPClient):
+    """
+        AsyncRTSPClient for running several Daphne workers (STREAM_CLUSTER enabled).
+
+        Every worker that has viewers of a stream creates one of these. The one that
+        holds the stream's lease runs FFmpeg exactly like AsyncRTSPClient and renews
+        the lease while it does. The others connect to the owner's relay endpoint
+        and republish its frames and messages to their local viewers. When the
+        relay breaks they try to take the lease, so a crashed owner is replaced
+        once its lease expires.
+    """
+
+    def __init__(self, stream_id, url, group_name, **options):
+        super().__init__(stream_id, url, group_name, **options)
+        config = settings.STREAM_CLUSTER
+        self.leases = get_lease_store()
+        # One owner identity per client instance, so a client still shutting down on
+        # this worker is not mistaken for its replacement
+        self.lease_owner = f"{NODE_ID}/{uuid.uuid4().hex[:8]}"
+        self.node_address = config['NODE_ADDRESS']
+        self.renew_interval = config.get('RENEW_S', 3.0)
+        self.retry_interval = config.get('RETRY_S', 1.0)
+        self.relay_token = config.get('RELAY_TOKEN', '')
+        self.role = None        # 'owner' or 'relay' once the stream task has decided
+        self.owner_address = None
+        self.failovers = 0
+        self._relay_task = None
+        self._relay_burned_in = False
+
+    def start(self, burned_in=True):
+        super().start(burned_in=burned_in)
+        self._check_relay_overlay()
+
+    def add_client(self, burned_in=True):
+        super().add_client(burned_in=burned_in)
+        self._check_relay_overlay()
+
+    def _check_relay_overlay(self):
+        """Reconnect the relay when the first burned-in viewer joins, the owner only annotates on request"""
+        if self.role == 'relay' and self.burned_in_clients and not self._relay_burned_in and self._relay_task:
+            self._call_in_loop(self._relay_task.cancel)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            'role': self.role,
+            'owner': self.owner_address,
+            'failovers': self.failovers,
+        }
+
+    async def _run(self):
+        while self.is_running:
+            lease = await asyncio.to_thread(self.leases.acquire, self.stream_id, self.lease_owner, self.node_address)
+            if lease.owner == self.lease_owner:
+                if self.role == 'relay':
+                    self.failovers += 1
+                    logger.info(f"Took over stream {self.stream_id} from {self.owner_address}")
+                self.role, self.owner_address = 'owner', self.node_address
+                if not await self._own():
+                    # FFmpeg ended or the stream was stopped, same as a single worker
+                    return
+                logger.warning(f"Lost the lease of stream {self.stream_id}, switching to relay")
+                continue
+
+            if self.role != 'relay' or self.owner_address != lease.address:
+                await self._send_status_async(f"Relaying from {lease.address}")
+            self.role, self.owner_address = 'relay', lease.address
+            self._relay_task = asyncio.create_task(self._relay(lease.address))
+            # wait() rather than await: a cancelled relay (overlay change) must not cancel us
+            await asyncio.wait({self._relay_task})
+            self._relay_task = None
+            if self.is_running:
+                await asyncio.sleep(self.retry_interval)
+
+    async def _own(self):
+        """Ingest while renewing the lease, returns True if the lease was lost before FFmpeg ended"""
+        ingest = asyncio.create_task(self._ingest_supervised())
+        keeper = asyncio.create_task(self._keep_lease())
+        try:
+            done, _ = await asyncio.wait({ingest, keeper}, return_when=asyncio.FIRST_COMPLETED)
+            return keeper in done
+        finally:
+            for task in (ingest, keeper):
+                task.cancel()
+            await asyncio.gather(ingest, keeper, return_exceptions=True)
+            await asyncio.to_thread(self.leases.release, self.stream_id, self.lease_owner)
+
+    async def _keep_lease(self):
+        """Renew the lease until that fails"""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            if not await asyncio.to_thread(self.leases.renew, self.stream_id, self.lease_owner):
+                return
+
+    async def _relay(self, address):
+        """Republish the owner's frames and messages until the relay ends or fails"""
+        self._relay_burned_in = self.burned_in_clients > 0
+        timeout = self.leases.ttl
+        try:
+            async for record in read_relay(address, self.stream_id, self.relay_token, self._relay_burned_in, timeout):
+                if not self.is_running:
+                    return
+                if record[0] == 'frame':
+                    _, seq, captured_at, frame_bytes, annotated_frame_bytes = record
+                    self.frame_seq = seq
+                    await self._publish_frame_async(frame_bytes, annotated_frame_bytes, captured_at or time.time())
+                else:
+                    await self.channel_layer.group_send(self.group_name, record[1])
+            logger.info(f"Relay of stream {self.stream_id} from {address} ended")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Relay of stream {self.stream_id} from {address} failed: {e!r}")
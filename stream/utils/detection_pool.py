@@ -0,0 +1,246 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from .mtcnn_detector import MTCNNDetector
+from .analyzers import DEFAULT_ANALYZER, analyzer_defaults, analyzer_spec, cached_chain
+from .metrics import stream_metrics
+from .frame_trace import frame_tracer
+
+logger = logging.getLogger('detection_pool')
+
+# Analyzer chains per worker thread (or per worker process), created on first use of each spec
+_worker_state = threading.local()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _detect_in_worker(frame_bytes, submitted_at, spec, defaults=None):
+    """Runs inside the pool, returns (AnalysisResult or None, submitted_at, started_at, finished_at)"""
+    started_at = time.time()
+    chains = getattr(_worker_state, 'chains', None)
+    if chains is None:
+        chains = _worker_state.chains = {}
+    chain = cached_chain(chains, spec, defaults)
+    result = chain.run(frame_bytes) if chain else None
+    return result, submitted_at, started_at, time.time()
+
+
+class DetectionPool:
+    """
+        Process-wide worker pool shared by every stream's AsyncFaceDetector.
+
+        Work is never queued behind busy workers: `try_submit` refuses a frame
+        when every worker already has a job, and the caller simply skips it.
+
+        `prep_executor` runs the per-frame work around the detector (the face
+        tracker's optical flow, the motion gate's decode and diff) so it stays off
+        the ingest thread and the event loop. It is always threads: that work
+        keeps per-stream state.
+    """
+
+    def __init__(self, executor='thread', workers=2, analyzer_defaults=None, prep_workers=2):
+        if executor == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face_detect')
+        self.prep_executor = concurrent.futures.ThreadPoolExecutor(max_workers=prep_workers, thread_name_prefix='face_prep')
+        self.executor_type = executor
+        self.workers = workers
+        self.analyzer_defaults = analyzer_defaults  # Backend -> kwargs, see analyzers.build_chain
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_submit(self, frame_bytes, spec=None):
+        """Submit an analysis job, returns the future or None if the pool is saturated"""
+        with self._lock:
+            if self._in_flight >= self.workers:
+                return None
+            self._in_flight += 1
+        spec = spec or analyzer_spec(DEFAULT_ANALYZER)
+        future = self.executor.submit(_detect_in_worker, frame_bytes, time.time(), spec, self.analyzer_defaults)
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def shutdown(self):
+        self.prep_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_detection_pool():
+    """
+        Return the shared DetectionPool, configured by settings.FACE_DETECTION.
+        Its WORKERS models serve every stream in the process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from django.conf import settings
+            config = getattr(settings, 'FACE_DETECTION', {})
+            _pool = DetectionPool(
+                executor=config.get('EXECUTOR', 'thread'),
+                workers=config.get('WORKERS', 2),
+                analyzer_defaults=analyzer_defaults(config),
+                prep_workers=config.get('PREP_WORKERS', 2),
+            )
+            logger.info(f"Started face detection pool: {_pool.workers} {_pool.executor_type} worker(s)")
+        return _pool
+
+
+class AsyncFaceDetector:
+    """
+        Per-stream front end to the detection pool.
+
+        The capture loop calls `submit` for every frame and `annotate` to draw the
+        most recent detection result onto it. At most one job per stream is in
+        flight; frames arriving meanwhile, or while the pool is saturated, are
+        not detected on and only get the previous result drawn. The tracker and
+        the motion gate run on the pool's prep threads, one frame per stream at a
+        time, and the tracker publishes its moved boxes from there; `submit`
+        itself only checks flags. A frame that arrives while the previous one is
+        still being tracked waits, replacing any older waiting frame.
+    """
+
+    def __init__(self, stream_id, pool=None, on_result=None, motion_gate=None, tracker=None, analyzer=None):
+        self.stream_id = stream_id
+        self.pool = pool or get_detection_pool()
+        self.analyzer = analyzer or analyzer_spec(DEFAULT_ANALYZER)  # Analyzer chain spec, see analyzers.py
+        self.on_result = on_result  # Called with (seq, faces) from the pool for every new result
+        self.motion_gate = motion_gate  # Optional MotionGate, skips detection on static scenes
+        self.tracker = tracker  # Optional FaceTracker, moves boxes between detector keyframes
+        self.latest_faces = []
+        self.latest_result = None
+        self.latest_result_time = 0
+        self.metrics = stream_metrics(stream_id)
+        self.tracer = frame_tracer(stream_id)
+        self._future = None
+        self._preparing = False   # A frame is being tracked or gated on a prep thread
+        self._pending = None      # (frame_bytes, seq) to track next, newest wins
+        self._lock = threading.Lock()
+
+        self.frames_submitted = 0
+        self.frames_skipped = 0
+        self._completed_at = collections.deque(maxlen=30)
+        self._queue_latency = collections.deque(maxlen=30)
+        self._detect_latency = collections.deque(maxlen=30)
+
+    def submit(self, frame_view, seq=None):
+        """Offer a frame for tracking and detection, copying it only if it goes on to a prep thread or a worker"""
+        prep = bool(self.tracker or (self.motion_gate and self.motion_gate.threshold))
+        with self._lock:
+            if self._preparing and self.tracker:
+                # The tracker has to see every frame it can keep up with, in order
+                self._pending = (bytes(frame_view), seq)
+                return False
+            if self._preparing or (self._future is not None and not self.tracker):
+                self.frames_skipped += 1
+                return False
+            if prep:
+                self._preparing = True
+            else:
+                future = self._try_submit_locked(bytes(frame_view))
+        if prep:
+            self.pool.prep_executor.submit(self._prepare, bytes(frame_view), seq)
+            return True
+        if future is None:
+            return False
+        future.add_done_callback(lambda f: self._on_result(f, seq))
+        return True
+
+    def _prepare(self, frame_bytes, seq):
+        """Prep thread: track and gate this stream's frames until no newer one is waiting"""
+        while True:
+            try:
+                self._track_and_gate(frame_bytes, seq)
+            except Exception as e:
+                logger.error(f"Frame preparation failed for {self.stream_id}: {e}", exc_info=True)
+            with self._lock:
+                if self._pending is None:
+                    self._preparing = False
+                    return
+                (frame_bytes, seq), self._pending = self._pending, None
+
+    def _track_and_gate(self, frame_bytes, seq):
+        if self.tracker:
+            faces = self.tracker.track(frame_bytes)
+            if faces:
+                self.latest_faces = faces
+                if self.on_result:
+                    self.on_result(seq, faces)
+            if not self.tracker.needs_detection():
+                return
+        with self._lock:
+            if self._future is not None:
+                self.frames_skipped += 1
+                return
+        if self.motion_gate and not self.motion_gate.should_detect(frame_bytes):
+            return
+        with self._lock:
+            future = self._try_submit_locked(frame_bytes)
+        if future:
+            future.add_done_callback(lambda f: self._on_result(f, seq))
+
+    def _try_submit_locked(self, frame_bytes):
+        future = self.pool.try_submit(frame_bytes, self.analyzer)
+        if future is None:
+            self.frames_skipped += 1
+            return None
+        self._future = future
+        self.frames_submitted += 1
+        return future
+
+    def _on_result(self, future, seq):
+        with self._lock:
+            self._future = None
+        try:
+            result, submitted_at, started_at, finished_at = future.result()
+        except Exception as e:
+            logger.error(f"Face detection job failed for {self.stream_id}: {e}")
+            return
+        self.metrics.detection_latency.observe(finished_at - submitted_at)
+        if self.tracer.sampled(seq):
+            self.tracer.record('detection', finished_at - submitted_at)
+        if result is None:
+            return
+        faces = result.faces
+        if self.tracker:
+            self.tracker.on_detection(faces)
+        self.latest_faces = faces
+        self.latest_result = result
+        self.latest_result_time = finished_at
+        self._completed_at.append(finished_at)
+        self._queue_latency.append(started_at - submitted_at)
+        self._detect_latency.append(finished_at - started_at)
+        if self.on_result:
+            self.on_result(seq, faces)
+
+    def annotate(self, frame_view):
+        """Draw the latest faces onto the frame, returns (jpeg_bytes, success)"""
+        faces = self.latest_faces
+        if not faces:
+            return frame_view, False
+        return MTCNNDetector.draw_faces(frame_view, faces)
+
+    def stats(self):
+        completed = list(self._completed_at)
+        fps = (len(completed) - 1) / (completed[-1] - completed[0]) if len(completed) > 1 and completed[-1] > completed[0] else 0.0
+        queue = list(self._queue_latency)
+        detect = list(self._detect_latency)
+        return {
+            'analyzer': ' -> '.join(backend for backend, _ in self.analyzer),
+            'detection_fps': round(fps, 2),
+            'frames_submitted': self.frames_submitted,
+            'frames_skipped': self.frames_skipped,
+            'queue_latency_ms': round(sum(queue) / len(queue) * 1000, 1) if queue else 0.0,
+            'detect_latency_ms': round(sum(detect) / len(detect) * 1000, 1) if detect else 0.0,
+            'faces': len(self.latest_faces),
+            **(self.motion_gate.stats() if self.motion_gate else {}),
+            **(self.tracker.stats() if self.tracker else {}),
+        }
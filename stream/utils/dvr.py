@@ -0,0 +1,315 @@
+import bisect
+import concurrent.futures
+import logging
+import mmap
+import os
+import threading
+from array import array
+from typing import NamedTuple
+
+logger = logging.getLogger('dvr')
+
+
+def dvr_config():
+    from django.conf import settings
+    return getattr(settings, 'DVR', {})
+
+
+_io_executor = None
+_io_lock = threading.Lock()
+_swept = False   # Leftover segments are swept once per process, with the first recorder
+
+
+def _io():
+    """The thread that creates and deletes segment files, so appends never wait on the filesystem"""
+    global _io_executor
+    with _io_lock:
+        if _io_executor is None:
+            _io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='dvr_io')
+        return _io_executor
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep_segments(directory):
+    """
+        Delete segment files left behind by processes that are gone (a crash, a
+        SIGKILL), recognized by the pid in their name. Workers sharing the
+        directory keep theirs. Returns how many files were deleted.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for name in names:
+        parts = name.split('-')
+        if not name.endswith('.seg') or len(parts) < 4 or not parts[-3].isdigit():
+            continue
+        pid = int(parts[-3])
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        try:
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info(f"Deleted {removed} DVR segment(s) of dead processes from {directory}")
+    return removed
+
+
+class RecordedFrame(NamedTuple):
+    captured_at: float    # Wall clock time the frame left FFmpeg, the index key
+    seq: int              # RTSPClient frame_seq
+    data: bytes
+
+
+class _Segment:
+    """A memory-mapped file of frames spilled from RAM, in capture order"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.used = 0
+        self.file = open(path, 'w+b')
+        # Allocate the blocks and fault the pages in now, on the I/O thread, rather
+        # than on the first write of every page during appends
+        os.posix_fallocate(self.file.fileno(), 0, size)
+        self.map = mmap.mmap(self.file.fileno(), size, flags=mmap.MAP_SHARED | getattr(mmap, 'MAP_POPULATE', 0))
+        self.times = array('d')
+        self.seqs = array('Q')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+
+    def fits(self, length):
+        return self.used + length <= self.size
+
+    def append(self, captured_at, seq, data):
+        self.map[self.used:self.used + len(data)] = data
+        self.times.append(captured_at)
+        self.seqs.append(seq)
+        self.offsets.append(self.used)
+        self.lengths.append(len(data))
+        self.used += len(data)
+
+    def frame(self, i):
+        offset = self.offsets[i]
+        return RecordedFrame(self.times[i], self.seqs[i], bytes(self.map[offset:offset + self.lengths[i]]))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class FrameRecorder:
+    """
+        Time-indexed recording of a stream's recent frames for instant replay.
+
+        The newest `ram_bytes` of frames are kept in memory; older frames spill to
+        memory-mapped segment files of `segment_bytes` in `directory`, and the oldest
+        segment is deleted once the recording would exceed `budget_bytes`. Appends
+        are amortized O(1); frame_at/next_after bisect the segment start times and
+        then one segment's (or the RAM tier's) timestamps, so lookups are O(log n).
+        Timestamps are forced to increase, a clock step back never breaks the order.
+
+        Appends run on the ingest path (the event loop in asyncio mode), so segment
+        files are created and deleted on a background thread: the next segment is
+        made ahead of time, and a frame that spills while it is not ready yet is
+        dropped instead of waiting for the filesystem.
+    """
+
+    def __init__(self, stream_id, directory, budget_bytes=256 << 20, ram_bytes=32 << 20, segment_bytes=16 << 20):
+        self.stream_id = stream_id
+        self.directory = directory
+        self.ram_budget = min(ram_bytes, budget_bytes)
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(0, (budget_bytes - self.ram_budget) // segment_bytes)
+        self.frames_dropped = 0    # Frames too old for the budget, or too large for a segment
+        self.closed = False
+
+        self._lock = threading.Lock()
+        self._last_time = 0.0
+        # RAM tier: parallel timestamp array and (seq, data) list, consumed from _ram_head
+        self._ram_times = array('d')
+        self._ram_frames = []
+        self._ram_head = 0
+        self._ram_used = 0
+        # Disk tier: segments oldest first, with their first timestamps for bisecting
+        self._segments = []
+        self._segment_starts = []
+        self._segment_counter = 0
+        self._spare = None             # Next segment, created on the I/O thread
+        self._spare_pending = False
+
+    def append(self, captured_at, seq, data):
+        with self._lock:
+            if self.closed:
+                return
+            if captured_at <= self._last_time:
+                captured_at = self._last_time + 1e-6
+            self._last_time = captured_at
+            self._ram_times.append(captured_at)
+            self._ram_frames.append((seq, data))
+            self._ram_used += len(data)
+            if self._ram_used * 2 > self.ram_budget:
+                self._prepare_spare()
+            # Keep at least the newest frame in RAM
+            while self._ram_used > self.ram_budget and len(self._ram_frames) - self._ram_head > 1:
+                self._spill_oldest()
+            if self._ram_head > 1024 and self._ram_head * 2 > len(self._ram_frames):
+                del self._ram_frames[:self._ram_head]
+                self._ram_times = self._ram_times[self._ram_head:]
+                self._ram_head = 0
+
+    def _spill_oldest(self):
+        head = self._ram_head
+        captured_at, (seq, data) = self._ram_times[head], self._ram_frames[head]
+        self._ram_frames[head] = None
+        self._ram_head += 1
+        self._ram_used -= len(data)
+
+        if not self.max_segments or len(data) > self.segment_bytes:
+            self.frames_dropped += 1
+            return
+        if not self._segments or not self._segments[-1].fits(len(data)):
+            if self._spare is None:
+                self.frames_dropped += 1
+                self._prepare_spare()
+                return
+            if len(self._segments) >= self.max_segments:
+                oldest = self._segments.pop(0)
+                self._segment_starts.pop(0)
+                self.frames_dropped += len(oldest.times)
+                _io().submit(oldest.close)
+            self._segments.append(self._spare)
+            self._segment_starts.append(captured_at)
+            self._spare = None
+            self._prepare_spare()
+        self._segments[-1].append(captured_at, seq, data)
+
+    def _prepare_spare(self):
+        """Have the I/O thread create the next segment, unless it exists or is on its way"""
+        if not self.max_segments or self._spare is not None or self._spare_pending:
+            return
+        self._spare_pending = True
+        self._segment_counter += 1
+        path = os.path.join(self.directory, f"{self.stream_id}-{os.getpid()}-{id(self):x}-{self._segment_counter}.seg")
+        _io().submit(self._create_spare, path)
+
+    def _create_spare(self, path):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            segment = _Segment(path, self.segment_bytes)
+        except OSError as e:
+            logger.error(f"Cannot create DVR segment {path}: {e}")
+            segment = None
+        with self._lock:
+            self._spare_pending = False
+            if not self.closed and segment is not None:
+                self._spare, segment = segment, None
+        if segment is not None:
+            segment.close()
+
+    def _ram_frame(self, i):
+        seq, data = self._ram_frames[i]
+        return RecordedFrame(self._ram_times[i], seq, data)
+
+    def _oldest(self):
+        if self._segments:
+            return self._segments[0].frame(0)
+        if self._ram_head < len(self._ram_frames):
+            return self._ram_frame(self._ram_head)
+        return None
+
+    def frame_at(self, timestamp):
+        """The frame shown at `timestamp` (the last one captured at or before it), or the oldest one"""
+        with self._lock:
+            if self.closed:
+                return None
+            i = bisect.bisect_right(self._ram_times, timestamp, lo=self._ram_head) - 1
+            if i >= self._ram_head:
+                return self._ram_frame(i)
+            k = bisect.bisect_right(self._segment_starts, timestamp) - 1
+            if k >= 0:
+                segment = self._segments[k]
+                return segment.frame(bisect.bisect_right(segment.times, timestamp) - 1)
+            return self._oldest()
+
+    def next_after(self, timestamp):
+        """The first frame captured after `timestamp`, None if there is none yet"""
+        with self._lock:
+            if self.closed:
+                return None
+            k = max(0, bisect.bisect_right(self._segment_starts, timestamp) - 1)
+            for segment in self._segments[k:k + 2]:
+                j = bisect.bisect_right(segment.times, timestamp)
+                if j < len(segment.times):
+                    return segment.frame(j)
+            i = bisect.bisect_right(self._ram_times, timestamp, lo=self._ram_head)
+            if i < len(self._ram_frames):
+                return self._ram_frame(i)
+            return None
+
+    def window(self):
+        """(oldest, newest) capture time in the recording, or None while it is empty"""
+        with self._lock:
+            if self.closed or self._ram_head >= len(self._ram_frames):
+                return None
+            oldest = self._segment_starts[0] if self._segments else self._ram_times[self._ram_head]
+            return oldest, self._ram_times[-1]
+
+    def stats(self):
+        window = self.window()
+        with self._lock:
+            return {
+                'window_s': round(window[1] - window[0], 1) if window else 0.0,
+                'ram_frames': len(self._ram_frames) - self._ram_head,
+                'ram_bytes': self._ram_used,
+                'disk_frames': sum(len(segment.times) for segment in self._segments),
+                'disk_bytes': sum(segment.used for segment in self._segments),
+                'segments': len(self._segments),
+                'frames_dropped': self.frames_dropped,
+            }
+
+    def close(self):
+        """Drop the recording and delete its segment files"""
+        with self._lock:
+            self.closed = True
+            segments = self._segments + ([self._spare] if self._spare else [])
+            self._segments, self._segment_starts, self._spare = [], [], None
+            self._ram_times, self._ram_frames = array('d'), []
+            self._ram_head = self._ram_used = 0
+        for segment in segments:
+            _io().submit(segment.close)
+
+
+def build_recorder(stream_id):
+    """A FrameRecorder configured by settings.DVR, or None when the DVR is off"""
+    global _swept
+    config = dvr_config()
+    if not config.get('ENABLED'):
+        return None
+    with _io_lock:
+        sweep, _swept = not _swept, True
+    if sweep:
+        _io().submit(sweep_segments, config['DIRECTORY'])
+    return FrameRecorder(
+        stream_id,
+        config['DIRECTORY'],
+        budget_bytes=int(config.get('BUDGET_MB', 256) * (1 << 20)),
+        ram_bytes=int(config.get('RAM_MB', 32) * (1 << 20)),
+        segment_bytes=int(config.get('SEGMENT_MB', 16) * (1 << 20)),
+    )
@@ -0,0 +1,182 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('face_tracker')
+
+TRACKER_TYPES = ('iou', 'flow')
+
+_REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+}
+
+
+def box_iou(a, b):
+    """Intersection over union of two [x, y, w, h] boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class _Track:
+    __slots__ = ('box', 'confidence', 'velocity', 'points', 'initial_points', 'score')
+
+    def __init__(self, box, confidence):
+        self.box = [float(v) for v in box]
+        self.confidence = confidence      # Detector confidence of the face
+        self.velocity = (0.0, 0.0)        # Pixels per frame, used by the 'iou' tracker
+        self.points = None                # Feature points in tracker coordinates, 'flow' tracker
+        self.initial_points = 0
+        self.score = 1.0                  # How much we trust the tracked position
+
+    def as_face(self):
+        return {'box': [int(round(v)) for v in self.box], 'confidence': self.confidence}
+
+
+class FaceTracker:
+    """
+        Moves detector boxes forward between MTCNN keyframes.
+
+        'iou':  detections are associated with existing tracks by IoU and each track
+                keeps moving at the velocity seen between its last two detections.
+        'flow': Lucas-Kanade optical flow on a downscaled grayscale frame moves each
+                box by the median motion of feature points inside it; the share of
+                points that survive a forward-backward check is the track score.
+
+        A new detection is requested every `detect_interval` frames, or as soon as
+        any track score falls below `min_confidence`.
+    """
+
+    def __init__(self, method='flow', detect_interval=5, min_confidence=0.5, scale=2):
+        if method not in TRACKER_TYPES:
+            raise ValueError(f"Unknown tracker '{method}', expected one of {TRACKER_TYPES}")
+        self.method = method
+        self.detect_interval = max(1, detect_interval)
+        self.min_confidence = min_confidence
+        self.scale = scale
+        self._tracks = []
+        self._prev_gray = None
+        self._frames_since_detection = self.detect_interval
+        self._reinit_points = False
+        self._lock = threading.Lock()
+
+        self.frames_tracked = 0
+        self.redetects_requested = 0
+
+    def needs_detection(self):
+        """True when the next frame should go to the detector"""
+        with self._lock:
+            if self._frames_since_detection >= self.detect_interval:
+                return True
+            if any(track.score < self.min_confidence for track in self._tracks):
+                self.redetects_requested += 1
+                return True
+            return False
+
+    def on_detection(self, faces, frames_elapsed=None):
+        """
+            Replace the tracks with a fresh detection result. Faces that overlap an
+            existing track keep it, so the 'iou' tracker can learn their velocity.
+        """
+        with self._lock:
+            elapsed = max(1, frames_elapsed or self._frames_since_detection)
+            tracks = []
+            unmatched = list(self._tracks)
+            for face in faces:
+                track = _Track(face['box'], face['confidence'])
+                best = max(unmatched, key=lambda t: box_iou(t.box, track.box), default=None)
+                if best is not None and box_iou(best.box, track.box) > 0.3:
+                    unmatched.remove(best)
+                    track.velocity = (
+                        (track.box[0] - best.box[0]) / elapsed,
+                        (track.box[1] - best.box[1]) / elapsed,
+                    )
+                tracks.append(track)
+            self._tracks = tracks
+            self._frames_since_detection = 0
+            self._reinit_points = True
+
+    def track(self, image_bytes):
+        """Advance every track by one frame and return the current faces"""
+        with self._lock:
+            if not self._tracks:
+                self._frames_since_detection += 1
+                self._prev_gray = None
+                return []
+
+            # The first frame after a detection only seeds the tracker, it is not a tracked frame
+            seeding = self._reinit_points
+            if not seeding:
+                self._frames_since_detection += 1
+
+            if self.method == 'iou':
+                self._reinit_points = False
+                if not seeding:
+                    for track in self._tracks:
+                        track.box[0] += track.velocity[0]
+                        track.box[1] += track.velocity[1]
+            else:
+                gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), _REDUCED_GRAYSCALE_FLAGS.get(self.scale, cv2.IMREAD_GRAYSCALE))
+                if gray is None:
+                    return [track.as_face() for track in self._tracks]
+                if seeding or self._prev_gray is None or self._prev_gray.shape != gray.shape:
+                    self._init_points(gray)
+                else:
+                    self._flow(gray)
+                self._prev_gray = gray
+
+            if not seeding:
+                self.frames_tracked += 1
+            return [track.as_face() for track in self._tracks]
+
+    def _init_points(self, gray):
+        self._reinit_points = False
+        scale = self.scale
+        for track in self._tracks:
+            x, y, w, h = (int(v / scale) for v in track.box)
+            mask = np.zeros_like(gray)
+            mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = 255
+            points = cv2.goodFeaturesToTrack(gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+            track.points = points
+            track.initial_points = 0 if points is None else len(points)
+            track.score = 1.0 if track.initial_points >= 3 else 0.0
+
+    def _flow(self, gray):
+        lk_params = dict(winSize=(15, 15), maxLevel=2,
+                         criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        for track in self._tracks:
+            if track.points is None or len(track.points) < 3:
+                track.score = 0.0
+                continue
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None, **lk_params)
+            backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, forward, None, **lk_params)
+            fb_error = np.linalg.norm((track.points - backward).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < 1.0)
+
+            track.score = good.sum() / track.initial_points if track.initial_points else 0.0
+            if good.sum() < 3:
+                continue
+            motion = (forward - track.points).reshape(-1, 2)[good]
+            dx, dy = np.median(motion, axis=0) * self.scale
+            track.box[0] += float(dx)
+            track.box[1] += float(dy)
+            track.points = forward[good].reshape(-1, 1, 2)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracker': self.method,
+                'detect_interval': self.detect_interval,
+                'tracks': len(self._tracks),
+                'frames_tracked': self.frames_tracked,
+                'redetects_requested': self.redetects_requested,
+                'min_track_score': round(min((t.score for t in self._tracks), default=1.0), 2),
+            }
@@ -0,0 +1,171 @@
+import logging
+import struct
+
+logger = logging.getLogger('fmp4')
+
+# Container boxes on the path to the boxes read here
+_CONTAINERS = {b'moov', b'mvex', b'moof', b'traf', b'trak', b'mdia', b'minf', b'stbl'}
+_NON_SYNC_SAMPLE = 0x00010000    # sample_is_non_sync_sample bit of ISO/IEC 14496-12 sample flags
+
+
+def _boxes(data, start=0, end=None):
+    """Yield (type, payload start, box end) of the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _find(data, path, start=0, end=None):
+    """Payload (start, end) of the first box at `path` (e.g. [b'moov', b'mvex', b'trex']), or None"""
+    for box_type, payload, box_end in _boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload, box_end
+            return _find(data, path[1:], payload, box_end)
+    return None
+
+
+def is_init_segment(data):
+    return data[4:8] == b'ftyp'
+
+
+def default_sample_flags(init_segment):
+    """default_sample_flags of the first track's trex box, the fallback for fragments that set none"""
+    trex = _find(init_segment, [b'moov', b'mvex', b'trex'])
+    if trex is None or trex[1] - trex[0] < 24:
+        return 0
+    return struct.unpack_from('>I', init_segment, trex[0] + 20)[0]
+
+
+def fragment_starts_with_keyframe(fragment, default_flags=0):
+    """
+        Whether the first sample of a moof+mdat fragment is a sync sample (an IDR frame),
+        so a decoder can start there. Unknown layouts count as keyframes.
+    """
+    traf = _find(fragment, [b'moof', b'traf'])
+    if traf is None:
+        return True
+    flags = default_flags
+    tfhd = _find(fragment, [b'tfhd'], *traf)
+    if tfhd:
+        pos = tfhd[0]
+        tf_flags = struct.unpack_from('>I', fragment, pos)[0] & 0xFFFFFF
+        pos += 8    # version/flags, track_ID
+        for bit, size in ((0x01, 8), (0x02, 4), (0x08, 4), (0x10, 4)):
+            if tf_flags & bit:
+                pos += size
+        if tf_flags & 0x20:
+            flags = struct.unpack_from('>I', fragment, pos)[0]
+    trun = _find(fragment, [b'trun'], *traf)
+    if trun:
+        pos = trun[0]
+        tr_flags = struct.unpack_from('>I', fragment, pos)[0] & 0xFFFFFF
+        pos += 8    # version/flags, sample_count
+        if tr_flags & 0x001:
+            pos += 4
+        if tr_flags & 0x004:
+            flags = struct.unpack_from('>I', fragment, pos)[0]
+        elif tr_flags & 0x400:
+            # Per-sample flags: skip the first sample's duration and size
+            pos += 4 * bool(tr_flags & 0x100) + 4 * bool(tr_flags & 0x200)
+            flags = struct.unpack_from('>I', fragment, pos)[0]
+    return not flags & _NON_SYNC_SAMPLE
+
+
+def codec_mime(init_segment):
+    """MediaSource type of the init segment, e.g. 'video/mp4; codecs="avc1.4d401f"'"""
+    for codec in (b'avc1', b'avc3', b'hvc1', b'hev1'):
+        pos = init_segment.find(codec)
+        if pos == -1:
+            continue
+        if codec in (b'avc1', b'avc3'):
+            avcc = init_segment.find(b'avcC', pos)
+            if avcc != -1 and avcc + 8 <= len(init_segment):
+                profile, compatibility, level = init_segment[avcc + 5:avcc + 8]
+                return f'video/mp4; codecs="{codec.decode()}.{profile:02x}{compatibility:02x}{level:02x}"'
+        return f'video/mp4; codecs="{codec.decode()}"'
+    return 'video/mp4'
+
+
+class MP4FragmentSplitter:
+    """
+        Incrementally split fragmented MP4 (FFmpeg `-movflags empty_moov+frag_keyframe`
+        output) into the init segment (ftyp+moov) and moof+mdat media fragments.
+
+        Same feed()/frames() interface as JPEGFrameSplitter, so the ingest loops can
+        read either; frames() yields bytes, valid after the next feed. Other
+        top-level boxes (styp, sidx, mfra) are dropped.
+    """
+
+    def __init__(self, read_size=256 * 1024, max_box_size=32 * 1024 * 1024):
+        self.read_size = read_size
+        self.max_box_size = max_box_size
+        self._buffer = bytearray()
+        self._init = []          # ftyp (and anything before moov) until the moov completes it
+        self._moof = None        # moof waiting for its mdat
+
+        # Counters for benchmarks/metrics
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_dropped = 0
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    def reset(self):
+        self._buffer.clear()
+        self._init, self._moof = [], None
+
+    def feed(self, data):
+        self.bytes_in += len(data)
+        self._buffer += data
+
+    def frames(self):
+        buffer = self._buffer
+        pos = 0
+        while len(buffer) - pos >= 8:
+            size, box_type = struct.unpack_from('>I4s', buffer, pos)
+            if size == 1:
+                if len(buffer) - pos < 16:
+                    break
+                size = struct.unpack_from('>Q', buffer, pos + 8)[0]
+            if size < 8 or size > self.max_box_size:
+                logger.warning(f"Corrupt or oversized MP4 box {box_type!r} ({size} bytes), dropping {len(buffer) - pos} bytes")
+                self.bytes_dropped += len(buffer) - pos
+                pos = len(buffer)
+                self._init, self._moof = [], None
+                break
+            if len(buffer) - pos < size:
+                break
+            box = bytes(buffer[pos:pos + size])
+            pos += size
+
+            if box_type == b'ftyp':
+                self._init = [box]
+            elif box_type == b'moov':
+                self.frames_out += 1
+                yield b''.join(self._init + [box])
+                self._init = []
+            elif box_type == b'moof':
+                self._moof = box
+            elif box_type == b'mdat' and self._moof is not None:
+                self.frames_out += 1
+                yield self._moof + box
+                self._moof = None
+            else:
+                self.bytes_dropped += size
+        del buffer[:pos]
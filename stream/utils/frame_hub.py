@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import threading
+from typing import NamedTuple
+
+logger = logging.getLogger('frame_hub')
+
+
+class Frame(NamedTuple):
+    """One published frame, shared read-only by every viewer of the stream"""
+    version: int                 # Hub sequence number, increases by one per publish
+    seq: int                     # RTSPClient frame_seq, matches the seq of detection messages
+    data: bytes                  # JPEG as produced by FFmpeg
+    annotated: bytes | None      # Same frame with face boxes burned in, if any
+    captured_at: float | None    # Wall clock time the frame left FFmpeg
+
+
+class FrameChannel:
+    """
+        Latest-frame mailbox of one stream.
+
+        The ingest side calls `publish` from any thread; it only swaps `latest`
+        and, at most once per event loop iteration, wakes the waiting viewers.
+        Viewers call `next_frame(version)` on the event loop and get the newest
+        frame published after `version`; frames published in between are simply
+        never seen, so a slow viewer cannot build up a backlog.
+    """
+
+    def __init__(self, stream_id, rendition=None):
+        self.stream_id = stream_id
+        self.rendition = rendition    # None for the stream's main output
+        self.latest = None
+        self.version = 0
+        self.subscribers = 0
+        self._loop = None
+        self._changed = asyncio.Event()
+        self._lock = threading.Lock()
+        self._wakeup_pending = False
+
+    def subscribe(self):
+        """Register a viewer, must be called from the event loop the viewers run on"""
+        self._loop = asyncio.get_running_loop()
+        self.subscribers += 1
+
+    def unsubscribe(self):
+        self.subscribers = max(0, self.subscribers - 1)
+
+    def publish(self, data, annotated=None, seq=0, captured_at=None):
+        with self._lock:
+            self.version += 1
+            self.latest = Frame(self.version, seq, data, annotated, captured_at)
+            if self._loop is None or self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._wakeup()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup)
+            except RuntimeError:
+                # The event loop is gone (server shutting down), nobody is waiting
+                self._wakeup_pending = False
+
+    def clear(self):
+        """Forget the last frame when the stream stops, so it is not kept in memory"""
+        with self._lock:
+            self.latest = None
+
+    def _wakeup(self):
+        with self._lock:
+            self._wakeup_pending = False
+        # set() resolves every viewer currently waiting; clearing right away makes
+        # the next wait block until the next publish
+        self._changed.set()
+        self._changed.clear()
+
+    async def next_frame(self, after_version=0):
+        """Wait for and return the newest frame with a version above `after_version`"""
+        while True:
+            frame = self.latest
+            if frame is not None and frame.version > after_version:
+                return frame
+            await self._changed.wait()
+
+
+class FrameHub:
+    """Process-wide registry of FrameChannels, one per stream id and extra rendition"""
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def channel(self, stream_id, rendition=None):
+        with self._lock:
+            channel = self._channels.get((stream_id, rendition))
+            if channel is None:
+                channel = self._channels[stream_id, rendition] = FrameChannel(stream_id, rendition)
+            return channel
+
+    def forget(self, stream_id):
+        """Drop a deleted stream's channels, for every rendition"""
+        with self._lock:
+            for key in [key for key in self._channels if key[0] == stream_id]:
+                del self._channels[key]
+
+    def stats(self):
+        with self._lock:
+            channels = list(self._channels.values())
+        return {
+            f'{channel.stream_id}:{channel.rendition}' if channel.rendition else channel.stream_id: {'version': channel.version, 'subscribers': channel.subscribers}
+            for channel in channels
+        }
+
+
+_hub = FrameHub()
+
+
+def get_frame_hub():
+    return _hub
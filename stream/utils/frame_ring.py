@@ -0,0 +1,113 @@
+import logging
+import struct
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+logger = logging.getLogger('frame_ring')
+
+# Layout of the shared memory block:
+#   header: QII (version of the last complete frame, slot count, bytes per slot), padded to 64
+#   slots:  Q state + QdII (seq, captured_at, len(frame), len(annotated)) + frame + annotated
+# A slot's state is 2 * version - 1 while its frame is being written and 2 * version once
+# it is complete, so a reader can tell a finished slot from one the writer is overwriting.
+_HEADER = struct.Struct('=QII')
+_HEADER_SIZE = 64
+_STATE = struct.Struct('=Q')
+_META = struct.Struct('=QdII')
+_SLOT_HEADER_SIZE = _STATE.size + _META.size
+
+
+class RingFrame(NamedTuple):
+    version: int                 # Ring sequence number, increases by one per write
+    seq: int                     # RTSPClient frame_seq of the writing worker
+    data: bytes
+    annotated: bytes | None
+    captured_at: float | None
+
+
+class SharedFrameRing:
+    """
+        Fixed-size ring of JPEG frames in shared memory, one writer process and one reader.
+
+        The ingest worker writes every frame into the next slot; the ASGI process reads
+        only the newest one, copying it straight out of shared memory (frames never go
+        through a pipe). Writes never wait for the reader, a reader that loses a slot
+        to the writer mid-copy just retries with the newer frame.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        _, self.slots, self.slot_bytes = _HEADER.unpack_from(shm.buf, 0)
+        self._stride = _SLOT_HEADER_SIZE + self.slot_bytes
+        self.dropped_oversize = 0
+
+    @classmethod
+    def create(cls, slots=4, slot_bytes=1024 * 1024):
+        """Allocate a new ring, the creating process owns it and unlinks it on close"""
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + slots * (_SLOT_HEADER_SIZE + slot_bytes))
+        _HEADER.pack_into(shm.buf, 0, 0, slots, slot_bytes)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open a ring created by another process"""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def version(self):
+        return _HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def _slot_offset(self, version):
+        return _HEADER_SIZE + (version % self.slots) * self._stride
+
+    def write(self, seq, captured_at, data, annotated=None):
+        """Store a frame as the newest one; returns False if it does not fit in a slot"""
+        annotated = annotated or b''
+        if len(data) + len(annotated) > self.slot_bytes:
+            if len(data) > self.slot_bytes:
+                self.dropped_oversize += 1
+                logger.warning(f"Frame of {len(data)} bytes does not fit a {self.slot_bytes} byte ring slot, dropped")
+                return False
+            annotated = b''
+
+        buf = self.shm.buf
+        version = self.version + 1
+        offset = self._slot_offset(version)
+        _STATE.pack_into(buf, offset, 2 * version - 1)
+        start = offset + _SLOT_HEADER_SIZE
+        buf[start:start + len(data)] = data
+        buf[start + len(data):start + len(data) + len(annotated)] = annotated
+        _META.pack_into(buf, offset + _STATE.size, seq, captured_at or 0.0, len(data), len(annotated))
+        _STATE.pack_into(buf, offset, 2 * version)
+        _STATE.pack_into(buf, 0, version)
+        return True
+
+    def read_latest(self, after_version=0):
+        """The newest complete frame as a RingFrame, or None if there is none newer than `after_version`"""
+        buf = self.shm.buf
+        for _ in range(3):
+            version = self.version
+            if version <= after_version:
+                return None
+            offset = self._slot_offset(version)
+            (state,) = _STATE.unpack_from(buf, offset)
+            if state != 2 * version:
+                continue
+            seq, captured_at, length, annotated_length = _META.unpack_from(buf, offset + _STATE.size)
+            start = offset + _SLOT_HEADER_SIZE
+            data = bytes(buf[start:start + length])
+            annotated = bytes(buf[start + length:start + length + annotated_length]) if annotated_length else None
+            # The writer may have lapped the ring while we copied, then the copy is torn
+            if _STATE.unpack_from(buf, offset)[0] == state:
+                return RingFrame(version, seq, data, annotated, captured_at or None)
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger('frame_slot')
+
+
+class LatestFrameSlot:
+    """
+        Per-viewer delivery slot that only ever holds the newest undelivered frame.
+
+        Frames offered while a send is in flight replace the pending one, and the
+        replaced frame is counted as dropped, so a slow viewer gets fewer frames
+        instead of a growing backlog. Daphne's send() returns once the frame is
+        buffered, so the slot can also be gated on client acks: once a viewer
+        sends its first ack, at most `max_in_flight` frames are left unacked.
+
+        With a `source` FrameChannel the slot pulls the newest frame from the
+        frame hub itself instead of being offered frames; `pick` chooses which
+        bytes of the shared Frame to send. Deliveries, drops and send times are
+        also counted in the stream's `metrics` (metrics.StreamMetrics) if given.
+        With a `tracer` (frame_trace.FrameTracer) the hop and send of sampled
+        frames are traced, and `on_traced(seq)` is awaited before one is sent.
+    """
+
+    def __init__(self, send, max_in_flight=2, source=None, pick=None, metrics=None, tracer=None, on_traced=None):
+        self._send = send                 # async callable taking the frame bytes
+        self._metrics = metrics
+        self._tracer = tracer
+        self._on_traced = on_traced
+        self._source = source             # FrameChannel to follow, None when frames are offered
+        self._pick = pick or (lambda frame: frame.data)
+        self._version = 0                 # Hub version of the last frame taken from the source
+        self._pending = None              # (frame_bytes, captured_at, seq)
+        self._has_pending = asyncio.Event()
+        self._has_credit = asyncio.Event()
+        self._has_credit.set()
+        self._task = None
+        self._sent_capture_times = collections.deque()
+
+        self.max_in_flight = max_in_flight
+        self.acks_enabled = False
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+        self._lag_samples = 0
+
+    def start(self):
+        if self._source:
+            self._source.subscribe()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self._source:
+                self._source.unsubscribe()
+        self._pending = None
+
+    def offer(self, frame_bytes, captured_at=None, seq=None):
+        """Queue a frame for delivery, replacing any frame that has not been sent yet"""
+        if self._pending is not None:
+            self.frames_dropped += 1
+            if self._metrics:
+                self._metrics.frames_dropped_total += 1
+        self._pending = (frame_bytes, captured_at, seq)
+        self._has_pending.set()
+
+    def ack(self, count=1):
+        """Record that the viewer has received `count` more frames"""
+        self.acks_enabled = True
+        now = time.time()
+        for _ in range(min(count, len(self._sent_capture_times))):
+            captured_at = self._sent_capture_times.popleft()
+            if captured_at is not None:
+                self._record_lag(now - captured_at)
+        if len(self._sent_capture_times) < self.max_in_flight:
+            self._has_credit.set()
+
+    def _record_lag(self, lag):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        self._lag_samples += 1
+
+    def stats(self):
+        return {
+            'frames_delivered': self.frames_delivered,
+            'frames_dropped': self.frames_dropped,
+            'in_flight': len(self._sent_capture_times) if self.acks_enabled else 0,
+            'acks_enabled': self.acks_enabled,
+            'lag_last_ms': round(self.last_lag * 1000, 1),
+            'lag_avg_ms': round(self._lag_total / self._lag_samples * 1000, 1) if self._lag_samples else 0.0,
+            'lag_max_ms': round(self.max_lag * 1000, 1),
+        }
+
+    async def _next(self):
+        """Wait for the next frame to deliver, returns (frame_bytes, captured_at, seq)"""
+        if self._source is None:
+            await self._has_pending.wait()
+            if self.acks_enabled:
+                await self._has_credit.wait()
+            self._has_pending.clear()
+            pending, self._pending = self._pending, None
+            return pending
+
+        if self.acks_enabled:
+            await self._has_credit.wait()
+        frame = await self._source.next_frame(self._version)
+        if self._version:
+            # Frames published while this viewer was busy were never picked up
+            self.frames_dropped += frame.version - self._version - 1
+            if self._metrics:
+                self._metrics.frames_dropped_total += frame.version - self._version - 1
+        self._version = frame.version
+        return self._pick(frame), frame.captured_at, frame.seq
+
+    async def _run(self):
+        while True:
+            frame_bytes, captured_at, seq = await self._next()
+            traced = self._tracer is not None and self._tracer.sampled(seq)
+
+            try:
+                if traced:
+                    self._tracer.picked_up(seq)
+                    if self._on_traced:
+                        await self._on_traced(seq)
+                send_started = time.perf_counter()
+                await self._send(frame_bytes)
+            except Exception as e:
+                logger.error(f"Error sending frame to client: {str(e)}")
+                continue
+
+            self.frames_delivered += 1
+            if self._metrics or traced:
+                send_time = time.perf_counter() - send_started
+                if self._metrics:
+                    self._metrics.send_latency.observe(send_time)
+                    self._metrics.frames_sent_total += 1
+                if traced:
+                    self._tracer.record('send', send_time)
+            if self.acks_enabled:
+                # Lag is measured when the viewer acks the frame
+                self._sent_capture_times.append(captured_at)
+                if len(self._sent_capture_times) >= self.max_in_flight:
+                    self._has_credit.clear()
+            elif captured_at is not None:
+                self._record_lag(time.time() - captured_at)
@@ -0,0 +1,136 @@
+import logging
+
+logger = logging.getLogger('frame_splitter')
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+
+
+class JPEGFrameSplitter:
+    """
+        Incrementally split an MJPEG byte stream (FFmpeg `-f mjpeg` output) into frames.
+
+        Bytes are read straight into one preallocated buffer with `readinto`, the
+        marker scan resumes where the previous one stopped, and complete frames are
+        handed out as memoryview slices of that buffer. A frame view is only valid
+        until the next `read_from`/`feed` call; use `bytes(frame)` to keep it longer.
+    """
+
+    def __init__(self, buffer_size=8 * 1024 * 1024, read_size=256 * 1024, min_frame_size=200):
+        if read_size > buffer_size // 2:
+            raise ValueError("read_size must be at most half of buffer_size")
+        self.buffer_size = buffer_size
+        self.read_size = read_size
+        self.min_frame_size = min_frame_size
+
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._head = 0           # First byte not yet consumed
+        self._tail = 0           # One past the last valid byte
+        self._scan = 0           # Where the next marker search resumes
+        self._frame_start = -1   # Offset of the SOI of the frame being assembled
+
+        # Counters for benchmarks/metrics
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_copied = 0    # Bytes moved while compacting the buffer
+        self.bytes_dropped = 0   # Bytes discarded on overflow or as junk
+
+    @property
+    def buffered(self):
+        """Number of bytes held that have not been emitted as a frame yet"""
+        return self._tail - self._head
+
+    def reset(self):
+        self._head = self._tail = self._scan = 0
+        self._frame_start = -1
+
+    def _make_room(self, needed):
+        """Ensure `needed` bytes are free at the tail, compacting or dropping data if required"""
+        if self.buffer_size - self._tail >= needed:
+            return
+
+        # Only the partial frame (or the few bytes after the last scan) is kept.
+        keep_from = self._frame_start if self._frame_start != -1 else max(self._head, self._scan - 1)
+        self.bytes_dropped += keep_from - self._head
+        pending = self._tail - keep_from
+
+        if pending + needed > self.buffer_size:
+            # A single partial frame filled the buffer; give up on it and resync on the next SOI.
+            logger.warning(f"Frame exceeds splitter buffer ({self.buffer_size} bytes), dropping {pending} bytes.")
+            self.bytes_dropped += pending
+            self.reset()
+            return
+
+        if pending:
+            self._view[0:pending] = self._view[keep_from:self._tail]
+            self.bytes_copied += pending
+        shift = keep_from
+        self._head = 0
+        self._tail = pending
+        self._scan = max(0, self._scan - shift)
+        if self._frame_start != -1:
+            self._frame_start -= shift
+
+    def read_from(self, stream):
+        """
+            Read one block from a raw binary stream into the buffer.
+            Returns the number of bytes read, 0 on EOF.
+        """
+        self._make_room(self.read_size)
+        n = stream.readinto(self._view[self._tail:self._tail + self.read_size])
+        if not n:
+            return 0
+        self._tail += n
+        self.bytes_in += n
+        return n
+
+    def feed(self, data):
+        """
+            Append bytes that were read elsewhere (e.g. from an asyncio stream).
+            Drain `frames()` after each call, unscanned data is dropped on overflow.
+        """
+        data = memoryview(data)
+        while len(data):
+            self._make_room(min(len(data), self.read_size))
+            n = min(len(data), self.buffer_size - self._tail)
+            self._view[self._tail:self._tail + n] = data[:n]
+            self._tail += n
+            self.bytes_in += n
+            data = data[n:]
+
+    def frames(self):
+        """Yield every complete JPEG frame currently in the buffer as a memoryview"""
+        buffer = self._buffer
+        while True:
+            if self._frame_start == -1:
+                start = buffer.find(JPEG_START, self._scan, self._tail)
+                if start == -1:
+                    # Keep a trailing 0xFF around in case the marker straddles two reads
+                    self._scan = max(self._head, self._tail - 1)
+                    if self._scan > self._head:
+                        self.bytes_dropped += self._scan - self._head
+                        self._head = self._scan
+                    return
+                self.bytes_dropped += start - self._head
+                self._frame_start = start
+                self._head = start
+                self._scan = start + len(JPEG_START)
+
+            end = buffer.find(JPEG_END, self._scan, self._tail)
+            if end == -1:
+                self._scan = max(self._scan, self._tail - 1)
+                return
+
+            end += len(JPEG_END)
+            start = self._frame_start
+            self._frame_start = -1
+            self._head = self._scan = end
+
+            if end - start < self.min_frame_size:
+                logger.warning(f"Skipping very small/empty frame candidate: {end - start} bytes")
+                self.bytes_dropped += end - start
+                continue
+
+            self.frames_out += 1
+            yield self._view[start:end]
@@ -0,0 +1,124 @@
+import collections
+import threading
+import time
+
+# Stages in the order a frame goes through them. read: from the pipe read that brought
+# the frame's first bytes to the one that completed it (0 if one read had it all);
+# split: from there until the splitter yields it; process: detection submit
+# and box drawing; publish: DVR append and hand-off to the frame hub or channel layer;
+# hop: from the hand-off until a viewer's slot picks the frame up; send: the WebSocket
+# send; client: from the trace message until the viewer's echo, i.e. network and
+# render time. detection runs off the frame path, from submit to result.
+STAGES = ('read', 'split', 'process', 'publish', 'hop', 'send', 'client', 'detection')
+
+# Hand-off times kept for viewers to look up, per stream
+MAX_HANDOFFS = 64
+
+
+def frame_trace_config():
+    from django.conf import settings
+    return getattr(settings, 'LATENCY_TRACE', {})
+
+
+class FrameTrace:
+    """The ingest stages of one sampled frame, each mark() records the time since the previous one"""
+
+    __slots__ = ('tracer', 'seq', 'last')
+
+    def __init__(self, tracer, seq, first_read_at, last_read_at):
+        self.tracer = tracer
+        self.seq = seq
+        self.last = time.perf_counter()
+        tracer.record('read', last_read_at - first_read_at)
+        tracer.record('split', self.last - last_read_at)
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.tracer.record(stage, now - self.last)
+        self.last = now
+
+    def handoff(self):
+        """The frame leaves the ingest now, viewers measure their hop from here"""
+        self.tracer.handoff(self.seq, self.last)
+
+
+class FrameTracer:
+    """
+        Sampling latency tracer of one stream. Every `sample_every`-th frame (by frame
+        seq, so the ingest and the viewers agree on which ones) gets its stage durations
+        recorded, the last `ring_size` per stage. Frames that are not sampled cost a
+        modulo.
+    """
+
+    def __init__(self, sample_every=30, ring_size=1024):
+        self.sample_every = sample_every
+        self._spans = {stage: collections.deque(maxlen=ring_size) for stage in STAGES}
+        self._handoffs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def sampled(self, seq):
+        return bool(self.sample_every) and seq is not None and seq % self.sample_every == 0
+
+    def begin(self, seq, first_read_at, last_read_at):
+        """A FrameTrace for frame `seq`, read from the pipe between the two times, if it is sampled, else None"""
+        if not self.sampled(seq):
+            return None
+        return FrameTrace(self, seq, first_read_at, last_read_at)
+
+    def record(self, stage, seconds):
+        self._spans[stage].append(seconds)
+
+    def handoff(self, seq, at=None):
+        with self._lock:
+            self._handoffs[seq] = time.perf_counter() if at is None else at
+            if len(self._handoffs) > MAX_HANDOFFS:
+                self._handoffs.popitem(last=False)
+
+    def picked_up(self, seq):
+        """A viewer's slot took frame `seq`, records the hop since its hand-off"""
+        with self._lock:
+            handed_off = self._handoffs.get(seq)
+        if handed_off is not None:
+            self.record('hop', time.perf_counter() - handed_off)
+
+    def stats(self):
+        """Percentiles per stage in ms, stages without samples are left out"""
+        stages = {}
+        for stage, spans in self._spans.items():
+            samples = sorted(spans)
+            if not samples:
+                continue
+
+            def percentile(p):
+                return round(1000 * samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+
+            stages[stage] = {
+                'count': len(samples),
+                'p50_ms': percentile(0.50),
+                'p95_ms': percentile(0.95),
+                'p99_ms': percentile(0.99),
+                'max_ms': round(1000 * samples[-1], 2),
+            }
+        return stages
+
+
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def frame_tracer(stream_id):
+    """The FrameTracer of a stream id configured by settings.LATENCY_TRACE, created on first use"""
+    tracer = _tracers.get(stream_id)
+    if tracer is None:
+        with _tracers_lock:
+            tracer = _tracers.get(stream_id)
+            if tracer is None:
+                config = frame_trace_config()
+                tracer = _tracers[stream_id] = FrameTracer(config.get('SAMPLE_EVERY', 30), config.get('RING_SIZE', 1024))
+    return tracer
+
+
+def forget_tracer(stream_id):
+    """Drop a deleted stream's FrameTracer and its samples"""
+    with _tracers_lock:
+        _tracers.pop(stream_id, None)
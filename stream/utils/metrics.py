@@ -0,0 +1,268 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; detection and send latencies, and FFmpeg's time to first frame
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STARTUP_BUCKETS = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0)
+# Seconds from losing FFmpeg's output to the first frame of its replacement
+RECOVERY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# A stream whose last frame is older than this reports an ingest rate of 0
+FPS_STALE_S = 5.0
+
+
+def metrics_config():
+    from django.conf import settings
+    return getattr(settings, 'METRICS', {})
+
+
+class Histogram:
+    """
+        Prometheus histogram with fixed buckets. observe() is a bisect and three
+        increments with no lock: each stream's values come from its own ingest,
+        detection and send paths, and an increment lost to two writers racing
+        is an acceptable error for a metric.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def state(self):
+        return list(self.counts), self.sum, self.count
+
+    def add(self, counts, total, count):
+        """Merge in observations made elsewhere (an ingest worker process)"""
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+        self.count += count
+
+
+class StreamMetrics:
+    """
+        Counters of one stream id, kept across the clients that run it so counters
+        only ever go up. Updated from the hot paths with plain attribute increments.
+    """
+
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.frames_total = 0           # Frames (or passthrough fragments) out of FFmpeg
+        self.bytes_total = 0            # Bytes read from FFmpeg's stdout
+        self.frames_sent_total = 0      # Frames delivered to viewers
+        self.frames_dropped_total = 0   # Frames viewers skipped because they were busy
+        self.ffmpeg_starts_total = 0    # FFmpeg processes that delivered a first frame
+        self.reconnects_total = 0       # Outages recovered from by restarting FFmpeg
+        self.stalls_total = 0           # FFmpeg processes restarted because no frame came
+        self.last_frame_time = 0.0      # Wall clock time of the newest frame
+        self.frame_interval = 0.0       # Moving average of the time between frames
+        self.detection_latency = Histogram()
+        self.send_latency = Histogram()
+        self.first_frame = Histogram(STARTUP_BUCKETS)
+        self.recovery = Histogram(RECOVERY_BUCKETS)
+
+    def frame(self, now):
+        """Count one frame at wall clock time `now`"""
+        if self.last_frame_time:
+            interval = now - self.last_frame_time
+            self.frame_interval = interval if not self.frame_interval else self.frame_interval + 0.1 * (interval - self.frame_interval)
+        self.last_frame_time = now
+        self.frames_total += 1
+
+    def ffmpeg_started(self, first_frame_s):
+        self.ffmpeg_starts_total += 1
+        if first_frame_s is not None:
+            self.first_frame.observe(first_frame_s)
+
+    def worker_snapshot(self):
+        """What an ingest worker process measured that the ASGI process cannot see itself"""
+        return {
+            'bytes_total': self.bytes_total,
+            'ffmpeg_starts_total': self.ffmpeg_starts_total,
+            'reconnects_total': self.reconnects_total,
+            'stalls_total': self.stalls_total,
+            'detection_latency': self.detection_latency.state(),
+            'first_frame': self.first_frame.state(),
+            'recovery': self.recovery.state(),
+        }
+
+    def merge_worker(self, snapshot, previous=None):
+        """Add what a worker measured since its `previous` snapshot (None for a new worker)"""
+        for name in ('bytes_total', 'ffmpeg_starts_total', 'reconnects_total', 'stalls_total'):
+            setattr(self, name, getattr(self, name) + snapshot[name] - (previous[name] if previous else 0))
+        for name in ('detection_latency', 'first_frame', 'recovery'):
+            counts, total, count = snapshot[name]
+            if previous:
+                old_counts, old_total, old_count = previous[name]
+                counts, total, count = [a - b for a, b in zip(counts, old_counts)], total - old_total, count - old_count
+            getattr(self, name).add(counts, total, count)
+
+    @property
+    def fps(self):
+        if not self.frame_interval or time.time() - self.last_frame_time > FPS_STALE_S:
+            return 0.0
+        return 1.0 / self.frame_interval
+
+
+_stream_metrics = {}
+_lock = threading.Lock()
+
+
+def stream_metrics(stream_id):
+    """The StreamMetrics of a stream id, created on first use"""
+    metrics = _stream_metrics.get(stream_id)
+    if metrics is None:
+        with _lock:
+            metrics = _stream_metrics.setdefault(stream_id, StreamMetrics(stream_id))
+    return metrics
+
+
+def drop_stream_metrics(stream_id):
+    """Forget a deleted stream's metrics, so /metrics stops reporting it"""
+    with _lock:
+        _stream_metrics.pop(stream_id, None)
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class _Exposition:
+    """Builds the text exposition, one HELP/TYPE header per metric family"""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text, samples):
+        """`samples` is a list of (labels dict, value); families without samples are left out"""
+        if not samples:
+            return
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            self.lines.append(f'{name}{self._labels(labels)} {self._value(value)}')
+
+    def histogram(self, name, help_text, samples):
+        """`samples` is a list of (labels dict, Histogram)"""
+        if not samples:
+            return
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in samples:
+            counts, total, count = histogram.state()
+            cumulative = 0
+            for bound, n in zip((*histogram.buckets, '+Inf'), counts):
+                cumulative += n
+                self.lines.append(f'{name}_bucket{self._labels({**labels, "le": bound})} {cumulative}')
+            self.lines.append(f'{name}_sum{self._labels(labels)} {self._value(total)}')
+            self.lines.append(f'{name}_count{self._labels(labels)} {count}')
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{_label(value)}"' for key, value in labels.items()) + '}'
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, float):
+            return repr(round(value, 6))
+        return str(int(value))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _process_samples():
+    """CPU time, resident memory and open fds of this process, from /proc (Linux only)"""
+    samples = {}
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        samples['cpu'] = (int(fields[11]) + int(fields[12])) / ticks
+        samples['threads'] = int(fields[17])
+        samples['rss'] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        samples['fds'] = len(os.listdir('/proc/self/fd'))
+    except (OSError, IndexError, ValueError):
+        pass
+    return samples
+
+
+def render_metrics(clients):
+    """Prometheus text exposition of every stream's metrics and the process, `clients` is consumer.active_streams"""
+    out = _Exposition()
+    with _lock:
+        metrics = list(_stream_metrics.values())
+    running = {stream_id: client for stream_id, client in list(clients.items()) if client.is_running}
+
+    def per_stream(value):
+        return [({'stream': m.stream_id}, value(m)) for m in metrics]
+
+    def per_running(value):
+        return [({'stream': stream_id}, value(client)) for stream_id, client in running.items()]
+
+    out.family('rtsp_streams_running', 'gauge', 'Streams with a running ingest', [({}, len(running))])
+    out.family('rtsp_viewers', 'gauge', 'Viewers of all streams', [({}, sum(c.client_count for c in running.values()))])
+    out.family('rtsp_stream_viewers', 'gauge', 'Viewers of the stream', per_running(lambda c: c.client_count))
+    out.family('rtsp_stream_ingest_fps', 'gauge', 'Frames per second out of FFmpeg, moving average',
+               per_running(lambda c: c.metrics.fps))
+    out.family('rtsp_stream_last_frame_timestamp_seconds', 'gauge', 'Unix time of the newest frame',
+               per_running(lambda c: c.metrics.last_frame_time))
+    out.family('rtsp_stream_reconnecting', 'gauge', '1 while FFmpeg is being restarted after its output stopped',
+               per_running(lambda c: int(c.reconnecting)))
+    out.family('rtsp_stream_splitter_buffered_bytes', 'gauge', 'Bytes read from FFmpeg that are not a complete frame yet',
+               per_running(lambda c: c.splitter_buffered()))
+    out.family('rtsp_stream_frames_total', 'counter', 'Frames out of FFmpeg', per_stream(lambda m: m.frames_total))
+    out.family('rtsp_stream_ffmpeg_bytes_total', 'counter', "Bytes read from FFmpeg's output", per_stream(lambda m: m.bytes_total))
+    out.family('rtsp_stream_frames_sent_total', 'counter', 'Frames delivered to viewers', per_stream(lambda m: m.frames_sent_total))
+    out.family('rtsp_stream_frames_dropped_total', 'counter', 'Frames viewers skipped because they were still busy',
+               per_stream(lambda m: m.frames_dropped_total))
+    out.family('rtsp_stream_ffmpeg_starts_total', 'counter',
+               'FFmpeg processes that delivered a first frame: starts, reconnects, worker restarts and rendition changes',
+               per_stream(lambda m: m.ffmpeg_starts_total))
+    out.family('rtsp_stream_reconnects_total', 'counter', 'Outages recovered from by restarting FFmpeg',
+               per_stream(lambda m: m.reconnects_total))
+    out.family('rtsp_stream_stalls_total', 'counter', 'FFmpeg processes restarted because no frame came for RTSP_RECONNECT STALL_S',
+               per_stream(lambda m: m.stalls_total))
+    out.histogram('rtsp_stream_recovery_seconds', 'Time from losing the stream to the first frame after reconnecting',
+                  per_stream(lambda m: m.recovery))
+    out.histogram('rtsp_stream_first_frame_seconds', 'Time from starting FFmpeg to its first frame',
+                  per_stream(lambda m: m.first_frame))
+    out.histogram('rtsp_stream_detection_latency_seconds', 'Time from submitting a frame for detection to its result',
+                  per_stream(lambda m: m.detection_latency))
+    out.histogram('rtsp_stream_send_latency_seconds', 'Time to hand a frame to a viewer connection',
+                  per_stream(lambda m: m.send_latency))
+
+    try:
+        from .snapshots import get_snapshots
+        cache = get_snapshots().stats()
+        out.family('rtsp_snapshot_cache_hits_total', 'counter', 'Snapshot requests served from the cache', [({}, cache['hits'])])
+        out.family('rtsp_snapshot_cache_misses_total', 'counter', 'Snapshot requests that had to encode or grab', [({}, cache['misses'])])
+        out.family('rtsp_snapshot_cache_bytes', 'gauge', 'Bytes held by the snapshot cache', [({}, cache['bytes'])])
+    except Exception as e:
+        logger.warning(f"Could not collect snapshot cache metrics: {e}")
+
+    process = _process_samples()
+    if process:
+        out.family('process_cpu_seconds_total', 'counter', 'User and system CPU time of this process', [({}, process['cpu'])])
+        out.family('process_resident_memory_bytes', 'gauge', 'Resident memory of this process', [({}, process['rss'])])
+        out.family('process_open_fds', 'gauge', 'Open file descriptors of this process', [({}, process['fds'])])
+        out.family('process_threads', 'gauge', 'Threads of this process', [({}, process['threads'])])
+    return out.text()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger('mjpeg_http')
+
+BOUNDARY = 'frame'
+CONTENT_TYPE = f'multipart/x-mixed-replace; boundary={BOUNDARY}'
+
+# Seconds without a frame after which a response checks whether its stream still runs
+STALL_CHECK_S = 5.0
+
+
+def mjpeg_part(frame_bytes):
+    """One part of the multipart/x-mixed-replace body"""
+    return b''.join((
+        f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame_bytes)}\r\n\r\n'.encode('ascii'),
+        frame_bytes,
+        b'\r\n',
+    ))
+
+
+class MJPEGStream:
+    """
+        Body of an MJPEG-over-HTTP response, for viewers that cannot speak the
+        WebSocket protocol (<img> tags, NVRs, curl health checks).
+
+        `join` is a coroutine function called on the event loop that counts this
+        viewer on the stream's shared client and returns (client, started), like
+        consumer.join_stream, and `leave(client, burned_in)` undoes it. So HTTP
+        viewers share FFmpeg with the WebSocket ones and keep the stream running
+        the same way.
+        Frames come from the frame hub (or stream_frame messages with channel layer
+        fan-out, read by a task of their own into a one-frame slot) latest-frame-wins:
+        while a part is being sent, newer frames replace each other and only the
+        newest is sent next. `max_fps` caps the rate per
+        viewer. The body ends when the stream stops.
+    """
+
+    def __init__(self, join, leave, burned_in=True, max_fps=0):
+        self._join = join
+        self._leave = leave
+        self.burned_in = burned_in
+        self.max_fps = max_fps
+        self._loop = None
+        self._parts = self._stream()
+
+    def __aiter__(self):
+        return self._parts
+
+    def close(self):
+        """
+            Called by Django from a worker thread when the response is over (also when
+            the client went away): leave the stream now, not whenever the suspended
+            body gets garbage collected
+        """
+        if self._loop and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._parts.aclose(), self._loop)
+
+    async def _stream(self):
+        self._loop = asyncio.get_running_loop()
+        client, _ = await self._join()
+        source = client.frame_channel
+        slot = None
+        if source:
+            source.subscribe()
+        else:
+            slot = _LayerFrameSlot(client, self.burned_in)
+            await slot.start()
+
+        min_interval = 1.0 / self.max_fps if self.max_fps else 0.0
+        version = 0
+        sent = dropped = 0
+        next_send = time.monotonic()
+        logger.info(f"MJPEG viewer joined stream {client.stream_id}")
+        try:
+            while True:
+                try:
+                    if source:
+                        frame = await asyncio.wait_for(source.next_frame(version), STALL_CHECK_S)
+                        if version:
+                            dropped += frame.version - version - 1
+                            client.metrics.frames_dropped_total += frame.version - version - 1
+                        version = frame.version
+                        frame_bytes = frame.annotated if self.burned_in and frame.annotated else frame.data
+                    else:
+                        frame_bytes = await asyncio.wait_for(slot.take(), STALL_CHECK_S)
+                except asyncio.TimeoutError:
+                    if not client.is_running:
+                        break
+                    continue
+
+                send_started = time.perf_counter()
+                yield mjpeg_part(frame_bytes)
+                sent += 1
+                client.metrics.send_latency.observe(time.perf_counter() - send_started)
+                client.metrics.frames_sent_total += 1
+                if min_interval:
+                    next_send = max(next_send + min_interval, time.monotonic())
+                    await asyncio.sleep(next_send - time.monotonic())
+        finally:
+            if source:
+                source.unsubscribe()
+            else:
+                dropped = slot.dropped
+                await slot.stop()
+            self._leave(client, burned_in=self.burned_in)
+            logger.info(f"MJPEG viewer left stream {client.stream_id}: {sent} frames sent, {dropped} dropped")
+
+
+class _LayerFrameSlot:
+    """
+        Newest stream_frame of a stream's group with channel layer fan-out. A task
+        keeps receiving, so the layer's per-channel queue never backs up behind a
+        slow HTTP client; a frame that arrives before the previous one was taken
+        replaces it and counts as dropped.
+    """
+
+    def __init__(self, client, burned_in):
+        self.client = client
+        self.burned_in = burned_in
+        self.dropped = 0
+        self._frame = None
+        self._ready = asyncio.Event()
+        self._channel_layer = get_channel_layer()
+        self._channel = None
+        self._task = None
+
+    async def start(self):
+        self._channel = await self._channel_layer.new_channel()
+        await self._channel_layer.group_add(self.client.group_name, self._channel)
+        self._task = asyncio.create_task(self._receive())
+
+    async def _receive(self):
+        while True:
+            message = await self._channel_layer.receive(self._channel)
+            # Other renditions' frames are for the WebSocket viewers that chose them
+            if message['type'] != 'stream_frame' or message.get('rendition'):
+                continue
+            if self._frame is not None:
+                self.dropped += 1
+                self.client.metrics.frames_dropped_total += 1
+            self._frame = message['frame']
+            if self.burned_in and message.get('annotated_frame'):
+                self._frame = message['annotated_frame']
+            self._ready.set()
+
+    async def take(self):
+        """Wait for a frame newer than the last one taken"""
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+    async def stop(self):
+        self._task.cancel()
+        await self._channel_layer.group_discard(self.client.group_name, self._channel)
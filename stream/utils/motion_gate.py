@@ -0,0 +1,82 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('motion_gate')
+
+
+class MotionGate:
+    """
+        Cheap motion check in front of the face detector.
+
+        Frames are decoded at 1/8 size in grayscale (libjpeg does the scaling),
+        shrunk to `width` pixels, blurred and compared with the frame the detector
+        last ran on. Detection runs when the fraction of changed pixels exceeds
+        `threshold`, or when `refresh_interval` seconds passed since the last run.
+        A threshold of 0 disables the gate.
+    """
+
+    def __init__(self, threshold=0.01, pixel_delta=25, refresh_interval=5.0, width=80):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self._reference = None
+        self._last_open = 0.0
+
+        self.hits = 0         # Detector ran because of motion
+        self.refreshes = 0    # Detector ran because of the forced refresh
+        self.misses = 0       # Detector skipped, static scene
+        self.last_changed = 0.0
+
+    def _thumbnail(self, image_bytes):
+        gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None or gray.size == 0:
+            return None
+        height = max(1, gray.shape[0] * self.width // gray.shape[1])
+        thumbnail = cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(thumbnail, (5, 5), 0)
+
+    def should_detect(self, image_bytes):
+        """Return True if the detector should run on this frame"""
+        if not self.threshold:
+            self.hits += 1
+            return True
+
+        thumbnail = self._thumbnail(image_bytes)
+        if thumbnail is None:
+            # Can't tell, let the detector deal with the frame
+            return True
+
+        now = time.monotonic()
+        if self._reference is None or self._reference.shape != thumbnail.shape:
+            changed = 1.0
+        else:
+            diff = cv2.absdiff(thumbnail, self._reference)
+            changed = float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+        self.last_changed = changed
+
+        if changed > self.threshold:
+            self.hits += 1
+        elif now - self._last_open >= self.refresh_interval:
+            self.refreshes += 1
+        else:
+            self.misses += 1
+            return False
+
+        self._reference = thumbnail
+        self._last_open = now
+        return True
+
+    def stats(self):
+        total = self.hits + self.refreshes + self.misses
+        return {
+            'threshold': self.threshold,
+            'gate_hits': self.hits,
+            'gate_refreshes': self.refreshes,
+            'gate_misses': self.misses,
+            'gate_skip_ratio': round(self.misses / total, 3) if total else 0.0,
+            'last_changed_area': round(self.last_changed, 4),
+        }
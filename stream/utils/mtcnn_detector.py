@@ -1,21 +1,36 @@
 import cv2
 from mtcnn_cv2 import MTCNN as MTCNN_CV2_Lib
-import PIL
-import PIL.Image as Image
-import io
 import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+# cv2.imdecode flags that let libjpeg decode straight to 1/2, 1/4 or 1/8 of the size
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 class MTCNNDetector:
-    def __init__(self):
+    def __init__(self, decode_scale=1, jpeg_quality=85, min_confidence=0.7):
         """
-            Initialize the detector once per instance of this class
-            This ensures that if multiple RTSPClient instances are created,
-            each has its own MTCNN detector, which can help with thread safety
-            if the underlying DNN models are not fully re-entrant.
+            Initialize the detector once per instance of this class.
+            The underlying DNN models are not re-entrant, so an instance must
+            only be used from one thread at a time (see DetectionPool).
+
+            decode_scale: 1, 2, 4 or 8 - decode frames at 1/N size for the detector
+            input, boxes are scaled back to full frame coordinates.
+            min_confidence: faces scored below this are dropped.
         """
+        if decode_scale not in _REDUCED_DECODE_FLAGS:
+            raise ValueError(f"decode_scale must be one of {sorted(_REDUCED_DECODE_FLAGS)}")
+        self.decode_scale = decode_scale
+        self.jpeg_quality = jpeg_quality
+        self.min_confidence = min_confidence
+        # RGB detector input, reused across frames of the same size
+        self._rgb = None
         try:
             self.detector = MTCNN_CV2_Lib()
             logger.info("MTCNN detector initialized successfully.")
@@ -24,76 +39,86 @@ class MTCNNDetector:
             self.detector = None
 
     def detect_faces(self, image_bytes):
+        """Detect faces and burn the boxes into the frame, returns (jpeg_bytes, success)"""
+        faces = self.find_faces(image_bytes)
+        if faces is None:
+            return image_bytes, False
+        return self.draw_faces(image_bytes, faces, self.jpeg_quality)
+
+    def find_faces(self, image_bytes):
+        """
+            Run MTCNN on a JPEG frame and return the faces above the confidence threshold
+            as a list of {'box': [x, y, w, h], 'confidence': float}, or None on failure.
+        """
         if not self.detector:
             logger.warning("MTCNN detector not initialized, skipping face detection.")
-            return image_bytes, False
-            
+            return None
+
+        image_array_rgb = self.decode(image_bytes)
+        if image_array_rgb is None:
+            return None
+
+        try:
+            # MTCNN expects RGB format, which image_array_rgb should be.
+            result = self.detector.detect_faces(image_array_rgb)
+        except cv2.error as e:
+            logger.error(f"OpenCV error in face detection: {str(e)}. Image shape: {image_array_rgb.shape}, dtype: {image_array_rgb.dtype}", exc_info=True)
+            return None
+        except Exception as e:
+            logger.error(f"Generic error in face detection: {str(e)}. Image shape: {image_array_rgb.shape}, dtype: {image_array_rgb.dtype}", exc_info=True)
+            return None
+
+        # threshold, and back to full frame coordinates
+        scale = self.decode_scale
+        return [
+            {'box': [int(v) * scale for v in face['box']], 'confidence': float(face['confidence'])}
+            for face in result if face['confidence'] > self.min_confidence
+        ]
+
+    def decode(self, image_bytes):
+        """
+            Decode JPEG bytes (or a memoryview) into the reused RGB detector input,
+            at 1/decode_scale size. Returns None if the frame is unusable.
+        """
         if not image_bytes or len(image_bytes) < 100: # Basic check
             logger.warning("detect_faces received empty or too small image_bytes.")
+            return None
+
+        # np.frombuffer wraps the bytes without copying; libjpeg does the downscale while decoding
+        image_bgr = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), _REDUCED_DECODE_FLAGS[self.decode_scale])
+        if image_bgr is None or image_bgr.size == 0:
+            logger.error("Failed to decode image from bytes (corrupted JPEG?).")
+            return None
+
+        if self._rgb is None or self._rgb.shape != image_bgr.shape:
+            self._rgb = np.empty_like(image_bgr)
+        cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        return self._rgb
+
+    @staticmethod
+    def draw_faces(image_bytes, faces, jpeg_quality=85):
+        """Draw face boxes onto a JPEG frame, returns (jpeg_bytes, success)"""
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None or image.size == 0:
+            logger.error("Failed to decode image from bytes (corrupted JPEG?).")
             return image_bytes, False
 
         try:
-            # Convert bytes to PIL Image
-            try:
-                image_pil = Image.open(io.BytesIO(image_bytes))
-            except PIL.UnidentifiedImageError:
-                logger.error("Failed to identify image from bytes (corrupted JPEG?).")
-                return image_bytes, False
-            
-            # Convert PIL Image to numpy array MTCNN_CV2 expects RGB.
-            image_array_rgb = np.array(image_pil)
-
-            # Ensure the image array is not empty and has 3 dimensions (H, W, C)
-            if image_array_rgb.size == 0 or image_array_rgb.ndim != 3:
-                logger.error(f"Invalid image array shape after PIL conversion: {image_array_rgb.shape if hasattr(image_array_rgb, 'shape') else 'None'}")
-                return image_bytes, False
+            # Drawing in BGR, green is the same in both orders
+            for face in faces:
+                x, y, w, h = face['box']
+                confidence = face['confidence']
+                cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                cv2.putText(image, f'{confidence:.2f}',
+                          (x, y - 10),
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
 
-            # Handle grayscale or RGBA images explicitly
-            if image_array_rgb.shape[2] == 1: # Grayscale (though JPEGs are usually 3-channel)
-                image_array_rgb = cv2.cvtColor(image_array_rgb, cv2.COLOR_GRAY2RGB)
-            elif image_array_rgb.shape[2] == 4: # RGBA
-                image_array_rgb = cv2.cvtColor(image_array_rgb, cv2.COLOR_RGBA2RGB)
-            
-            # Crucial: Ensure the image is contiguous and has the correct data type
-            if image_array_rgb.dtype != np.uint8:
-                 image_array_rgb = image_array_rgb.astype(np.uint8)
-            
-            # Ensure the array is C-contiguous, OpenCV sometimes requires this.
-            if not image_array_rgb.flags['C_CONTIGUOUS']:
-                image_array_rgb = np.ascontiguousarray(image_array_rgb, dtype=np.uint8)
-
-            # Defensive check for empty image after conversions
-            if image_array_rgb.shape[0] == 0 or image_array_rgb.shape[1] == 0:
-                logger.error(f"Image became empty after conversions. Original shape from PIL: {np.array(image_pil).shape}")
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            if not ok:
+                logger.error("Failed to encode annotated frame.")
                 return image_bytes, False
+            return encoded.tobytes(), True
 
-            # MTCNN expects RGB format, which image_array_rgb should be.
-            result = self.detector.detect_faces(image_array_rgb)
-            
-            for face in result:
-                bounding_box = face['box']
-                # keypoints = face['keypoints']
-                confidence = face['confidence']
-                # threshold 
-                if confidence > 0.7: 
-                    x, y, w, h = bounding_box
-                    cv2.rectangle(image_array_rgb, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                    cv2.putText(image_array_rgb, f'{confidence:.2f}', 
-                              (x, y - 10),
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-            
-            # Convert back to PIL Image (from RGB numpy array)
-            modified_image_pil = Image.fromarray(image_array_rgb)
-            
-            # Convert to bytes (JPEG format)
-            img_byte_arr = io.BytesIO()
-            modified_image_pil.save(img_byte_arr, format='JPEG', quality=85)
-            
-            return img_byte_arr.getvalue(), True
-            
         except cv2.error as e:
-            logger.error(f"OpenCV error in face detection: {str(e)}. Image shape: {image_array_rgb.shape if 'image_array_rgb' in locals() else 'N/A'}, dtype: {image_array_rgb.dtype if 'image_array_rgb' in locals() else 'N/A'}", exc_info=True)
+            logger.error(f"OpenCV error drawing faces: {str(e)}. Image shape: {image.shape}, dtype: {image.dtype}", exc_info=True)
             return image_bytes, False
-        except Exception as e:
-            logger.error(f"Generic error in face detection: {str(e)}. Image shape: {image_array_rgb.shape if 'image_array_rgb' in locals() else 'N/A'}, dtype: {image_array_rgb.dtype if 'image_array_rgb' in locals() else 'N/A'}", exc_info=True)
-            return image_bytes, False
\ No newline at end of file
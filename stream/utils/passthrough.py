@@ -0,0 +1,417 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import NamedTuple
+
+from .async_rtsp_client import AsyncRTSPClient
+from .fmp4 import MP4FragmentSplitter, codec_mime, default_sample_flags, fragment_starts_with_keyframe, is_init_segment
+from .frame_splitter import JPEGFrameSplitter
+
+logger = logging.getLogger('passthrough')
+
+
+def passthrough_config():
+    from django.conf import settings
+    return getattr(settings, 'RTSP_PASSTHROUGH', {})
+
+
+class Fragment(NamedTuple):
+    index: int             # Increases by one per fragment, starts again with every init segment
+    data: bytes            # moof+mdat
+    keyframe: bool         # Starts with an IDR frame, a decoder can start here
+    captured_at: float     # Wall clock time the fragment left FFmpeg
+
+
+class FragmentLog:
+    """
+        The init segment and the most recent media fragments of a passthrough stream.
+
+        Unlike JPEG frames, fragments depend on the ones before them back to the
+        last keyframe, so viewers read them in order (FragmentSlot) instead of
+        taking the latest. Every new FFmpeg connection sets a new init segment and
+        bumps `generation`, which tells viewers to start over. There is one log per
+        stream (fragment_log), so viewers carry on when the stream's client is
+        replaced. Used on the event loop only.
+    """
+
+    def __init__(self, max_fragments=120):
+        self.init_segment = None
+        self.mime = None
+        self.generation = 0
+        self.next_index = 1
+        self.last_keyframe = None
+        self._fragments = collections.deque(maxlen=max_fragments)
+        self._changed = asyncio.Event()
+
+    @property
+    def first_index(self):
+        return self._fragments[0].index if self._fragments else self.next_index
+
+    def set_init(self, init_segment):
+        self.init_segment = init_segment
+        self.mime = codec_mime(init_segment)
+        self.generation += 1
+        self.next_index = 1
+        self.last_keyframe = None
+        self._fragments.clear()
+        self._wakeup()
+
+    def append(self, data, keyframe, captured_at):
+        fragment = Fragment(self.next_index, data, keyframe, captured_at)
+        self.next_index += 1
+        self._fragments.append(fragment)
+        if keyframe:
+            self.last_keyframe = fragment
+        self._wakeup()
+
+    def get(self, index):
+        offset = index - self.first_index
+        return self._fragments[offset] if 0 <= offset < len(self._fragments) else None
+
+    def clear(self):
+        """Forget the segments when the stream stops, so they are not kept in memory"""
+        self.init_segment = self.mime = self.last_keyframe = None
+        self._fragments.clear()
+        self._wakeup()
+
+    def _wakeup(self):
+        # Same as FrameChannel: wake everyone waiting now, the next wait blocks again
+        self._changed.set()
+        self._changed.clear()
+
+    async def wait(self):
+        await self._changed.wait()
+
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'fragments': len(self._fragments),
+            'bytes': sum(len(fragment.data) for fragment in self._fragments),
+            'next_index': self.next_index,
+        }
+
+
+_fragment_logs = {}
+
+
+def fragment_log(stream_id):
+    """The FragmentLog of a stream, shared by all its clients over time"""
+    log = _fragment_logs.get(stream_id)
+    if log is None:
+        log = _fragment_logs[stream_id] = FragmentLog(passthrough_config().get('MAX_FRAGMENTS', 120))
+    return log
+
+
+def forget_fragment_log(stream_id):
+    """Drop a deleted stream's FragmentLog and the fragments it still holds"""
+    _fragment_logs.pop(stream_id, None)
+
+
+class FragmentSlot:
+    """
+        Per-viewer delivery of a passthrough stream: the init segment, then the
+        fragments in order from the newest keyframe.
+
+        Like LatestFrameSlot, once the viewer acks, at most `max_in_flight`
+        fragments are left unacked. A viewer that falls more than `max_behind`
+        fragments behind skips ahead to the newest keyframe fragment: everything
+        before a keyframe can be dropped without breaking the picture after it.
+        `on_init` is awaited before each init segment is sent (to announce the codec).
+    """
+
+    def __init__(self, send, log, on_init=None, max_in_flight=4, max_behind=4, metrics=None):
+        self._send = send
+        self._log = log
+        self._metrics = metrics
+        self._on_init = on_init
+        self._task = None
+        self._has_credit = asyncio.Event()
+        self._has_credit.set()
+        self._sent_capture_times = collections.deque()
+
+        self.max_in_flight = max_in_flight
+        self.max_behind = max_behind
+        self.acks_enabled = False
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.resyncs = 0
+        self.last_lag = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def offer(self, frame_bytes, captured_at=None, seq=None):
+        """Passthrough streams never send stream_frame messages, nothing to queue"""
+
+    def ack(self, count=1):
+        self.acks_enabled = True
+        for _ in range(min(count, len(self._sent_capture_times))):
+            self.last_lag = time.time() - self._sent_capture_times.popleft()
+        if len(self._sent_capture_times) < self.max_in_flight:
+            self._has_credit.set()
+
+    async def _run(self):
+        log = self._log
+        generation = 0
+        next_index = 0
+        need_keyframe = True
+        while True:
+            if log.generation != generation:
+                if log.init_segment is None:
+                    await log.wait()
+                    continue
+                generation = log.generation
+                if self._on_init:
+                    await self._on_init(log.mime)
+                await self._send(log.init_segment)
+                next_index, need_keyframe = 0, True
+            await self._has_credit.wait()
+
+            keyframe = log.last_keyframe
+            behind = log.next_index - next_index
+            if keyframe and keyframe.index > next_index and (
+                    need_keyframe or behind > self.max_behind or next_index < log.first_index):
+                if not need_keyframe:
+                    self.frames_dropped += keyframe.index - next_index
+                    self.resyncs += 1
+                    if self._metrics:
+                        self._metrics.frames_dropped_total += keyframe.index - next_index
+                next_index, need_keyframe = keyframe.index, False
+            elif keyframe and keyframe.index == next_index:
+                need_keyframe = False
+
+            fragment = None if need_keyframe else log.get(next_index)
+            if fragment is None:
+                if next_index < log.first_index:
+                    # Fell out of the log with no newer keyframe yet, wait for one
+                    need_keyframe = True
+                await log.wait()
+                continue
+
+            send_started = time.perf_counter()
+            await self._send(fragment.data)
+            next_index += 1
+            self.frames_delivered += 1
+            if self._metrics:
+                self._metrics.send_latency.observe(time.perf_counter() - send_started)
+                self._metrics.frames_sent_total += 1
+            if self.acks_enabled:
+                self._sent_capture_times.append(fragment.captured_at)
+                if len(self._sent_capture_times) >= self.max_in_flight:
+                    self._has_credit.clear()
+
+    def stats(self):
+        return {
+            'frames_delivered': self.frames_delivered,
+            'frames_dropped': self.frames_dropped,
+            'keyframe_resyncs': self.resyncs,
+            'in_flight': len(self._sent_capture_times),
+            'acks_enabled': self.acks_enabled,
+            'last_lag_ms': round(self.last_lag * 1000, 1),
+        }
+
+
+class KeyframeAnalysis:
+    """
+        Decimated analysis branch of a passthrough stream.
+
+        A second FFmpeg is fed the stream's init segment and fragments on stdin and
+        decodes keyframes only (-skip_frame nokey), at most `max_fps` of them, into
+        `width` px JPEGs for the stream's face detector. Decoding one frame per GOP
+        costs a fraction of the full decode the MJPEG mode needs. When FFmpeg cannot
+        keep up, fragments are skipped up to the next keyframe.
+    """
+
+    def __init__(self, client, max_fps=2.0, width=640, max_buffer=4 * 1024 * 1024):
+        self.client = client
+        self.max_fps = max_fps
+        self.width = width
+        self.max_buffer = max_buffer
+        self.process = None
+        self._reader = None
+        self._skipping = True
+        self.frames_analyzed = 0
+        self.fragments_skipped = 0
+
+    def _command(self):
+        select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{1 / self.max_fps:.3f})'," if self.max_fps else ""
+        return [
+            "ffmpeg",
+            "-skip_frame", "nokey",            # Only decode keyframes
+            "-f", "mp4", "-i", "pipe:0",
+            "-an",
+            "-vf", f"{select}scale={self.width}:-2",
+            "-vsync", "passthrough",           # One JPEG per selected keyframe, no duplicates
+            "-f", "mjpeg", "-q:v", "5",
+            "pipe:1",
+        ]
+
+    async def start(self, init_segment):
+        await self.stop()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *self._command(),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except Exception as e:
+            logger.error(f"Could not start the analysis branch of stream {self.client.stream_id}: {e}")
+            return
+        self.process.stdin.write(init_segment)
+        self._skipping = True
+        self._reader = asyncio.create_task(self._read(self.process))
+
+    def feed(self, fragment, keyframe):
+        process = self.process
+        if process is None or process.returncode is not None or process.stdin.is_closing():
+            return
+        if process.stdin.transport.get_write_buffer_size() > self.max_buffer:
+            self._skipping = True
+        if self._skipping and not keyframe:
+            self.fragments_skipped += 1
+            return
+        self._skipping = False
+        process.stdin.write(fragment)
+
+    async def _read(self, process):
+        splitter = JPEGFrameSplitter(buffer_size=4 * 1024 * 1024)
+        while True:
+            chunk = await process.stdout.read(splitter.read_size)
+            if not chunk:
+                return
+            splitter.feed(chunk)
+            for frame_view in splitter.frames():
+                self.frames_analyzed += 1
+                self.client._analyze(frame_view, self.frames_analyzed)
+
+    async def stop(self):
+        process, self.process = self.process, None
+        reader, self._reader = self._reader, None
+        if reader:
+            reader.cancel()
+        if process and process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    def stats(self):
+        return {
+            'frames_analyzed': self.frames_analyzed,
+            'fragments_skipped': self.fragments_skipped,
+            'running': self.process is not None and self.process.returncode is None,
+        }
+
+
+class PassthroughRTSPClient(AsyncRTSPClient):
+    """
+        AsyncRTSPClient for Stream.delivery='passthrough': FFmpeg remuxes the camera's
+        H.264 with -c copy into fragmented MP4 instead of decoding, scaling and
+        re-encoding it as MJPEG, and viewers play it with MediaSource.
+
+        The init segment is kept for late joiners, who then start at the newest
+        keyframe fragment. Face analysis, if the stream has an analyzer, runs on
+        the KeyframeAnalysis side branch; boxes go to viewers as detection messages
+        since nothing can be burned into passed-through video. There are no JPEG
+        frames, so no frame hub channel, MJPEG endpoint or DVR recording.
+    """
+
+    splitter_class = MP4FragmentSplitter
+    # There is one H.264 output, the camera's own
+    renditions_supported = False
+
+    def __init__(self, stream_id, url, group_name, **options):
+        super().__init__(stream_id, url, group_name, **options)
+        config = passthrough_config()
+        self.frame_channel = None
+        self.fragments = fragment_log(stream_id)
+        self.frag_duration_ms = config.get('FRAG_DURATION_MS', 500)
+        self.analysis = KeyframeAnalysis(
+            self, max_fps=config.get('ANALYSIS_FPS', 2.0), width=config.get('ANALYSIS_WIDTH', 640)
+        ) if self.face_detector else None
+        self._default_sample_flags = 0
+
+    def _start_ingest(self):
+        super()._start_ingest()
+        self._close_recorder()    # Nothing to record, the DVR stores JPEG frames
+
+    def _send_buffered_frame(self):
+        """New viewers get the init segment and the last keyframe from their FragmentSlot"""
+
+    def _ffmpeg_command(self, transport):
+        """FFmpeg command line that remuxes the RTSP input into fragmented MP4 on stdout, no transcoding"""
+        return [
+            "ffmpeg",
+            "-nostats",
+            "-rtsp_transport", transport,
+            "-fflags", "nobuffer",
+            "-i", self.url,
+            "-an",
+            "-c:v", "copy",                  # Pass the camera's H.264 through untouched
+            "-f", "mp4",
+            # Init segment up front, one fragment per keyframe or every FRAG_DURATION_MS
+            "-movflags", "empty_moov+default_base_moof+frag_keyframe",
+            "-frag_duration", str(int(self.frag_duration_ms * 1000)),
+            "-flush_packets", "1",
+            "-"
+        ]
+
+    def _process_frame(self, segment_view):
+        """Segments are passed through as they are, analysis runs on the side branch"""
+        segment = bytes(segment_view)
+        if not is_init_segment(segment):
+            self.frame_seq += 1
+        return segment, None
+
+    async def _publish_frame_async(self, segment, annotated_frame_bytes, captured_at):
+        if is_init_segment(segment):
+            logger.info(f"Stream {self.stream_id} passes through {codec_mime(segment)}")
+            self._default_sample_flags = default_sample_flags(segment)
+            self.fragments.set_init(segment)
+            if self.analysis:
+                await self.analysis.start(segment)
+            return
+        self.last_frame_time = captured_at
+        self.metrics.frame(captured_at)
+        keyframe = fragment_starts_with_keyframe(segment, self._default_sample_flags)
+        self.fragments.append(segment, keyframe, captured_at)
+        # A warm stream without viewers only keeps its segments, analysis waits for a viewer
+        if self.analysis and self.client_count:
+            self.analysis.feed(segment, keyframe)
+
+    def _analyze(self, frame_view, seq):
+        """A decoded keyframe from the analysis branch; also the stream's snapshot"""
+        self.frame_buffer = bytes(frame_view)
+        if self.face_detector and self.client_count:
+            try:
+                self.face_detector.submit(frame_view, seq)
+            except Exception as e:
+                logger.error(f"Unhandled exception in face detection for {self.stream_id}: {e}", exc_info=True)
+
+    async def _run(self):
+        try:
+            await super()._run()
+        finally:
+            if self.analysis:
+                await self.analysis.stop()
+            self.fragments.clear()
+
+    def stats(self):
+        return {
+            **super().stats(),
+            'passthrough': {
+                'mime': self.fragments.mime,
+                **self.fragments.stats(),
+                'analysis': self.analysis.stats() if self.analysis else None,
+            },
+        }
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .async_rtsp_client import AsyncRTSPClient
+from .frame_ring import SharedFrameRing
+from .rtsp_client import RTSPClient
+
+logger = logging.getLogger('rtsp_client')
+
+# Workers are spawned, not forked: Daphne's process has an event loop and threads
+_mp = multiprocessing.get_context('spawn')
+
+
+def process_ingest_config():
+    return getattr(settings, 'RTSP_PROCESS_INGEST', {})
+
+
+class ProcessRTSPClient(AsyncRTSPClient):
+    """
+        RTSPClient whose ingest runs in a worker process of its own (RTSP_INGEST_MODE='process').
+
+        The worker runs FFmpeg, the frame splitter and face detection exactly like the
+        threaded RTSPClient, so none of it competes for the GIL with the Daphne event
+        loop. Finished frames are written to a SharedFrameRing; the worker only sends a
+        short notice over its pipe and this side copies the newest frame out of shared
+        memory and publishes it like AsyncRTSPClient does. Detection, status and error
+        messages come over the same pipe and are forwarded to the channel layer.
+
+        The stream task supervises the worker: when it dies with a non-zero exit code
+        (crash, OOM kill, segfault in a native library) it is restarted with a backoff,
+        an exit code of 0 means FFmpeg ended and stops the stream as in the other modes.
+    """
+
+    # The worker only has the frame ring for the main output
+    renditions_supported = False
+
+    def __init__(self, stream_id, url, group_name, **options):
+        # Analysis happens in the worker, not here
+        super().__init__(stream_id, url, group_name, **{**options, 'analyzer': 'none'})
+        self.worker_options = options
+        self.worker = None
+        self.worker_stats = {}
+        self.restarts = 0
+        self._worker_metrics = None    # The worker's last metrics snapshot, merged into self.metrics
+        self.ring = None
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._ring_version = 0
+
+    def start(self, burned_in=True):
+        super().start(burned_in=burned_in)
+        self._send_clients()
+
+    def add_client(self, burned_in=True):
+        super().add_client(burned_in=burned_in)
+        self._send_clients()
+
+    def remove_client(self, burned_in=True):
+        super().remove_client(burned_in=burned_in)
+        self._send_clients()
+
+    def stats(self):
+        return {
+            'clients': self.client_count,
+            'detection': self.worker_stats.get('detection'),
+            'startup': self.worker_stats.get('startup'),
+            'latency': self.trace_stats(),
+            'reconnect': self.worker_stats.get('reconnect'),
+            'worker': {
+                'pid': self.worker.pid if self.worker else None,
+                'restarts': self.restarts,
+            },
+        }
+
+    def shutdown(self):
+        # The worker stops its FFmpeg when told to, without the event loop's help
+        worker = self.worker
+        if worker and worker.is_alive():
+            self._send_command('stop')
+            worker.join(3.0)
+            if worker.is_alive():
+                worker.kill()
+        super().shutdown()
+
+    def splitter_buffered(self):
+        return self.worker_stats.get('splitter_buffered', 0)
+
+    def trace_stats(self):
+        # The ingest stages are traced in the worker, hop, send and client ones here
+        return {**(self.worker_stats.get('latency') or {}), **self.tracer.stats()}
+
+    def _send_command(self, *command):
+        """Send a command to the worker from any thread, ignoring a worker that is gone"""
+        with self._conn_lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.send(command)
+            except (OSError, ValueError):
+                pass
+
+    def _send_clients(self):
+        # The worker skips frame processing while nobody watches, like RTSPClient
+        self._send_command('clients', self.client_count, self.burned_in_clients)
+
+    async def _run(self):
+        config = process_ingest_config()
+        self.ring = SharedFrameRing.create(config.get('RING_SLOTS', 4), config.get('RING_SLOT_BYTES', 1024 * 1024))
+        restart_delay = config.get('RESTART_S', 1.0)
+        failures = 0
+        try:
+            while self.is_running:
+                started_at = time.monotonic()
+                exitcode = await self._run_worker()
+                if not self.is_running or exitcode == 0:
+                    return
+                # A worker that ran for a while before crashing starts over at the shortest delay
+                failures = 1 if time.monotonic() - started_at > config.get('RESTART_RESET_S', 30.0) else failures + 1
+                delay = min(restart_delay * 2 ** (failures - 1), config.get('RESTART_MAX_S', 30.0))
+                self.restarts += 1
+                logger.error(f"Ingest worker of stream {self.stream_id} died (exit code {exitcode}), restarting in {delay:.1f}s")
+                self.reconnecting = True
+                await self._send_status_async(f"Ingest worker crashed, restarting in {delay:.0f}s", state='reconnecting')
+                await asyncio.sleep(delay)
+        finally:
+            self.ring.close()
+            self.ring = None
+
+    async def _run_worker(self):
+        """Run one worker process until it exits, returns its exit code"""
+        loop = asyncio.get_running_loop()
+        conn, child_conn = _mp.Pipe()
+        # Commands are built here so FFmpeg options (and benchmark overrides) stay in one place
+        commands = {transport: self._ffmpeg_command(transport) for transport in ('tcp', 'udp')}
+        process = _mp.Process(
+            target=run_ingest_worker,
+            args=(self.stream_id, self.url, self.group_name, self.worker_options, commands,
+                  self.ring.name, child_conn, (self.client_count, self.burned_in_clients)),
+            name=f"rtsp_ingest_{self.stream_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.worker = process
+        self._worker_metrics = None
+        with self._conn_lock:
+            self._conn = conn
+        # Viewers may have come or gone while the worker was being spawned
+        self._send_clients()
+        logger.info(f"Started ingest worker for stream {self.stream_id} (PID: {process.pid})")
+
+        exited = loop.create_future()
+        loop.add_reader(conn.fileno(), self._on_worker_message)
+        loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+            # Pick up whatever the worker sent right before exiting
+            self._on_worker_message()
+            await asyncio.to_thread(process.join)
+            logger.info(f"Ingest worker of stream {self.stream_id} exited with code {process.exitcode}")
+            return process.exitcode
+        finally:
+            loop.remove_reader(process.sentinel)
+            loop.remove_reader(conn.fileno())
+            if process.is_alive():
+                self._send_command('stop')
+                await asyncio.to_thread(process.join, 3.0)
+                if process.is_alive():
+                    logger.warning(f"Ingest worker of stream {self.stream_id} didn't stop. Killing.")
+                    process.kill()
+                    await asyncio.to_thread(process.join)
+            with self._conn_lock:
+                self._conn = None
+            conn.close()
+            process.close()
+            self.worker = None
+
+    def _on_worker_message(self):
+        """Reader callback for the worker pipe, runs on the event loop"""
+        frame_ready = False
+        conn = self._conn
+        try:
+            while conn is not None and conn.poll():
+                message = conn.recv()
+                kind = message[0]
+                if kind == 'frame':
+                    frame_ready = True
+                elif kind == 'message':
+                    if message[1].get('state'):
+                        # The worker reconnects FFmpeg itself, /metrics reports it from here
+                        self.reconnecting = message[1]['state'] == 'reconnecting'
+                    self.loop.create_task(self.channel_layer.group_send(self.group_name, message[1]))
+                elif kind == 'stats':
+                    self.worker_stats = message[1]
+                    self.metrics.merge_worker(self.worker_stats['metrics'], self._worker_metrics)
+                    self._worker_metrics = self.worker_stats['metrics']
+        except (EOFError, OSError):
+            # The worker is gone; stop watching the pipe, the sentinel reports the exit
+            self.loop.remove_reader(conn.fileno())
+
+        if frame_ready and self.ring:
+            # Notices can pile up while the loop is busy, only the newest frame matters
+            frame = self.ring.read_latest(self._ring_version)
+            if frame:
+                self._ring_version = frame.version
+                self.frame_seq = frame.seq
+                if self.tracer.sampled(frame.seq):
+                    self.tracer.handoff(frame.seq)
+                self.loop.create_task(self._publish_frame_async(frame.data, frame.annotated, frame.captured_at or time.time()))
+
+
+class _WorkerRTSPClient(RTSPClient):
+    """The threaded RTSPClient inside an ingest worker, reporting to the ASGI process over `conn`"""
+
+    renditions_supported = False
+
+    def __init__(self, stream_id, url, group_name, conn, ring, commands, **options):
+        super().__init__(stream_id, url, group_name, **options)
+        self.frame_channel = None
+        self.conn = conn
+        self.ring = ring
+        self.commands = commands
+        # Detection results are sent from pool threads while the ingest thread sends frames
+        self._conn_lock = threading.Lock()
+
+    def _ffmpeg_command(self, transport):
+        return self.commands[transport]
+
+    def _send(self, message):
+        with self._conn_lock:
+            self.conn.send(message)
+
+    def _handle_frame(self, frame_view, read_span=None):
+        trace = self.tracer.begin(self.frame_seq + 1, *read_span) if read_span else None
+        captured_at = time.time()
+        self.last_frame_time = captured_at
+        frame_bytes, annotated_frame_bytes = self._process_frame(frame_view)
+        if trace:
+            trace.mark('process')
+        if self.ring.write(self.frame_seq, captured_at, frame_bytes, annotated_frame_bytes):
+            self._send(('frame',))
+        if trace:
+            trace.mark('publish')
+
+    def _group_send(self, message):
+        self._send(('message', message))
+
+
+def run_ingest_worker(stream_id, url, group_name, options, commands, ring_name, conn, clients):
+    """Entry point of an ingest worker process"""
+    import django
+    django.setup()
+    # multiprocessing terminates daemonic workers when the ASGI process exits, stop FFmpeg first
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    detection_config = getattr(settings, 'FACE_DETECTION', {})
+    if detection_config.get('EXECUTOR') == 'process':
+        # The worker already is a process of its own, and daemonic processes cannot start a pool
+        detection_config['EXECUTOR'] = 'thread'
+
+    ring = SharedFrameRing.attach(ring_name)
+    client = _WorkerRTSPClient(stream_id, url, group_name, conn, ring, commands, **options)
+    client.client_count, client.burned_in_clients = clients
+    client.is_running = True
+    thread = threading.Thread(target=client._stream_loop, name=f"rtsp_ingest_{stream_id}", daemon=True)
+    thread.start()
+
+    stats_interval = process_ingest_config().get('STATS_S', 2.0)
+    next_stats = 0
+    try:
+        while client.is_running:
+            if conn.poll(0.5):
+                command = conn.recv()
+                if command[0] == 'clients':
+                    client.client_count, client.burned_in_clients = command[1], command[2]
+                elif command[0] == 'stop':
+                    break
+            now = time.monotonic()
+            if now >= next_stats:
+                next_stats = now + stats_interval
+                client._send(('stats', {
+                    **client.stats(),
+                    'metrics': client.metrics.worker_snapshot(),
+                    'splitter_buffered': client.splitter_buffered(),
+                }))
+    except (EOFError, OSError):
+        # The ASGI process is gone, don't leave FFmpeg running behind it
+        logger.warning(f"Ingest worker of stream {stream_id} lost its parent, stopping")
+    finally:
+        if client.is_running:
+            client._stop_stream()
+        thread.join(timeout=3.0)
+        ring.close()
@@ -0,0 +1,32 @@
+import random
+
+
+def reconnect_config():
+    from django.conf import settings
+    return getattr(settings, 'RTSP_RECONNECT', {})
+
+
+class ReconnectBackoff:
+    """
+        Delays between attempts to restart a stream's FFmpeg: `initial` doubling up to
+        `maximum` while attempts keep failing, each picked at random from the upper half
+        of that so streams that broke together do not retry together. A connection that
+        ran for `reset_after` seconds starts over at `initial`.
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, reset_after=30.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.reset_after = reset_after
+        self.failures = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = reconnect_config()
+        return cls(config.get('RETRY_S', 0.5), config.get('RETRY_MAX_S', 30.0), config.get('RETRY_RESET_S', 30.0))
+
+    def next_delay(self, ran_for=0.0):
+        """Seconds to wait before the next attempt, after one that lasted `ran_for` seconds"""
+        self.failures = 1 if ran_for >= self.reset_after else self.failures + 1
+        delay = min(self.initial * 2 ** (self.failures - 1), self.maximum)
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,97 @@
+import collections
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger('renditions')
+
+
+def renditions_config():
+    from django.conf import settings
+    return getattr(settings, 'RTSP_RENDITIONS', {})
+
+
+class Rendition(NamedTuple):
+    name: str
+    width: int       # Maximum width, never upscaled
+    fps: float
+    quality: int     # FFmpeg -q:v, lower is better
+
+
+def default_rendition():
+    """Name of FFmpeg's main output, the one analysis, the DVR and snapshots use"""
+    return renditions_config().get('DEFAULT', 'medium')
+
+
+def extra_renditions():
+    """The configured renditions besides the default one, by name"""
+    return {
+        name: Rendition(name, options['WIDTH'], options['FPS'], options.get('QUALITY', 10))
+        for name, options in renditions_config().get('EXTRA', {}).items()
+        if name != default_rendition()
+    }
+
+
+def ladder_output_args(main_filter, main_output, outputs):
+    """
+        FFmpeg output options for one decode split into the main output and one MJPEG
+        output per extra rendition. `main_filter` and `main_output` are the -vf chain
+        and output options of the main output; `outputs` maps Rendition -> the pipe fd
+        its JPEGs are written to.
+    """
+    labels = [f'[r{i}]' for i in range(len(outputs) + 1)]
+    graph = [f"[0:v]split={len(labels)}{''.join(labels)}", f"[r0]{main_filter}[main]"]
+    args = ['-map', '[main]', *main_output]
+    for i, (rendition, fd) in enumerate(outputs.items(), 1):
+        graph.append(f"[r{i}]scale='min({rendition.width},iw)':-2,fps={rendition.fps}[{rendition.name}]")
+        args += [
+            '-map', f'[{rendition.name}]',
+            '-f', 'mjpeg',
+            '-q:v', str(rendition.quality),
+            '-vsync', 'passthrough',
+            '-flush_packets', '1',
+            f'pipe:{fd}',
+        ]
+    return ['-filter_complex', ';'.join(graph), *args]
+
+
+class RenditionDemand:
+    """
+        Viewers per extra rendition of one stream, and which renditions FFmpeg should
+        encode: the watched ones, plus ones whose last viewer left less than `idle_s`
+        ago, so a viewer switching back and forth does not restart FFmpeg every time.
+        Updated from the event loop, read from the ingest thread.
+    """
+
+    def __init__(self, renditions, idle_s=30.0):
+        self.renditions = renditions
+        self.idle_s = idle_s
+        self.viewers = collections.Counter()
+        self._left_at = {}
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        with self._lock:
+            self.viewers[name] += 1
+            self._left_at.pop(name, None)
+
+    def remove(self, name):
+        with self._lock:
+            self.viewers[name] -= 1
+            if self.viewers[name] <= 0:
+                del self.viewers[name]
+                self._left_at[name] = time.monotonic()
+
+    def wanted(self, encoded):
+        """The extra renditions to encode, given the `encoded` ones"""
+        now = time.monotonic()
+        with self._lock:
+            return frozenset(
+                name for name in self.renditions
+                if self.viewers[name] or (name in encoded and now - self._left_at.get(name, now) < self.idle_s)
+            )
+
+    def stats(self):
+        with self._lock:
+            return dict(self.viewers)
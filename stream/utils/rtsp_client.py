@@ -1,19 +1,62 @@
+import asyncio
+import collections
+import concurrent.futures
 import threading
 import time
 import subprocess
 import os
+import select
 import signal
 import logging
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from .mtcnn_detector import MTCNNDetector
+from django.conf import settings
+from .detection_pool import AsyncFaceDetector
+from .analyzers import analyzer_spec
+from .motion_gate import MotionGate
+from .face_tracker import FaceTracker
+from .frame_splitter import JPEGFrameSplitter
+from .frame_hub import get_frame_hub
+from .dvr import build_recorder
+from .renditions import RenditionDemand, default_rendition, extra_renditions, ladder_output_args, renditions_config
+from .metrics import stream_metrics
+from .frame_trace import frame_tracer
+from .reconnect import ReconnectBackoff, reconnect_config
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('rtsp_client')
 
+# Longest wait for FFmpeg's output between checks for a stall or a stop
+READ_POLL_S = 1.0
+
+
+def frame_fanout():
+    """How frames reach viewers, RTSP_FRAME_FANOUT: 'hub' (same process) or 'channel_layer'"""
+    return getattr(settings, 'RTSP_FRAME_FANOUT', 'hub')
+
+
+def startup_config():
+    return getattr(settings, 'RTSP_STARTUP', {})
+
+
+def remember_transport(stream_id, transport):
+    """Store the transport that delivered frames on the Stream, so the next start tries it first"""
+    from ..models import Stream
+    try:
+        Stream.objects.filter(id=stream_id).update(last_transport=transport)
+    except Exception as e:
+        logger.warning(f"Could not remember transport for stream {stream_id}: {e}")
+
+
 class RTSPClient:
-    def __init__(self, stream_id, url, group_name):
+    # Splits FFmpeg's stdout into the units published to viewers
+    splitter_class = JPEGFrameSplitter
+    # Whether FFmpeg can encode the extra renditions of the quality ladder next to the main output
+    renditions_supported = True
+
+    def __init__(self, stream_id, url, group_name, motion_threshold=None, tracker=None, detection_interval=5,
+                 analyzer='mtcnn', analyzer_params=None, transport=None, idle_timeout=5.0):
         self.stream_id = stream_id
         self.url = url
         self.group_name = group_name
@@ -24,65 +67,245 @@ class RTSPClient:
         self.client_count = 0
         self.last_frame_time = 0
         self.fps = 15
+        self.width = 640
         self.frame_buffer = None
-        self.face_detector = MTCNNDetector()
-        
-    def start(self):
+        self.annotated_frame_buffer = None
+        self.frame_seq = 0
+        # Counters for the /metrics endpoint, shared by every client of this stream id,
+        # and the splitter FFmpeg's output currently goes through
+        self.metrics = stream_metrics(stream_id)
+        self.splitter = None
+        # Stage latencies of 1-in-N frames, see settings.LATENCY_TRACE
+        self.tracer = frame_tracer(stream_id)
+        # Viewers that want boxes burned into the JPEG; the rest get detections as a sidecar message
+        self.burned_in_clients = 0
+        # Frames go to same-process viewers through the frame hub; the channel layer carries
+        # status/error/detection messages (and frames too with RTSP_FRAME_FANOUT='channel_layer')
+        self.frame_channel = get_frame_hub().channel(stream_id) if frame_fanout() == 'hub' else None
+        self._last_stats_log = 0
+        # Transport to try first (the Stream's last_transport), and how the last start went
+        self.transport = transport or None
+        self.connected_transport = None
+        self.first_frame_ms = None
+        # Seconds to keep running after the last viewer left, None = always on (Stream.keep_warm),
+        # enforced by the StreamManager, which it tells when the ingest ends on its own
+        self.idle_timeout = idle_timeout
+        self.on_stopped = None
+        # What the StreamManager built this client from, changing it restarts the stream
+        self.stream_settings = None
+        # FFmpeg exiting or stalling mid-stream is restarted with a backoff (settings.RTSP_RECONNECT),
+        # viewers stay attached and keep the last frame meanwhile
+        self.reconnecting = False
+        self.reconnects = 0
+        self.stalls = 0
+        self.last_outage = None     # Reason, attempts and recovery time of the last outage
+        self._outage = None         # The same while reconnecting
+        self._recovered_s = None    # Set by _on_first_frame when it ended an outage
+        self._stderr_tail = collections.deque(maxlen=16)
+        # Recent frames for instant replay while the stream runs, None with the DVR off
+        self.recorder = None
+        # Extra renditions (settings.RTSP_RENDITIONS) come out of the same decode, but only
+        # while someone watches them; changing the set restarts FFmpeg without a gap
+        self.extra_renditions = extra_renditions() if self.renditions_supported else {}
+        self.rendition_demand = RenditionDemand(self.extra_renditions, renditions_config().get('IDLE_S', 30.0))
+        self.encoded_renditions = frozenset()
+        self._rendition_switch = None
+        self._rendition_retry_at = 0.0
+        self.face_detector = self._build_face_detector(
+            motion_threshold, tracker, detection_interval, analyzer, analyzer_params
+        )
+
+    def _build_face_detector(self, motion_threshold, tracker, detection_interval, analyzer, analyzer_params):
+        """Set up analysis for this stream, or return None for streams that are only viewed"""
+        if not analyzer or analyzer == 'none':
+            return None
+        # Detection runs in the shared worker pool, the capture loop only draws the latest result.
+        # The motion gate skips it on static scenes (motion_threshold None = global default, 0 = off).
+        detection_config = getattr(settings, 'FACE_DETECTION', {})
+        if motion_threshold is None:
+            motion_threshold = detection_config.get('MOTION_THRESHOLD', 0.01)
+        motion_gate = MotionGate(
+            threshold=motion_threshold,
+            refresh_interval=detection_config.get('MOTION_REFRESH_S', 5.0),
+        )
+        # With a tracker the detector only runs every `detection_interval` frames (or when tracking degrades)
+        face_tracker = FaceTracker(method=tracker, detect_interval=detection_interval) if tracker else None
+        return AsyncFaceDetector(
+            self.stream_id, on_result=self._send_detections, motion_gate=motion_gate, tracker=face_tracker,
+            analyzer=analyzer_spec(analyzer, analyzer_params),
+        )
+
+    def start(self, burned_in=True):
         self.client_count += 1
+        self.burned_in_clients += int(burned_in)
         logger.info(f"Client joined stream {self.stream_id} - Total clients: {self.client_count}")
         
         if self.is_running:
             # If already running, and we have a frame buffer, send it to the new client
-            if self.frame_buffer:
-                logger.info(f"Sending buffered frame to new client for stream {self.stream_id}")
-                self._send_frame(self.frame_buffer)
+            self._send_buffered_frame()
             return
         
+        self._start_ingest()
+
+    def start_warm(self):
+        """Start ingest with no viewer, for always-on streams"""
+        if not self.is_running:
+            self._start_ingest()
+
+    def _start_ingest(self):
         self.is_running = True
+        self.recorder = build_recorder(self.stream_id)
         self.thread = threading.Thread(target=self._stream_loop)
         self.thread.daemon = True
         self.thread.start()
         logger.info(f"Started stream {self.stream_id}")
     
-    def add_client(self):
+    def add_client(self, burned_in=True):
         self.client_count += 1
+        self.burned_in_clients += int(burned_in)
         logger.info(f"Client joined stream {self.stream_id} - Total clients: {self.client_count}")
         # If stream is running and we have a frame buffer, send it
-        if self.is_running and self.frame_buffer:
+        if self.is_running:
+            self._send_buffered_frame()
+
+    def _send_buffered_frame(self):
+        """Give a new viewer the last frame; hub viewers already start from the latest frame"""
+        if self.frame_buffer and not self.frame_channel:
             logger.info(f"Sending buffered frame to new client for stream {self.stream_id}")
-            self._send_frame(self.frame_buffer)
+            self._send_frame(self.frame_buffer, annotated_frame=self.annotated_frame_buffer)
 
-    def remove_client(self):
+    def remove_client(self, burned_in=True):
         if self.client_count > 0:
             self.client_count -= 1
+        if burned_in and self.burned_in_clients > 0:
+            self.burned_in_clients -= 1
         logger.info(f"Client left stream {self.stream_id} - Remaining clients: {self.client_count}")
-        
-        # Consider stopping the stream if no clients are left after a short delay
-        # This part of your logic seemed a bit complex with _shutdown, simplifying:
-        if self.client_count == 0 and self.is_running:
-            logger.info(f"No clients for stream {self.stream_id}, scheduling stop.")
-            # A simple delay before stopping to handle quick reconnects
-            threading.Timer(5.0, self._check_and_stop).start() 
-
-    def _check_and_stop(self):
-        if self.client_count == 0 and self.is_running:
-            logger.info(f"Stopping stream {self.stream_id} due to no clients.")
-            self._stop_stream()
-            
-    def _stream_loop(self):
-        logger.info(f"Starting optimized stream loop for {self.stream_id}")
-        
-        transport_types = ['tcp', 'udp']
-        success = False
-        
+
+    async def stop(self):
+        """Stop the stream and wait until the ingest thread and its FFmpeg are gone"""
+        await asyncio.to_thread(self._stop_stream)
+        thread = self.thread
+        if thread and thread is not threading.current_thread():
+            await asyncio.to_thread(thread.join, 5.0)
+            if thread.is_alive():
+                logger.warning(f"Stream loop for {self.stream_id} did not end within 5s")
+
+    def shutdown(self):
+        """Stop the stream without the event loop, for process exit"""
+        self._stop_stream()
+        if self.thread:
+            # A probe still running kills its FFmpeg attempts on the way out
+            self.thread.join(2.0)
+
+    def _ingest_ended(self):
+        """Tell the StreamManager the ingest is over"""
+        if self.on_stopped:
+            self.on_stopped(self)
+
+    def stats(self):
+        """Stream level stats reported to viewers"""
+        return {
+            'clients': self.client_count,
+            'detection': self.face_detector.stats() if self.face_detector else None,
+            'startup': {'transport': self.connected_transport, 'first_frame_ms': self.first_frame_ms},
+            'idle_timeout': self.idle_timeout,
+            'dvr': self.recorder.stats() if self.recorder else None,
+            'latency': self.trace_stats(),
+            'reconnect': self.reconnect_stats(),
+            'renditions': {
+                'encoded': [default_rendition(), *sorted(self.encoded_renditions)],
+                'viewers': self.rendition_demand.stats(),
+            },
+        }
+
+    def trace_stats(self):
+        """Stage latency percentiles of the sampled frames, see frame_trace.py"""
+        return self.tracer.stats()
+
+    def reconnect_stats(self):
+        return {
+            'reconnecting': self.reconnecting,
+            'reconnects': self.reconnects,
+            'stalls': self.stalls,
+            'last_outage': self.last_outage or self._outage,
+        }
+
+    def splitter_buffered(self):
+        """Bytes of FFmpeg output waiting in the splitter for the rest of their frame"""
+        splitter = self.splitter
+        return splitter.buffered if splitter else 0
+
+    def _transport_order(self):
+        """TCP then UDP, or the remembered transport first"""
+        transports = ['tcp', 'udp']
+        if self.transport in transports:
+            transports.remove(self.transport)
+            transports.insert(0, self.transport)
+        return transports
+
+    def _probe_batches(self):
+        """Groups of transports started together: all at once with PARALLEL_PROBE, else one by one"""
+        transports = self._transport_order()
+        if startup_config().get('PARALLEL_PROBE'):
+            return [transports]
+        return [[transport] for transport in transports]
+
+    def _on_first_frame(self, transport, started_at):
+        """Record time-to-first-frame and the end of an outage; returns True if the transport differs from the remembered one"""
+        self.connected_transport = transport
+        self.first_frame_ms = round(1000 * (time.monotonic() - started_at), 1)
+        # The stall watchdog counts from here, the first frames may not be published yet
+        self.last_frame_time = time.time()
+        self.metrics.ffmpeg_started(self.first_frame_ms / 1000)
+        logger.info(f"Connected to {self.stream_id} via {transport.upper()}, first frame after {self.first_frame_ms} ms")
+        self._recovered_s = None
+        outage, self._outage = self._outage, None
+        if outage:
+            self._recovered_s = time.monotonic() - outage.pop('since')
+            self.reconnecting = False
+            self.reconnects += 1
+            self.metrics.reconnects_total += 1
+            self.metrics.recovery.observe(self._recovered_s)
+            self.last_outage = {**outage, 'recovery_s': round(self._recovered_s, 2)}
+            logger.info(f"Stream {self.stream_id} recovered after {self._recovered_s:.1f}s and {outage['attempts']} attempts")
+        changed = transport != self.transport
+        self.transport = transport
+        return changed
+
+    def _connected_message(self, transport):
+        """Status for viewers once FFmpeg delivers"""
+        if self._recovered_s is not None:
+            return f"Reconnected via {transport.upper()} after {self._recovered_s:.1f}s"
+        return f"Connected via {transport.upper()}"
+
+    def _outage_began(self, reason):
+        """FFmpeg's output stopped mid-stream ('exited', 'stalled', 'pipe broken'), reconnecting starts"""
+        if reason == 'stalled':
+            self.stalls += 1
+            self.metrics.stalls_total += 1
+        self.reconnecting = True
+        self._outage = {'reason': reason, 'since': time.monotonic(), 'attempts': 0}
+
+    def _next_attempt(self, backoff, ran_for):
+        """Count a reconnect attempt, returns the delay before it and the status for viewers"""
+        self._outage['attempts'] += 1
+        reason, attempts = self._outage['reason'], self._outage['attempts']
+        delay = backoff.next_delay(ran_for)
+        logger.warning(f"Stream {self.stream_id} {reason}, reconnecting in {delay:.1f}s (attempt {attempts})")
+        return delay, f"Stream {reason}, reconnecting in {delay:.1f}s (attempt {attempts})"
+
+    def _ffmpeg_command(self, transport, outputs=None):
+        """
+            Build the FFmpeg command line that turns the RTSP input into MJPEG on stdout,
+            plus one MJPEG output per extra rendition in `outputs` (Rendition -> pipe fd)
+        """
         cpu_count = os.cpu_count() or 4
         thread_count = max(1, min(cpu_count // 2, 4))
 
-        logger.info(f"RTSP URL: {self.url}")
-        
-        base_command = [
+        command = [
             "ffmpeg",                        # Call FFmpeg executable
-            "-rtsp_transport", "",           # Specify RTSP transport protocol (e.g., tcp, udp) — empty here, likely to be filled dynamically
+            "-nostats",                      # No progress lines on stderr, only what went wrong
+            "-rtsp_transport", transport,    # Specify RTSP transport protocol (tcp or udp)
             "-fflags", "nobuffer",           # Disable buffering to reduce latency
             "-flags", "low_delay",           # Enable low delay mode for real-time streaming
             "-hwaccel", "auto",              # Use hardware acceleration if available
@@ -91,139 +314,405 @@ class RTSPClient:
             "-an",                           # Disable audio processing (no audio)
             "-f", "mjpeg",                   # Set output format to MJPEG (Motion JPEG)
             "-q:v", "10",                     # Set video quality (lower is better, 1 is highest quality)
-            "-vf", f"scale=640:-1,fps={self.fps}",  # Apply video filters: scale to 640px width (maintain aspect ratio), set target FPS
+            "-vf", f"scale={self.width}:-1,fps={self.fps}",  # Apply video filters: scale to 640px width (maintain aspect ratio), set target FPS
             "-vsync", "passthrough",         # Pass through frames without modifying timing (avoid frame duplication/dropping)
             "-flush_packets", "1",           # Flush packets immediately to reduce latency
             "-"                              # Output to stdout (for piping or in-memory handling)
         ]
+        if outputs:
+            # One decode split into the main output on stdout and the renditions on their pipes
+            return command[:command.index("-an") + 1] + ladder_output_args(
+                f"scale={self.width}:-1,fps={self.fps}",
+                ["-f", "mjpeg", "-q:v", "10", "-vsync", "passthrough", "-flush_packets", "1", "-"],
+                outputs,
+            )
+        return command
 
-        for transport in transport_types:
-            if not self.is_running:
-                break
-                
-            command = base_command.copy()
-            command[command.index("-rtsp_transport") + 1] = transport
-            
-            logger.info(f"Attempting to connect to {self.stream_id} via {transport.upper()}...")
-            self._send_status(f"Connecting via {transport.upper()}...")
-            
-            try:
-                self.process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE, # Capture stderr
-                    bufsize=10**8, # Increased buffer for stdout, default might be too small
-                    preexec_fn=os.setsid
-                )
-                
-                # Check if ffmpeg started successfully after a short delay
-                time.sleep(2) # Give FFmpeg some time to connect or fail
-                if self.process.poll() is None: # If poll() is None, process is running
-                    logger.info(f"Successfully connected to {self.stream_id} via {transport.upper()}")
-                    success = True
-                    break
-                else:
-                    stderr_output = self.process.stderr.read().decode(errors='ignore')
-                    logger.error(f"FFmpeg failed to start for {self.stream_id} via {transport.upper()}. Exit code: {self.process.returncode}. Stderr: {stderr_output}")
-                    self._send_error(f"FFmpeg failed (transport: {transport.upper()}): {stderr_output[:200]}") # Send part of error
-
-            except Exception as e:
-                logger.error(f"Connection failed for {self.stream_id} via {transport.upper()}: {str(e)}")
-                self._send_error(f"Connection failed (transport: {transport.upper()}): {str(e)}")
-                continue
+    def _stream_loop(self):
+        logger.info(f"Starting optimized stream loop for {self.stream_id}")
+        logger.info(f"RTSP URL: {self.url}")
 
-        if not success:
-            logger.error(f"FFmpeg unable to connect to {self.url} using {transport_types}")
-            self._send_error(f"FFmpeg unable to connect to {self.url}")
+        started_at = time.monotonic()
+        connected = self._connect()
+        if not connected:
+            if self.is_running:
+                logger.error(f"FFmpeg unable to connect to {self.url} using {self._transport_order()}")
+                self._send_error(f"FFmpeg unable to connect to {self.url}")
             self._stop_stream() # Ensure is_running is set to False
+            self._ingest_ended()
             return
 
-        jpeg_start = b'\xff\xd8'
-        jpeg_end = b'\xff\xd9'
-        buffer = bytearray()
-        max_buffer_size = 100 * 1024 * 1024  # 10MB max buffer, ensure it's larger than largest possible frame
+        backoff = ReconnectBackoff.from_settings()
+        while True:
+            reason = self._ingest(connected, started_at)
+            if not reason or not self.is_running or not reconnect_config().get('ENABLED', True):
+                break
+            # Viewers stay subscribed and keep the last frame while FFmpeg is restarted
+            ran_for = time.monotonic() - started_at
+            self._outage_began(reason)
+            connected = None
+            while self.is_running and not connected:
+                delay, message = self._next_attempt(backoff, ran_for)
+                ran_for = 0.0
+                self._send_status(message, state='reconnecting')
+                deadline = time.monotonic() + delay
+                while self.is_running and time.monotonic() < deadline:
+                    time.sleep(min(0.1, delay))
+                started_at = time.monotonic()
+                connected = self._connect()
+            if not connected:
+                break
+
+        logger.info(f"Stream loop for {self.stream_id} ended.")
+        self._stop_stream() # Clean up FFmpeg if loop exits
+        self._ingest_ended()
+
+    def _connect(self):
+        """Probe the transports batch by batch, returns what _probe returned for the first that delivers, or None"""
+        for transports in self._probe_batches():
+            if not self.is_running:
+                return None
+            connected = self._probe(transports)
+            if connected:
+                return connected
+        return None
 
+    def _ingest(self, connected, started_at):
+        """
+            Publish frames from the FFmpeg that _probe connected until it ends. Returns why it
+            ended mid-stream ('exited', 'stalled', 'pipe broken'), or None once the stream stopped.
+        """
+        transport, self.process, splitter, first_frames = connected
+        self.splitter = splitter
+        self._stderr_tail = self._drain_stderr(self.process)
+        if self._on_first_frame(transport, started_at):
+            remember_transport(self.stream_id, transport)
+        self._send_status(self._connected_message(transport), state='live')
+        for frame_bytes in first_frames:
+            self._handle_frame(memoryview(frame_bytes))
+
+        stall_s = reconnect_config().get('STALL_S', 10.0)
         # frame_interval = 1.0 / self.fps
+        partial_since = None    # When the first bytes of the frame being assembled were read
+        reason = None
 
         while self.is_running:
-            if self.client_count == 0:
-                # No clients, FFmpeg might still be running, but we don't process/send.
-                # This also means face detection doesn't run, saving CPU.
-                time.sleep(0.1) # Sleep a bit to avoid busy-waiting
-                continue # Continue checking is_running and client_count
-
             try:
-                chunk = self.process.stdout.read(8096) # Read smaller chunks more frequently
-                if not chunk:
-                    if self.process.poll() is not None: # FFmpeg process terminated
-                        stderr_output = self.process.stderr.read().decode(errors='ignore')
+                switched = self._check_renditions(transport)
+                if switched:
+                    splitter, first_frames = switched
+                    self.splitter, partial_since = splitter, None
+                    for frame_bytes in first_frames:
+                        self._handle_frame(memoryview(frame_bytes))
+
+                # _stop_stream clears self.process from another thread, keep using the one read here
+                process = self.process
+                if process is None:
+                    break
+                readable, _, _ = select.select([process.stdout], [], [], READ_POLL_S)
+                if stall_s and time.time() - self.last_frame_time > stall_s:
+                    logger.error(f"No frame from FFmpeg for {self.stream_id} in {stall_s:.0f}s, restarting it")
+                    reason = 'stalled'
+                    break
+                if not readable:
+                    continue
+                # stdout is unbuffered, so this is a single read() of whatever the pipe holds
+                read = splitter.read_from(process.stdout)
+                read_at = time.perf_counter()
+                if not read:
+                    if process.poll() is not None: # FFmpeg process terminated
+                        if not self.is_running:
+                            break
+                        stderr_output = b''.join(self._stderr_tail).decode(errors='ignore')
                         logger.error(f"FFmpeg process for {self.stream_id} terminated unexpectedly. Stderr: {stderr_output}")
                         self._send_error("FFmpeg process terminated.")
+                        reason = 'exited'
                         break
-                    time.sleep(0.01) # No data, but process alive, wait briefly
+                    time.sleep(0.01) # EOF, but the process has not exited yet
                     continue
-                
-                buffer.extend(chunk)
-                
-                if len(buffer) > max_buffer_size:
-                    # If buffer is too large, try to find the last JPEG start marker
-                    # to salvage part of the stream, rather than just truncating the head.
-                    last_jpeg_start_pos = buffer.rfind(jpeg_start)
-                    if last_jpeg_start_pos != -1:
-                        buffer = buffer[last_jpeg_start_pos:]
-                    else: # Should not happen if JPEGs are coming
-                        buffer = bytearray() # Clear buffer if no start marker found
-                    logger.warning(f"Buffer overflow for {self.stream_id}, trimmed buffer.")
-
-                while True:
-                    start_pos = buffer.find(jpeg_start)
-                    if start_pos == -1:
-                        break 
-                    
-                    end_pos = buffer.find(jpeg_end, start_pos + len(jpeg_start)) # Search after start
-                    if end_pos == -1:
-                        # Found start, but not end yet, need more data
-                        if len(buffer) > max_buffer_size * 0.8 and start_pos > max_buffer_size * 0.2:
-                             # If a partial frame is consuming too much buffer and not at the beginning,
-                             # discard the beginning part to make space for its end.
-                            buffer = buffer[start_pos:]
-                        break 
-                        
-                    raw_frame_bytes = bytes(buffer[start_pos : end_pos + len(jpeg_end)])
-                    
-                    # Basic validation of extracted frame bytes
-                    if not raw_frame_bytes or len(raw_frame_bytes) < 200: # Arbitrary small size for a JPEG
-                        logger.warning(f"Skipping very small/empty frame candidate: {len(raw_frame_bytes)} bytes for {self.stream_id}")
-                        del buffer[:end_pos + len(jpeg_end)]
-                        continue
+                self.metrics.bytes_total += read
 
-                    del buffer[:end_pos + len(jpeg_end)] # Consume frame from buffer
-                    # current_time = time.time()
-                    processed_frame_bytes = raw_frame_bytes
-                    if self.face_detector:
-                        try:
-                            modified_frame_bytes, success = self.face_detector.detect_faces(raw_frame_bytes)
-                            if success:
-                                processed_frame_bytes = modified_frame_bytes
-                        except Exception as e:
-                            logger.error(f"Unhandled exception in face detection for {self.stream_id}: {e}", exc_info=True)
-                    
-                    self.frame_buffer = processed_frame_bytes 
-                    self._send_frame(processed_frame_bytes)
-                    # self.last_frame_time = current_time
-                        
-                    # else: Skip frame to maintain FPS
+                for frame_view in splitter.frames():
+                    self._handle_frame(frame_view, (partial_since or read_at, read_at))
+                    partial_since = None
+                # A partial frame left over began in this read, unless it was already pending
+                partial_since = (partial_since or read_at) if splitter.buffered else None
             
             except Exception as e:
                 logger.error(f"Error in stream loop for {self.stream_id}: {str(e)}", exc_info=True)
                 # If stdout.read() fails, it might be an OSError if the pipe is broken
                 if isinstance(e, BrokenPipeError) or isinstance(e, OSError):
                     logger.error(f"Pipe broken for {self.stream_id}. FFmpeg might have crashed.")
+                    reason = 'pipe broken'
                     break
                 time.sleep(0.1) # Avoid tight loop on other errors
 
-        logger.info(f"Stream loop for {self.stream_id} ended.")
-        self._stop_stream() # Clean up FFmpeg if loop exits
+        if reason and self.is_running:
+            # Make way for the next FFmpeg; the frame buffer and hub channel stay for viewers
+            process, self.process = self.process, None
+            self.splitter = None
+            if process:
+                self._kill_probe(process)
+            self._abandon_renditions()
+        return reason
+
+    def _drain_stderr(self, process):
+        """Keep FFmpeg's stderr flowing from a thread so it never blocks, returns a deque of its last output"""
+        tail = collections.deque(maxlen=16)
+
+        def drain():
+            try:
+                while chunk := process.stderr.read(4096):
+                    tail.append(chunk)
+            except (OSError, ValueError):
+                pass
+
+        threading.Thread(target=drain, name=f"rtsp_stderr_{self.stream_id}", daemon=True).start()
+        return tail
+
+    def _probe(self, transports):
+        """
+            Start FFmpeg for each transport and wait for the first complete JPEG.
+            Returns (transport, process, splitter, first_frames) for the first one that
+            delivers within FIRST_FRAME_TIMEOUT_S and stops the others, or None.
+        """
+        timeout = startup_config().get('FIRST_FRAME_TIMEOUT_S', 10.0)
+        attempts = {}  # stdout -> (transport, process, splitter)
+        for transport in transports:
+            logger.info(f"Attempting to connect to {self.stream_id} via {transport.upper()}...")
+            self._send_status(f"Connecting via {transport.upper()}...")
+            try:
+                process = subprocess.Popen(
+                    self._ffmpeg_command(transport),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE, # Capture stderr
+                    bufsize=0, # Raw pipe: the frame splitter reads into its own buffer
+                    preexec_fn=os.setsid
+                )
+            except Exception as e:
+                logger.error(f"Connection failed for {self.stream_id} via {transport.upper()}: {str(e)}")
+                self._send_error(f"Connection failed (transport: {transport.upper()}): {str(e)}")
+                continue
+            attempts[process.stdout] = (transport, process, self.splitter_class())
+
+        deadline = time.monotonic() + timeout
+        try:
+            while attempts and self.is_running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Short waits so a stop during the probe is noticed
+                readable, _, _ = select.select(list(attempts), [], [], min(remaining, 0.5))
+                for stdout in readable:
+                    transport, process, splitter = attempts[stdout]
+                    if not splitter.read_from(stdout):
+                        del attempts[stdout]
+                        process.wait()
+                        stderr_output = process.stderr.read().decode(errors='ignore')
+                        logger.error(f"FFmpeg failed to start for {self.stream_id} via {transport.upper()}. Exit code: {process.returncode}. Stderr: {stderr_output}")
+                        self._send_error(f"FFmpeg failed (transport: {transport.upper()}): {stderr_output[:200]}") # Send part of error
+                        continue
+                    # The views die with the next read, keep copies until the loop takes over
+                    first_frames = [bytes(frame_view) for frame_view in splitter.frames()]
+                    if first_frames:
+                        del attempts[stdout]
+                        return transport, process, splitter, first_frames
+
+            for transport, _, _ in attempts.values():
+                logger.error(f"No frame from {self.stream_id} via {transport.upper()} within {timeout}s")
+                self._send_error(f"No video (transport: {transport.upper()}) within {timeout:.0f}s")
+            return None
+        finally:
+            # Losers of a parallel probe, timed out attempts, or everything if the stream stopped
+            for _, process, _ in attempts.values():
+                self._kill_probe(process)
+
+    def _check_renditions(self, transport):
+        """
+            Keep FFmpeg's extra outputs in line with what viewers watch: start FFmpeg with
+            the wanted renditions next to the running one and swap once it delivers, so
+            viewers see no gap. Returns (splitter, first_frames) after a swap, else None.
+        """
+        switch = self._rendition_switch
+        if switch is None:
+            wanted = self.rendition_demand.wanted(self.encoded_renditions)
+            if wanted != self.encoded_renditions and time.monotonic() >= self._rendition_retry_at:
+                self._rendition_switch = concurrent.futures.Future()
+                threading.Thread(
+                    target=self._start_renditions, args=(transport, wanted, self._rendition_switch), daemon=True
+                ).start()
+            return None
+        if not switch.done():
+            return None
+
+        self._rendition_switch = None
+        started = switch.result()
+        if started is None:
+            self._rendition_retry_at = time.monotonic() + renditions_config().get('RETRY_S', 10.0)
+            return None
+        process, splitter, renditions, first_frames = started
+        if not self.is_running:
+            self._kill_probe(process)
+            return None
+        previous, self.process = self.process, process
+        self._stderr_tail = self._drain_stderr(process)
+        self._renditions_swapped(renditions)
+        self._kill_probe(previous)
+        return splitter, first_frames
+
+    def _start_renditions(self, transport, renditions, switch):
+        """Thread body: start FFmpeg with the extra `renditions` and resolve `switch` once it delivers a frame"""
+        timeout = startup_config().get('FIRST_FRAME_TIMEOUT_S', 10.0)
+        logger.info(f"Starting FFmpeg with renditions {sorted(renditions)} for stream {self.stream_id}")
+        started_at = time.monotonic()
+        process = None
+        try:
+            process = self._spawn(transport, renditions)
+            splitter = self.splitter_class()
+            deadline = time.monotonic() + timeout
+            while self.is_running and time.monotonic() < deadline:
+                readable, _, _ = select.select([process.stdout], [], [], 0.5)
+                if not readable:
+                    continue
+                if not splitter.read_from(process.stdout):
+                    break
+                first_frames = [bytes(frame_view) for frame_view in splitter.frames()]
+                if first_frames:
+                    self.metrics.ffmpeg_started(time.monotonic() - started_at)
+                    switch.set_result((process, splitter, renditions, first_frames))
+                    return
+            logger.error(f"FFmpeg with renditions {sorted(renditions)} delivered no frame for stream {self.stream_id}")
+        except Exception as e:
+            logger.error(f"Could not start renditions {sorted(renditions)} for stream {self.stream_id}: {e}")
+        if process:
+            self._kill_probe(process)
+        switch.set_result(None)
+
+    def _spawn(self, transport, renditions):
+        """Start FFmpeg with one extra output per rendition name, each read by a thread of its own"""
+        pipes = {self.extra_renditions[name]: os.pipe() for name in sorted(renditions)}
+        try:
+            process = subprocess.Popen(
+                self._ffmpeg_command(transport, {rendition: write_fd for rendition, (_, write_fd) in pipes.items()}),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,
+                preexec_fn=os.setsid,
+                pass_fds=[write_fd for _, write_fd in pipes.values()],
+            )
+        except Exception:
+            for read_fd, _ in pipes.values():
+                os.close(read_fd)
+            raise
+        finally:
+            # FFmpeg holds the write ends now, so the readers see EOF when it exits
+            for _, write_fd in pipes.values():
+                os.close(write_fd)
+        for rendition, (read_fd, _) in pipes.items():
+            threading.Thread(
+                target=self._read_rendition, args=(process, rendition.name, os.fdopen(read_fd, 'rb', buffering=0)),
+                name=f"rtsp_rendition_{self.stream_id}_{rendition.name}", daemon=True,
+            ).start()
+        return process
+
+    def _read_rendition(self, process, name, pipe):
+        """Reader thread of one extra output, its frames are published while `process` is the stream's FFmpeg"""
+        splitter = JPEGFrameSplitter()
+        try:
+            while splitter.read_from(pipe):
+                for frame_view in splitter.frames():
+                    if process is self.process:
+                        self._publish_rendition(name, bytes(frame_view), time.time())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Reading rendition {name} of stream {self.stream_id} failed: {e}")
+        finally:
+            pipe.close()
+
+    def _publish_rendition(self, name, frame_bytes, captured_at):
+        """Hand a frame of an extra rendition to its viewers, through the frame hub or the channel layer"""
+        if self.frame_channel:
+            get_frame_hub().channel(self.stream_id, name).publish(frame_bytes, None, self.frame_seq, captured_at)
+            return
+        if not self.rendition_demand.viewers.get(name):
+            return
+        try:
+            self._group_send({
+                "type": "stream_frame",
+                "frame": frame_bytes,
+                "annotated_frame": None,
+                "seq": self.frame_seq,
+                "captured_at": captured_at,
+                "rendition": name,
+            })
+        except Exception as e:
+            logger.error(f"Error sending {name} frame for {self.stream_id}: {str(e)}")
+
+    def _renditions_swapped(self, renditions):
+        """Record the extra renditions of the FFmpeg process that took over, forgetting the dropped ones' frames"""
+        if self.frame_channel:
+            for name in self.encoded_renditions - renditions:
+                get_frame_hub().channel(self.stream_id, name).clear()
+        if renditions != self.encoded_renditions:
+            logger.info(f"Stream {self.stream_id} encodes renditions {[default_rendition(), *sorted(renditions)]}")
+        self.encoded_renditions = renditions
+
+    def _kill_probe(self, process):
+        try:
+            process.kill()
+            process.wait(timeout=1.0)
+        except Exception:
+            pass
+
+    def _handle_frame(self, frame_view, read_span=None):
+        """
+            Run analysis on a frame view from the splitter, then buffer and broadcast it.
+            `read_span` is when the frame's first and last bytes were read, for tracing.
+        """
+        trace = self.tracer.begin(self.frame_seq + 1, *read_span) if read_span else None
+        captured_at = time.time()
+        self.last_frame_time = captured_at
+        self.metrics.frame(captured_at)
+        frame_bytes, annotated_frame_bytes = self._process_frame(frame_view)
+        if trace:
+            trace.mark('process')
+            trace.handoff()
+        self.frame_buffer = frame_bytes
+        self.annotated_frame_buffer = annotated_frame_bytes
+        if self.recorder:
+            self.recorder.append(captured_at, self.frame_seq, frame_bytes)
+        if self.frame_channel:
+            self.frame_channel.publish(frame_bytes, annotated_frame_bytes, self.frame_seq, captured_at)
+        elif self.client_count:
+            self._send_frame(frame_bytes, captured_at=captured_at, annotated_frame=annotated_frame_bytes)
+        if trace:
+            trace.mark('publish')
+
+    def _process_frame(self, frame_view):
+        """
+            Submit a frame view for face detection and return (frame_bytes, annotated_frame_bytes).
+            The untouched FFmpeg JPEG is always returned; a copy with the latest boxes burned in
+            is only produced while burned-in viewers are connected and there is something to draw.
+        """
+        self.frame_seq += 1
+        annotated_frame_bytes = None
+        # A warm stream without viewers only keeps its latest frame, analysis waits for a viewer
+        if self.face_detector and self.client_count:
+            try:
+                self.face_detector.submit(frame_view, self.frame_seq)
+                if self.burned_in_clients:
+                    modified_frame_bytes, success = self.face_detector.annotate(frame_view)
+                    if success:
+                        annotated_frame_bytes = modified_frame_bytes
+            except Exception as e:
+                logger.error(f"Unhandled exception in face detection for {self.stream_id}: {e}", exc_info=True)
+
+            now = time.monotonic()
+            if now - self._last_stats_log > 10:
+                self._last_stats_log = now
+                logger.info(f"Detection stats for {self.stream_id}: {self.face_detector.stats()}")
+
+        # The view is reused by the splitter, the frame outlives it in the buffer/channel layer
+        return bytes(frame_view), annotated_frame_bytes
 
     def _stop_stream(self):
         self.is_running = False
@@ -232,7 +721,13 @@ class RTSPClient:
         pid = original_process.pid if original_process else None
 
         self.process = None # Clear immediately
+        self.splitter = None
         self.frame_buffer = None
+        self.annotated_frame_buffer = None
+        self._close_recorder()
+        if self.frame_channel:
+            self.frame_channel.clear()
+        self._abandon_renditions()
 
         if original_process and pid:
             logger.info(f"Attempting to stop FFmpeg process for stream {self.stream_id} (PID: {pid}).")
@@ -262,25 +757,59 @@ class RTSPClient:
         
         logger.info(f"Stream {self.stream_id} cleanup attempt complete. is_running: {self.is_running}")
 
-    def _send_frame(self, frame_bytes):
+    def _abandon_renditions(self):
+        """The FFmpeg with the extra renditions is gone, a replacement starts with the main output only"""
+        switch, self._rendition_switch = self._rendition_switch, None
+        if switch:
+            # FFmpeg still being started for other renditions stops on its own, or here if it already delivered
+            switch.add_done_callback(lambda switch: switch.result() and self._kill_probe(switch.result()[0]))
+        self._renditions_swapped(frozenset())
+
+    def _close_recorder(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.close()
+
+    def _group_send(self, message):
+        """Send a message to every consumer of this stream from the ingest thread"""
+        async_to_sync(self.channel_layer.group_send)(self.group_name, message)
+
+    def _send_frame(self, frame_bytes, captured_at=None, annotated_frame=None):
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._group_send(
                 {
                     "type": "stream_frame",
                     "frame": frame_bytes, # Send raw bytes
+                    "annotated_frame": annotated_frame, # Same frame with boxes burned in, if any
+                    "seq": self.frame_seq,
+                    "captured_at": captured_at, # Wall clock time the frame left FFmpeg, for lag stats
                 }
             )
         except Exception as e:
             logger.error(f"Error sending frame for {self.stream_id}: {str(e)}")
 
-    def _send_status(self, message):
+    def _send_detections(self, seq, faces):
+        """Publish a detection result as a small sidecar message (called from the detection pool)"""
+        try:
+            self._group_send(
+                {
+                    "type": "stream_detections",
+                    "seq": seq,
+                    "faces": faces,
+                    "stream_id": self.stream_id
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error sending detections for {self.stream_id}: {str(e)}")
+
+    def _send_status(self, message, state=None):
+        """Status text for viewers; `state` is 'reconnecting' during an outage and 'live' once frames flow"""
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._group_send(
                 {
                     "type": "stream_status",
                     "message": message,
+                    "state": state,
                     "stream_id": self.stream_id
                 }
             )
@@ -289,8 +818,7 @@ class RTSPClient:
 
     def _send_error(self, message):
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._group_send(
                 {
                     "type": "stream_error",
                     "message": message,
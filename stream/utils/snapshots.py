@@ -0,0 +1,273 @@
+import collections
+import hashlib
+import logging
+import subprocess
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger('snapshots')
+
+
+def snapshot_config():
+    from django.conf import settings
+    return getattr(settings, 'SNAPSHOTS', {})
+
+
+class Snapshot(NamedTuple):
+    data: bytes                  # JPEG, downscaled if a width was asked for
+    etag: str                    # Quoted hash of `data`, unchanged while the picture is
+    captured_at: float | None    # Wall clock time the source frame left FFmpeg
+    expires: float               # time.monotonic() after which it is taken again
+
+
+def make_snapshot(data, captured_at, ttl):
+    return Snapshot(data, f'"{hashlib.blake2b(data, digest_size=8).hexdigest()}"', captured_at, time.monotonic() + ttl)
+
+
+def scale_jpeg(data, width, quality=80):
+    """Downscale a JPEG to `width` pixels wide keeping the aspect ratio, never upscales"""
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None or image.shape[1] <= width:
+        return data
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else data
+
+
+def grab_command(url, transport, max_width):
+    """FFmpeg command line that writes a single JPEG of the RTSP input to stdout"""
+    return [
+        "ffmpeg",
+        "-rtsp_transport", transport,
+        "-i", url,
+        "-an",
+        "-frames:v", "1",                               # Stop after the first decoded frame
+        "-vf", f"scale='min({max_width},iw)':-2",        # Same size a running stream delivers at most
+        "-f", "mjpeg",
+        "-q:v", "5",
+        "-"
+    ]
+
+
+def grab_frame(stream, timeout, max_width):
+    """
+        One JPEG from a stream that is not running, trying its remembered transport
+        first, or None if FFmpeg does not deliver one within `timeout` seconds
+    """
+    from .rtsp_client import remember_transport
+
+    first = stream.last_transport or 'tcp'
+    deadline = time.monotonic() + timeout
+    for transport in (first, 'udp' if first == 'tcp' else 'tcp'):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            result = subprocess.run(grab_command(stream.url, transport, max_width), capture_output=True,
+                                    timeout=remaining)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Snapshot grab of stream {stream.id} via {transport.upper()} timed out")
+            continue
+        except OSError as e:
+            logger.error(f"Could not start FFmpeg for a snapshot of stream {stream.id}: {e}")
+            return None
+        start = result.stdout.find(b'\xff\xd8')
+        end = result.stdout.find(b'\xff\xd9', start + 2)
+        if start != -1 and end != -1:
+            if transport != stream.last_transport:
+                remember_transport(stream.id, transport)
+            return result.stdout[start:end + 2]
+        logger.warning(f"Snapshot grab of stream {stream.id} via {transport.upper()} returned no frame")
+    return None
+
+
+class SnapshotCache:
+    """
+        Snapshots by (stream_id, width) with a TTL, least recently used first.
+
+        Entries expire `ttl` seconds after they were taken; on top of that the
+        cache holds at most `max_bytes` of JPEG data and drops the least recently
+        requested entries to stay below it.
+    """
+
+    def __init__(self, max_bytes=32 << 20):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is not None and snapshot.expires <= time.monotonic():
+                self._remove(key)
+                snapshot = None
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return snapshot
+
+    def put(self, key, snapshot):
+        size = len(snapshot.data)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = snapshot
+            self.used += size
+            while self.used > self.max_bytes:
+                oldest, _ = next(iter(self._entries.items()))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def forget(self, stream_id):
+        """Drop every cached snapshot of a stream"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == stream_id]:
+                self._remove(key)
+
+    def _remove(self, key):
+        snapshot = self._entries.pop(key, None)
+        if snapshot is not None:
+            self.used -= len(snapshot.data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.used,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class _Grab:
+    """A cold grab in progress, the requesters that did not start it wait on `done`"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.source = None
+
+
+class Snapshots:
+    """
+        Latest picture of each stream for dashboards and grids.
+
+        A running stream's snapshot is its client's latest frame; a stream that is
+        not running gets one short FFmpeg grab, shared by every request that comes
+        in while it runs and then cached for COLD_TTL_S (failures too, so a dead
+        camera is not retried by every tile). Downscaled variants are cached per
+        width for TTL_S, so a grid polling hundreds of tiles re-encodes each
+        thumbnail at most once per TTL.
+    """
+
+    def __init__(self, config):
+        self.ttl = config.get('TTL_S', 1.0)
+        self.cold_ttl = config.get('COLD_TTL_S', 10.0)
+        self.grab_timeout = config.get('GRAB_TIMEOUT_S', 5.0)
+        self.max_width = config.get('MAX_WIDTH', 640)
+        self.quality = config.get('QUALITY', 80)
+        self.cache = SnapshotCache(int(config.get('CACHE_MB', 32) * (1 << 20)))
+        self.grabs_started = 0
+        self._grabs = {}
+        self._failed = {}    # stream_id -> time.monotonic() until which a failed grab is not retried
+        self._lock = threading.Lock()
+
+    def get(self, stream, client=None, width=None):
+        """Snapshot of `stream` at most `width` pixels wide, None if no frame can be had"""
+        width = min(width, self.max_width) if width else None
+        key = (str(stream.id), width)
+        snapshot = self.cache.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        source = self._running_source(client) or self._cold_source(stream)
+        if source is None:
+            return None
+        if width is None:
+            return source
+        data = scale_jpeg(source.data, width, self.quality)
+        snapshot = make_snapshot(data, source.captured_at, max(0.0, source.expires - time.monotonic()))
+        self.cache.put(key, snapshot)
+        return snapshot
+
+    def _running_source(self, client):
+        if client is None or not client.is_running:
+            return None
+        channel = getattr(client, 'frame_channel', None)
+        frame = channel.latest if channel else None
+        if frame is not None:
+            return make_snapshot(frame.data, frame.captured_at, self.ttl)
+        if client.frame_buffer:
+            return make_snapshot(client.frame_buffer, None, self.ttl)
+        return None
+
+    def _cold_source(self, stream):
+        stream_id = str(stream.id)
+        key = (stream_id, None)
+        with self._lock:
+            source = self.cache.get(key)
+            if source is not None:
+                return source
+            if self._failed.get(stream_id, 0) > time.monotonic():
+                return None
+            grab = self._grabs.get(stream_id)
+            started = grab is None
+            if started:
+                grab = self._grabs[stream_id] = _Grab()
+                self.grabs_started += 1
+
+        if not started:
+            grab.done.wait(self.grab_timeout + 1)
+            return grab.source
+
+        try:
+            data = grab_frame(stream, self.grab_timeout, self.max_width)
+            if data:
+                grab.source = make_snapshot(data, time.time(), self.cold_ttl)
+                self.cache.put(key, grab.source)
+        finally:
+            with self._lock:
+                self._grabs.pop(stream_id, None)
+                if grab.source is None:
+                    self._failed[stream_id] = time.monotonic() + self.cold_ttl
+                else:
+                    self._failed.pop(stream_id, None)
+            grab.done.set()
+        return grab.source
+
+    def forget(self, stream_id):
+        """Drop a deleted stream's cached snapshots and failed grab"""
+        with self._lock:
+            self._failed.pop(stream_id, None)
+        self.cache.forget(stream_id)
+
+    def stats(self):
+        with self._lock:
+            grabs = {'grabs_started': self.grabs_started, 'grabs_running': len(self._grabs)}
+        return {**self.cache.stats(), **grabs}
+
+
+_snapshots = None
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshots():
+    """The process-wide Snapshots configured by settings.SNAPSHOTS"""
+    global _snapshots
+    with _snapshots_lock:
+        if _snapshots is None:
+            _snapshots = Snapshots(snapshot_config())
+        return _snapshots
@@ -0,0 +1,116 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger('stream_leases')
+
+
+class Lease(NamedTuple):
+    stream_id: str
+    owner: str          # Lease holder, one RTSPClient instance on one worker
+    address: str        # host:port other workers relay the stream from
+    expires_at: float
+
+
+class SQLiteLeaseStore:
+    """
+        Stream ownership leases in a SQLite file shared by every Daphne worker.
+
+        A lease is taken with BEGIN IMMEDIATE, so two workers racing for the same
+        stream serialize on SQLite's write lock and exactly one of them wins. The
+        holder has to renew it within `ttl` seconds; an expired lease can be taken
+        by anyone, which is how a crashed owner is replaced. The file must live on
+        a filesystem with working POSIX locks (a local disk shared by the workers
+        of one host, not NFS).
+    """
+
+    def __init__(self, path, ttl=10.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stream_lease ("
+                " stream_id TEXT PRIMARY KEY, owner TEXT NOT NULL,"
+                " address TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        # sqlite3 connections must not be shared across threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    def acquire(self, stream_id, owner, address):
+        """Take or renew the lease if it is free, expired or already ours; returns the current Lease"""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT owner, address, expires_at FROM stream_lease WHERE stream_id = ?", (stream_id,)
+            ).fetchone()
+            if row is None or row[2] < now or row[0] == owner:
+                if row is not None and row[0] != owner:
+                    logger.info(f"Lease for stream {stream_id} expired (held by {row[0]}), taken over by {owner}")
+                conn.execute(
+                    "INSERT OR REPLACE INTO stream_lease (stream_id, owner, address, expires_at) VALUES (?, ?, ?, ?)",
+                    (stream_id, owner, address, now + self.ttl),
+                )
+                return Lease(stream_id, owner, address, now + self.ttl)
+            return Lease(stream_id, *row)
+
+    def renew(self, stream_id, owner):
+        """Extend a lease we hold, returns False if it expired or was taken over"""
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE stream_lease SET expires_at = ? WHERE stream_id = ? AND owner = ? AND expires_at >= ?",
+                (now + self.ttl, stream_id, owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, stream_id, owner):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM stream_lease WHERE stream_id = ? AND owner = ?", (stream_id, owner))
+
+    def holder(self, stream_id):
+        """The current, unexpired Lease of a stream or None"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT owner, address, expires_at FROM stream_lease WHERE stream_id = ? AND expires_at >= ?",
+                (stream_id, time.time()),
+            ).fetchone()
+        return Lease(stream_id, *row) if row else None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_lease_store():
+    """The process-wide lease store configured by settings.STREAM_CLUSTER"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from django.conf import settings
+            config = settings.STREAM_CLUSTER
+            _store = SQLiteLeaseStore(config['LEASE_DB'], ttl=config.get('LEASE_TTL_S', 10.0))
+        return _store
@@ -0,0 +1,357 @@
+import asyncio
+import atexit
+import logging
+import weakref
+
+from .frame_hub import get_frame_hub
+from .frame_trace import forget_tracer
+from .metrics import drop_stream_metrics
+from .passthrough import forget_fragment_log
+from .snapshots import get_snapshots
+from .warm_streams import get_idle_streams, idle_timeout_for, warm_config
+
+logger = logging.getLogger('stream_manager')
+
+# How long shutdown() waits for all streams to stop
+SHUTDOWN_TIMEOUT_S = 10.0
+
+
+class StreamManager:
+    """
+        Owns the running stream clients of this process and every step of their
+        lifecycle: start, viewers joining and leaving, the idle timeout, eviction,
+        FFmpeg exiting, deactivation and process shutdown.
+
+        All of it happens on the event loop. Viewer counts only change there, so
+        they need no lock, and each stream's start and stop steps run under an
+        asyncio lock of their own. A viewer joining while the stream is being
+        stopped waits for the old FFmpeg to be gone and then starts a new one, so
+        there is never more than one FFmpeg per stream. Each stream has at most one
+        idle timer, and a viewer joining cancels it.
+
+        `create_client(stream)` builds the ingest client of a Stream, and
+        `client_settings(stream)` is what it was built from: when a saved Stream's
+        settings differ from its running client's, the client is replaced and its
+        viewers move to the new one. Clients tell the manager when their ingest ends
+        on its own (FFmpeg exited, no connection) through client.on_stopped.
+    """
+
+    def __init__(self, create_client, client_settings):
+        self.create_client = create_client
+        self.client_settings = client_settings
+        self.clients = {}           # Stream id -> running client
+        self.restarts = 0
+        # Client replaced after a settings change -> its replacement, which the
+        # viewers that joined the old one leave
+        self._successors = weakref.WeakKeyDictionary()
+        self.stops = 0
+        self.loop = None
+        self._locks = {}            # Stream id -> asyncio.Lock of its start and stop steps
+        self._idle_timers = {}      # Stream id -> asyncio.TimerHandle
+        self._stopping = set()      # Tasks stopping a client
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    def _bind(self):
+        """Remember the event loop on first use, always-on streams start with it"""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.create_task(self.start_always_on())
+
+    def _lock(self, stream_id):
+        lock = self._locks.get(stream_id)
+        if lock is None:
+            lock = self._locks[stream_id] = asyncio.Lock()
+        return lock
+
+    def _in_loop(self, callback, *args):
+        """Run `callback` on the event loop, now if we are on it. Returns False before the loop is known"""
+        if self.loop is None or self.loop.is_closed():
+            return False
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+        return True
+
+    async def join(self, stream, burned_in=True):
+        """
+            Count one viewer on the stream's client, starting it if it is not running.
+            Returns (client, started). Every viewer leaves with leave(client) on the
+            client it got here.
+        """
+        self._bind()
+        stream_id = str(stream.id)
+        async with self._lock(stream_id):
+            if self._closed:
+                raise RuntimeError("Shutting down, not starting streams")
+            client = self.clients.get(stream_id)
+            if client and client.is_running:
+                # Also the case for a warm stream nobody was watching: its latest frame is ready
+                self.attach(client, burned_in=burned_in)
+                return client, False
+            client = self._new_client(stream)
+            self._cancel_idle(stream_id)
+            client.start(burned_in=burned_in)
+            return client, True
+
+    def attach(self, client, burned_in=True):
+        """Count one more viewer on a running client, it stops being idle"""
+        self._cancel_idle(client.stream_id)
+        get_idle_streams().discard(client)
+        client.add_client(burned_in=burned_in)
+
+    def leave(self, client, burned_in=True):
+        """
+            A viewer of `client` left. Without viewers the stream stays warm (frames keep
+            coming, analysis pauses) until its idle timeout, or forever if it is always on
+        """
+        if not self._on_loop():
+            self._in_loop(self.leave, client, burned_in)
+            return
+        while client in self._successors:
+            client = self._successors[client]
+        client.remove_client(burned_in=burned_in)
+        if client.client_count or not client.is_running or self.clients.get(client.stream_id) is not client:
+            return
+        self._unwatched(client)
+
+    def _unwatched(self, client):
+        """The registered `client` has no viewer: start its idle timer, unless it is always on"""
+        self._cancel_idle(client.stream_id)
+        if client.idle_timeout is None:
+            get_idle_streams().discard(client)
+            logger.info(f"No clients for stream {client.stream_id}, keeping it running (always on).")
+            return
+        logger.info(f"No clients for stream {client.stream_id}, stopping in {client.idle_timeout:.0f}s.")
+        self._idle_timers[client.stream_id] = self.loop.call_later(client.idle_timeout, self._idle_expired, client)
+        for evicted in get_idle_streams().add(client):
+            logger.info(f"Too many idle streams ({get_idle_streams().max_idle}), stopping stream {evicted.stream_id}")
+            self._stop_soon(evicted, idle=True)
+
+    def _idle_expired(self, client):
+        self._idle_timers.pop(client.stream_id, None)
+        logger.info(f"Stopping stream {client.stream_id} due to no clients.")
+        self._stop_soon(client, idle=True)
+
+    def _cancel_idle(self, stream_id):
+        timer = self._idle_timers.pop(stream_id, None)
+        if timer:
+            timer.cancel()
+
+    async def start_warm(self, stream):
+        """Start a stream with no viewer (always-on streams), unless it is running"""
+        self._bind()
+        stream_id = str(stream.id)
+        async with self._lock(stream_id):
+            client = self.clients.get(stream_id)
+            if self._closed or (client and client.is_running):
+                return
+            logger.info(f"Starting always-on stream {stream_id}")
+            self._new_client(stream).start_warm()
+
+    async def start_always_on(self):
+        """Start every active always-on stream that is not running yet"""
+        from asgiref.sync import sync_to_async
+        from ..models import Stream
+        try:
+            streams = await sync_to_async(list)(Stream.objects.filter(is_active=True, keep_warm='always'))
+            for stream in streams:
+                await self.start_warm(stream)
+        except Exception as e:
+            logger.error(f"Could not start always-on streams: {e}")
+
+    def _new_client(self, stream):
+        client = self.clients[str(stream.id)] = self.create_client(stream)
+        client.on_stopped = self._client_stopped
+        client.stream_settings = self.client_settings(stream)
+        return client
+
+    async def apply(self, stream):
+        """
+            Bring a running stream in line with its saved settings: a new keep-warm policy
+            applies in place, any other change restarts FFmpeg in a new client that takes
+            over the viewers. An always-on stream that is not running is started.
+        """
+        self._bind()
+        stream_id = str(stream.id)
+        async with self._lock(stream_id):
+            client = self.clients.get(stream_id)
+            running = client is not None and client.is_running
+            if running and not self._closed:
+                if client.stream_settings != self.client_settings(stream):
+                    await self._restart(client, stream)
+                elif client.idle_timeout != idle_timeout_for(stream):
+                    logger.info(f"Keep-warm policy of stream {stream_id} changed")
+                    client.idle_timeout = idle_timeout_for(stream)
+                    if not client.client_count:
+                        self._unwatched(client)
+        if not running and stream.keep_warm == 'always':
+            await self.start_warm(stream)
+
+    async def _restart(self, client, stream):
+        """Replace `client` by one built from the saved `stream`, keeping its viewers. Holds the stream's lock"""
+        stream_id = str(stream.id)
+        logger.info(f"Settings of stream {stream_id} changed, restarting it")
+        self._cancel_idle(stream_id)
+        get_idle_streams().discard(client)
+        replacement = self._new_client(stream)
+        self._successors[client] = replacement
+        replacement.client_count, replacement.burned_in_clients = client.client_count, client.burned_in_clients
+        replacement.rendition_demand = client.rendition_demand
+        self.restarts += 1
+        # One FFmpeg per camera: the old one is gone before the new one starts
+        await client.stop()
+        if client.stream_settings.get('delivery') != replacement.stream_settings.get('delivery'):
+            # Viewers read JPEG frames or MP4 fragments, they have to connect again for the other
+            await client.channel_layer.group_send(client.group_name, {'type': 'stream_restarted', 'stream_id': stream_id})
+        replacement.start_warm()
+        if not replacement.client_count:
+            self._unwatched(replacement)
+
+    async def stop(self, client, idle=False):
+        """Stop `client` and wait until its FFmpeg is gone. With `idle`, only if it still has no viewer"""
+        stream_id = client.stream_id
+        async with self._lock(stream_id):
+            if idle and client.client_count:
+                # A viewer came back between the idle timer and now
+                return
+            if self.clients.get(stream_id) is client:
+                # Idle timers belong to the registered client, not to one already replaced
+                del self.clients[stream_id]
+                self._cancel_idle(stream_id)
+            get_idle_streams().discard(client)
+            if client.is_running:
+                self.stops += 1
+            await client.stop()
+
+    def _stop_soon(self, client, idle=False):
+        task = self.loop.create_task(self.stop(client, idle=idle))
+        self._stopping.add(task)
+        task.add_done_callback(self._stopping.discard)
+
+    def stop_stream(self, stream_id):
+        """Stop a stream if it is running (deactivated or deleted), from any thread"""
+        def stop():
+            client = self.clients.get(str(stream_id))
+            if client:
+                logger.info(f"Stopping stream {stream_id}")
+                self._stop_soon(client)
+        self._in_loop(stop)
+
+    def stream_deleted(self, stream_id):
+        """A Stream was deleted: stop it, then drop what this process keeps about it, from any thread"""
+        stream_id = str(stream_id)
+
+        async def delete():
+            client = self.clients.get(stream_id)
+            if client:
+                logger.info(f"Stopping deleted stream {stream_id}")
+                await self.stop(client)
+            self._forget_stream(stream_id)
+
+        def start():
+            task = self.loop.create_task(delete())
+            self._stopping.add(task)
+            task.add_done_callback(self._stopping.discard)
+        if not self._in_loop(start):
+            self._forget_stream(stream_id)
+
+    @staticmethod
+    def _forget_stream(stream_id):
+        """Drop a deleted stream's entries from the per-process registries, once its client is gone"""
+        drop_stream_metrics(stream_id)
+        get_frame_hub().forget(stream_id)
+        forget_fragment_log(stream_id)
+        forget_tracer(stream_id)
+        get_snapshots().forget(stream_id)
+
+    def stream_changed(self, stream):
+        """A Stream was saved: stop it if it was deactivated, else apply its settings, from any thread"""
+        if not stream.is_active:
+            self.stop_stream(stream.id)
+        else:
+            self._in_loop(lambda: self.loop.create_task(self.apply(stream)))
+
+    def _client_stopped(self, client):
+        """client.on_stopped: its ingest ended, from the ingest thread or the event loop"""
+        self._in_loop(self._forget, client)
+
+    def _forget(self, client):
+        if self.clients.get(client.stream_id) is not client:
+            # Stopped by us, or already replaced
+            return
+        logger.info(f"Stream {client.stream_id} stopped on its own, removing it")
+        del self.clients[client.stream_id]
+        self._cancel_idle(client.stream_id)
+        get_idle_streams().discard(client)
+        if client.idle_timeout is None and not self._closed:
+            delay = warm_config().get('ALWAYS_ON_RESTART_S', 30.0)
+            logger.info(f"Restarting always-on stream {client.stream_id} in {delay:.0f}s")
+            self.loop.call_later(delay, lambda: self.loop.create_task(self.start_always_on()))
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def close(self):
+        """Stop every stream and wait for all of them, no new ones start afterwards"""
+        self._closed = True
+        for stream_id in list(self._idle_timers):
+            self._cancel_idle(stream_id)
+        for client in list(self.clients.values()):
+            self._stop_soon(client)
+        if self._stopping:
+            await asyncio.wait(set(self._stopping))
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT_S):
+        """
+            Stop every stream before the process exits, so no FFmpeg outlives it (they
+            run in sessions of their own and would not get the server's signals).
+            Registered with atexit; may be called from any thread.
+        """
+        loop = self.loop
+        if self._closed or loop is None or loop.is_closed():
+            return
+        if not self.clients and not self._stopping:
+            self._closed = True
+            return
+        logger.info(f"Shutting down {len(self.clients)} streams")
+        if loop.is_running():
+            if self._on_loop():
+                # Cannot block the loop we are on, stop in the background
+                loop.create_task(self.close())
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self.close(), loop).result(timeout)
+            except Exception as e:
+                logger.error(f"Streams did not shut down cleanly: {e!r}")
+            return
+
+        # At exit the server's loop has stopped and thread pools take no more work,
+        # every client stops its FFmpeg on its own
+        self._closed = True
+        for stream_id in list(self._idle_timers):
+            self._cancel_idle(stream_id)
+        clients = list(self.clients.values())
+        self.clients.clear()
+        for client in clients:
+            try:
+                client.shutdown()
+            except Exception as e:
+                logger.error(f"Stream {client.stream_id} did not shut down cleanly: {e!r}")
+
+    def stats(self):
+        return {
+            'running': sorted(self.clients),
+            'idle_timers': sorted(self._idle_timers),
+            'stopping': len(self._stopping),
+            'stops': self.stops,
+            'restarts': self.restarts,
+        }
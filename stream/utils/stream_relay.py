@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import struct
+
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger('stream_relay')
+
+# Wire format of the relay body, one record after another:
+#   b'F' + !QdII (seq, captured_at, len(frame), len(annotated)) + frame + annotated
+#   b'M' + !I (len(payload)) + JSON channel layer message (detections, status, errors)
+_FRAME_HEADER = struct.Struct('!QdII')
+_MESSAGE_HEADER = struct.Struct('!I')
+
+RELAY_TOKEN_HEADER = 'X-Stream-Relay-Token'
+
+
+class RelayError(Exception):
+    pass
+
+
+def encode_frame(seq, captured_at, frame_bytes, annotated_frame_bytes=None):
+    annotated_frame_bytes = annotated_frame_bytes or b''
+    header = _FRAME_HEADER.pack(seq, captured_at or 0.0, len(frame_bytes), len(annotated_frame_bytes))
+    return b''.join((b'F', header, frame_bytes, annotated_frame_bytes))
+
+
+def encode_message(message):
+    payload = json.dumps(message).encode()
+    return b'M' + _MESSAGE_HEADER.pack(len(payload)) + payload
+
+
+class RelayDecoder:
+    """Incremental parser for the relay body, same feed()/records() shape as JPEGFrameSplitter"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+
+    def records(self):
+        """
+            Yield ('frame', seq, captured_at, frame_bytes, annotated_frame_bytes or None)
+            and ('message', dict) for every complete record in the buffer
+        """
+        buffer = self._buffer
+        pos = 0
+        while pos < len(buffer):
+            kind = buffer[pos:pos + 1]
+            if kind == b'F':
+                start = pos + 1 + _FRAME_HEADER.size
+                if len(buffer) < start:
+                    break
+                seq, captured_at, frame_len, annotated_len = _FRAME_HEADER.unpack_from(buffer, pos + 1)
+                end = start + frame_len + annotated_len
+                if len(buffer) < end:
+                    break
+                frame_bytes = bytes(buffer[start:start + frame_len])
+                annotated = bytes(buffer[start + frame_len:end]) if annotated_len else None
+                yield 'frame', seq, captured_at or None, frame_bytes, annotated
+            elif kind == b'M':
+                start = pos + 1 + _MESSAGE_HEADER.size
+                if len(buffer) < start:
+                    break
+                (length,) = _MESSAGE_HEADER.unpack_from(buffer, pos + 1)
+                end = start + length
+                if len(buffer) < end:
+                    break
+                yield 'message', json.loads(bytes(buffer[start:end]))
+            else:
+                raise RelayError(f"Corrupt relay stream, unexpected record type {kind!r}")
+            pos = end
+        del buffer[:pos]
+
+
+async def relay_stream(client, manager, burned_in=False):
+    """
+        Body of the relay response on the owning worker: frames of `client` from the
+        frame hub (or stream_frame messages with channel layer fan-out) plus every
+        other message of the stream's group. The relay counts as one viewer of the
+        StreamManager `manager`, so the owner keeps ingesting while only remote
+        workers are watching.
+    """
+    channel_layer = get_channel_layer()
+    layer_channel = await channel_layer.new_channel()
+    await channel_layer.group_add(client.group_name, layer_channel)
+    manager.attach(client, burned_in=burned_in)
+    source = client.frame_channel
+    version = 0
+    frame_task = message_task = None
+    logger.info(f"Relaying stream {client.stream_id} to another worker")
+    try:
+        while True:
+            if source and frame_task is None:
+                frame_task = asyncio.create_task(source.next_frame(version))
+            if message_task is None:
+                message_task = asyncio.create_task(channel_layer.receive(layer_channel))
+            done, _ = await asyncio.wait({t for t in (frame_task, message_task) if t}, return_when=asyncio.FIRST_COMPLETED)
+
+            if frame_task in done:
+                frame = frame_task.result()
+                frame_task = None
+                version = frame.version
+                yield encode_frame(frame.seq, frame.captured_at, frame.data, frame.annotated)
+            if message_task in done:
+                message = message_task.result()
+                message_task = None
+                if message['type'] == 'stream_frame':
+                    yield encode_frame(message['seq'], message.get('captured_at'), message['frame'], message.get('annotated_frame'))
+                else:
+                    yield encode_message(message)
+    finally:
+        for task in (frame_task, message_task):
+            if task:
+                task.cancel()
+        await channel_layer.group_discard(client.group_name, layer_channel)
+        manager.leave(client, burned_in=burned_in)
+        logger.info(f"Stopped relaying stream {client.stream_id}")
+
+
+async def read_relay(address, stream_id, token='', burned_in=False, timeout=10.0):
+    """
+        Connect to the relay endpoint of the worker at `address` (host:port) and yield
+        its records as RelayDecoder.records() does. Ends when the owner closes the
+        stream; raises RelayError/OSError/TimeoutError when it fails or goes silent
+        for `timeout` seconds.
+    """
+    host, port = address.rsplit(':', 1)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+    try:
+        path = f"/api/streams/{stream_id}/relay/?burned_in={int(burned_in)}"
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {address}\r\n{RELAY_TOKEN_HEADER}: {token}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        parts = status_line.split()
+        if len(parts) < 2 or parts[1] != b'200':
+            raise RelayError(f"Relay from {address} refused: {status_line.decode('latin-1').strip()}")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+
+        decoder = RelayDecoder()
+        while True:
+            if chunked:
+                size_line = await asyncio.wait_for(reader.readline(), timeout)
+                if not size_line:
+                    return
+                size = int(size_line.split(b';')[0], 16)
+                if size == 0:
+                    return
+                data = (await asyncio.wait_for(reader.readexactly(size + 2), timeout))[:-2]
+            else:
+                data = await asyncio.wait_for(reader.read(256 * 1024), timeout)
+                if not data:
+                    return
+            decoder.feed(data)
+            for record in decoder.records():
+                yield record
+    finally:
+        writer.close()
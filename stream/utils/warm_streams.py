@@ -0,0 +1,78 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger('warm_streams')
+
+
+def warm_config():
+    from django.conf import settings
+    return getattr(settings, 'WARM_STREAMS', {})
+
+
+def idle_timeout_for(stream):
+    """
+        Seconds a stream keeps running after its last viewer left, from its keep_warm
+        policy: None for 'always', Stream.idle_timeout for 'idle', a short grace for
+        'on_demand' so a reload does not restart FFmpeg
+    """
+    if stream.keep_warm == 'always':
+        return None
+    if stream.keep_warm == 'idle':
+        return float(stream.idle_timeout)
+    return warm_config().get('ON_DEMAND_GRACE_S', 5.0)
+
+
+class IdleStreams:
+    """
+        Running streams without viewers, least recently watched first.
+
+        Idle streams keep FFmpeg running and their latest frame fresh (without
+        analysis) until their idle timeout. At most `max_idle` of them are kept;
+        adding one more evicts the stream that has been idle longest, which the
+        StreamManager then stops. Always-on streams are never added, they are
+        bounded by configuration instead.
+    """
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.evictions = 0
+        self._clients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, client):
+        """Track an idle client, returns the clients evicted to make room for it"""
+        with self._lock:
+            self._clients.pop(id(client), None)
+            self._clients[id(client)] = client
+            evicted = []
+            while len(self._clients) > self.max_idle:
+                _, oldest = self._clients.popitem(last=False)
+                evicted.append(oldest)
+            self.evictions += len(evicted)
+        return evicted
+
+    def discard(self, client):
+        with self._lock:
+            self._clients.pop(id(client), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': [client.stream_id for client in self._clients.values()],
+                'max_idle': self.max_idle,
+                'evictions': self.evictions,
+            }
+
+
+_idle_streams = None
+_idle_lock = threading.Lock()
+
+
+def get_idle_streams():
+    """The process-wide IdleStreams configured by settings.WARM_STREAMS"""
+    global _idle_streams
+    with _idle_lock:
+        if _idle_streams is None:
+            _idle_streams = IdleStreams(warm_config().get('MAX_IDLE', 8))
+        return _idle_streams
@@ -1,11 +1,20 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import Stream
 from .serializers import StreamSerializer
-# from .utils.stream_manager import StreamManager
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from .consumer import active_streams, join_stream, stream_manager
+from .utils.stream_relay import RELAY_TOKEN_HEADER, relay_stream
+from .utils.snapshots import get_snapshots
+from .utils.mjpeg_http import CONTENT_TYPE as MJPEG_CONTENT_TYPE, MJPEGStream
+from .utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics_config, render_metrics
+from .utils.frame_trace import STAGES as TRACE_STAGES, frame_tracer
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
 
 # Create your views here.
 
@@ -24,6 +33,20 @@ class StreamViewSet(viewsets.ModelViewSet):
     """
     queryset = Stream.objects.all()
     serializer_class = StreamSerializer
+
+    def perform_create(self, serializer):
+        stream = serializer.save()
+        stream_manager.stream_changed(stream)
+
+    def perform_update(self, serializer):
+        # Stops a deactivated stream, restarts a running one with its new settings, starts one that became always on
+        stream = serializer.save()
+        stream_manager.stream_changed(stream)
+
+    def perform_destroy(self, instance):
+        stream_id = str(instance.id)
+        instance.delete()
+        stream_manager.stream_deleted(stream_id)
     
     @extend_schema(
         description="Activate a stream",
@@ -35,6 +58,7 @@ class StreamViewSet(viewsets.ModelViewSet):
         stream = self.get_object()
         stream.is_active = True
         stream.save()
+        stream_manager.stream_changed(stream)
         serializer = self.get_serializer(stream)
         return Response(serializer.data)
     
@@ -48,11 +72,10 @@ class StreamViewSet(viewsets.ModelViewSet):
         stream = self.get_object()
         stream.is_active = False
         stream.save()
-        
+
         # Stop the stream if it's running
-        # manager = StreamManager()
-        # manager.stop_stream(str(stream.id))
-        
+        stream_manager.stop_stream(str(stream.id))
+
         serializer = self.get_serializer(stream)
         return Response(serializer.data)
     
@@ -66,3 +89,147 @@ class StreamViewSet(viewsets.ModelViewSet):
         active_streams = Stream.objects.filter(is_active=True)
         serializer = self.get_serializer(active_streams, many=True)
         return Response(serializer.data)
+
+    def _recorder(self, pk):
+        client = active_streams.get(str(pk))
+        return getattr(client, 'recorder', None) if client and client.is_running else None
+
+    @extend_schema(description="Time window and size of the stream's instant replay recording")
+    @action(detail=True, methods=['get'])
+    def dvr(self, request, pk=None):
+        """Recording window of a running stream, playback is requested over the WebSocket"""
+        self.get_object()
+        recorder = self._recorder(pk)
+        window = recorder.window() if recorder else None
+        if window is None:
+            return Response({'detail': 'No recording available for this stream'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'start': window[0], 'end': window[1], **recorder.stats()})
+
+    @extend_schema(description="Debug: p50/p95/p99 in ms per stage (pipe read to viewer echo) of the frames sampled by the latency tracer")
+    @action(detail=True, methods=['get'])
+    def latency(self, request, pk=None):
+        """Where a frame's time goes between FFmpeg and the viewer, see settings.LATENCY_TRACE"""
+        self.get_object()
+        client = active_streams.get(str(pk))
+        tracer = frame_tracer(str(pk))
+        stages = client.trace_stats() if client else tracer.stats()
+        return Response({
+            'running': bool(client and client.is_running),
+            'sample_every': tracer.sample_every,
+            'stages': {stage: stages[stage] for stage in TRACE_STAGES if stage in stages},
+        })
+
+    @extend_schema(
+        description="Recorded JPEG frame shown at a unix timestamp",
+        parameters=[OpenApiParameter('at', float, description="Unix timestamp within the recording window")],
+        responses={(200, 'image/jpeg'): bytes},
+    )
+    @action(detail=True, methods=['get'], url_path='dvr/frame')
+    def dvr_frame(self, request, pk=None):
+        """A single recorded frame, the last one captured at or before ?at="""
+        self.get_object()
+        try:
+            at = float(request.query_params['at'])
+        except (KeyError, ValueError):
+            return Response({'detail': "Query parameter 'at' (unix timestamp) is required"}, status=status.HTTP_400_BAD_REQUEST)
+        recorder = self._recorder(pk)
+        frame = recorder.frame_at(at) if recorder else None
+        if frame is None:
+            return Response({'detail': 'No recording available for this stream'}, status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(frame.data, content_type='image/jpeg')
+        response['X-Captured-At'] = f"{frame.captured_at:.6f}"
+        return response
+
+    @extend_schema(
+        description="Latest JPEG of the stream, optionally downscaled; cached, supports If-None-Match",
+        parameters=[OpenApiParameter('width', int, description="Maximum width in pixels (never upscaled)")],
+        responses={(200, 'image/jpeg'): bytes, 304: None},
+    )
+    @action(detail=True, methods=['get'])
+    def snapshot(self, request, pk=None):
+        """Thumbnail for stream grids, a stream that is not running is grabbed once and cached"""
+        stream = self.get_object()
+        try:
+            width = int(request.query_params.get('width', 0))
+        except ValueError:
+            width = -1
+        if width < 0:
+            return Response({'detail': "Query parameter 'width' must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        snapshots = get_snapshots()
+        snapshot = snapshots.get(stream, active_streams.get(str(pk)), width or None)
+        if snapshot is None:
+            return Response({'detail': 'Could not get a frame from this stream'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if '*' in etags or snapshot.etag in etags:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(snapshot.data, content_type='image/jpeg')
+            if snapshot.captured_at:
+                response['X-Captured-At'] = f"{snapshot.captured_at:.6f}"
+        response['ETag'] = snapshot.etag
+        response['Cache-Control'] = f"private, max-age={int(snapshots.ttl)}"
+        return response
+
+    @extend_schema(
+        description="Live MJPEG stream (multipart/x-mixed-replace) for <img> tags, NVRs and curl",
+        parameters=[
+            OpenApiParameter('overlay', str, enum=['burned', 'none'], description="'none' sends frames without face boxes"),
+            OpenApiParameter('fps', float, description="Maximum frame rate for this viewer"),
+        ],
+        responses={(200, 'multipart/x-mixed-replace'): bytes},
+    )
+    @action(detail=True, methods=['get'])
+    def mjpeg(self, request, pk=None):
+        """Watch a stream over plain HTTP, sharing its FFmpeg process with every other viewer"""
+        stream = self.get_object()
+        if not stream.is_active:
+            return Response({'detail': 'Stream is not active'}, status=status.HTTP_404_NOT_FOUND)
+        if stream.delivery == 'passthrough':
+            return Response({'detail': 'Stream is delivered as H.264 passthrough, there are no JPEG frames'},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            max_fps = float(request.query_params.get('fps', 0))
+        except ValueError:
+            max_fps = -1
+        if max_fps < 0:
+            return Response({'detail': "Query parameter 'fps' must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        burned_in = request.query_params.get('overlay', 'burned') != 'none'
+        response = StreamingHttpResponse(
+            MJPEGStream(lambda: join_stream(stream, burned_in=burned_in), stream_manager.leave,
+                        burned_in=burned_in, max_fps=max_fps),
+            content_type=MJPEG_CONTENT_TYPE,
+        )
+        response['Cache-Control'] = 'no-cache, no-store'
+        response['X-Accel-Buffering'] = 'no'    # Keep reverse proxies from buffering the stream
+        return response
+
+    @extend_schema(exclude=True)
+    @action(detail=True, methods=['get'])
+    def relay(self, request, pk=None):
+        """Internal: stream the frames of a stream this worker owns to another worker"""
+        token = settings.STREAM_CLUSTER.get('RELAY_TOKEN', '')
+        if not token:
+            return Response({'detail': 'Relay is disabled, STREAM_RELAY_TOKEN is not set'}, status=status.HTTP_403_FORBIDDEN)
+        if not constant_time_compare(request.headers.get(RELAY_TOKEN_HEADER, ''), token):
+            return Response({'detail': 'Invalid relay token'}, status=status.HTTP_403_FORBIDDEN)
+
+        client = active_streams.get(str(pk))
+        if client is None or not client.is_running or getattr(client, 'role', 'owner') != 'owner':
+            return Response({'detail': 'This worker does not own the stream'}, status=status.HTTP_409_CONFLICT)
+
+        burned_in = request.query_params.get('burned_in') == '1'
+        return StreamingHttpResponse(relay_stream(client, stream_manager, burned_in=burned_in), content_type='application/octet-stream')
+
+
+def metrics(request):
+    """Prometheus scrape endpoint: per-stream ingest and delivery metrics of this process"""
+    config = metrics_config()
+    if not config.get('ENABLED', True):
+        raise Http404
+    token = config.get('TOKEN', '')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Invalid metrics token\n', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(active_streams), content_type=METRICS_CONTENT_TYPE)
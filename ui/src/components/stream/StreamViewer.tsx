@@ -4,7 +4,7 @@ import { Button } from '../ui/button';
 import { Badge } from '../ui/badge';
 import { Play, Pause, RefreshCw, Maximize, Minimize, Video, VideoOff, X } from 'lucide-react';
 import { cn } from '@/lib/utils';
-import { SOCKET_BASE_URL } from '@/config';
+import { LATENCY_TRACE, SIDECAR_OVERLAY, SOCKET_BASE_URL } from '@/config';
 
 interface StreamViewerProps {
   streamId: string;
@@ -17,7 +17,26 @@ interface StreamFrame {
   type: string;
   frame?: string;
   message?: string;
+  state?: 'reconnecting' | 'live' | null;
   stream_id: string;
+  seq?: number;
+  faces?: FaceDetection[];
+  mime?: string;
+  analysis_width?: number;
+  renditions?: string[];
+  name?: string;
+  detection_width?: number;
+}
+
+// Passthrough streams send fragmented MP4 for Media Source Extensions instead of JPEGs
+interface PassthroughInfo {
+  mime: string;
+  analysisWidth: number;
+}
+
+interface FaceDetection {
+  box: [number, number, number, number];
+  confidence: number;
 }
 
 const StreamViewer: React.FC<StreamViewerProps> = ({ 
@@ -28,15 +47,32 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
 }) => {
   const [isConnected, setIsConnected] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  // Set while the server restarts the stream's FFmpeg, the last frame stays up meanwhile
+  const [reconnecting, setReconnecting] = useState<string | null>(null);
   //Put data frames in a queue so we show smooth video.
   const [, setFrameQueue] = useState<Uint8Array[]>([]);
   const [currentFrame, setCurrentFrame] = useState<string | null>(null);
+  // Face boxes arrive as a sidecar message and are drawn over the untouched frame
+  const [faces, setFaces] = useState<FaceDetection[]>([]);
+  const [frameSize, setFrameSize] = useState<{ width: number; height: number } | null>(null);
+  const [passthrough, setPassthrough] = useState<PassthroughInfo | null>(null);
+  // Quality ladder: the stream's renditions, the one being shown, and the frame width detection boxes refer to
+  const [renditions, setRenditions] = useState<string[]>([]);
+  const [rendition, setRendition] = useState<string | null>(null);
+  const [detectionWidth, setDetectionWidth] = useState<number | null>(null);
   const [isPaused, setIsPaused] = useState(false);
   const [isFullscreen, setIsFullscreen] = useState(false);
   const [showControls, setShowControls] = useState(false);
   const cardRef = useRef<HTMLDivElement>(null);
   const wsRef = useRef<WebSocket | null>(null);
   const frameTimesRef = useRef<number[]>([]);
+  const videoRef = useRef<HTMLVideoElement>(null);
+  const sourceBufferRef = useRef<SourceBuffer | null>(null);
+  const appendQueueRef = useRef<ArrayBuffer[]>([]);
+  // Latency tracing: the server announces a sampled frame right before sending it,
+  // and gets a ping with its seq once that frame is on screen
+  const pendingTraceRef = useRef<number | null>(null);
+  const tracedFramesRef = useRef(new WeakMap<Uint8Array, number>());
 
   const STREAM_FRAMES = useRef(15);
 
@@ -47,6 +83,70 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
     };
   }, []);
 
+  // Fragments are appended one at a time and acked once appended, so a slow
+  // decoder holds back the server instead of growing a queue here
+  const appendNext = () => {
+    const sourceBuffer = sourceBufferRef.current;
+    if (!sourceBuffer || sourceBuffer.updating || appendQueueRef.current.length === 0) return;
+    try {
+      sourceBuffer.appendBuffer(appendQueueRef.current.shift()!);
+    } catch (err) {
+      console.error('Failed to append fragment:', err);
+      setError('Playback error');
+    }
+  };
+
+  useEffect(() => {
+    const video = videoRef.current;
+    if (!passthrough || !video) return;
+    if (!window.MediaSource || !MediaSource.isTypeSupported(passthrough.mime)) {
+      setError(`Browser cannot play ${passthrough.mime}`);
+      return;
+    }
+
+    const mediaSource = new MediaSource();
+    const objectUrl = URL.createObjectURL(mediaSource);
+    video.src = objectUrl;
+    mediaSource.addEventListener('sourceopen', () => {
+      const sourceBuffer = mediaSource.addSourceBuffer(passthrough.mime);
+      // Fragments are played in arrival order, so skipped ones leave no gap
+      sourceBuffer.mode = 'sequence';
+      sourceBuffer.addEventListener('updateend', () => {
+        const ws = wsRef.current;
+        if (ws && ws.readyState === WebSocket.OPEN) {
+          ws.send(JSON.stringify({ type: 'ack' }));
+        }
+        // Stay at the live edge and keep only a few seconds buffered
+        const buffered = sourceBuffer.buffered;
+        if (buffered.length > 0) {
+          const end = buffered.end(buffered.length - 1);
+          if (end - video.currentTime > 2) video.currentTime = end - 0.5;
+          if (!sourceBuffer.updating && video.currentTime - buffered.start(0) > 10) {
+            sourceBuffer.remove(buffered.start(0), video.currentTime - 5);
+            return;
+          }
+        }
+        appendNext();
+      });
+      sourceBufferRef.current = sourceBuffer;
+      appendNext();
+    });
+
+    return () => {
+      sourceBufferRef.current = null;
+      appendQueueRef.current = [];
+      video.removeAttribute('src');
+      URL.revokeObjectURL(objectUrl);
+    };
+  }, [passthrough]);
+
+  useEffect(() => {
+    const video = videoRef.current;
+    if (!video) return;
+    if (isPaused) video.pause();
+    else video.play().catch(() => {});
+  }, [isPaused, passthrough]);
+
   useEffect(() => {
     if (isPaused) return;
   
@@ -65,6 +165,15 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
         const blob = new Blob([nextFrame], { type: 'image/jpeg' });
         objectUrl = URL.createObjectURL(blob);
         setCurrentFrame(objectUrl);
+
+        const traceSeq = tracedFramesRef.current.get(nextFrame);
+        if (traceSeq !== undefined) {
+          tracedFramesRef.current.delete(nextFrame);
+          requestAnimationFrame(() => {
+            const ws = wsRef.current;
+            if (ws?.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'ping', trace: traceSeq }));
+          });
+        }
   
         return rest;
       });
@@ -85,23 +194,42 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
 
     // Create new WebSocket connection
     // Use path without ws/ prefix to match backend routes
-    const ws = new WebSocket(`${baseUrl}/stream/${streamId}/`);
+    const query = new URLSearchParams();
+    if (SIDECAR_OVERLAY) query.set('overlay', 'sidecar');
+    if (LATENCY_TRACE) query.set('trace', '1');
+    const ws = new WebSocket(`${baseUrl}/stream/${streamId}/?${query}`);
     wsRef.current = ws;
 
     ws.onopen = () => {
       setFrameQueue([]);
       setCurrentFrame(null);
+      setFaces([]);
+      setPassthrough(null);
+      setRendition(null);
+      setDetectionWidth(null);
       setIsConnected(true);
       setError(null);
+      setReconnecting(null);
       frameTimesRef.current = [];
     };
 
     ws.onmessage = async (event) => {
       try {
-        // Check if the data is a Blob (which it is, based on your log)
-        if (event.data instanceof Blob) {
+        if (event.data instanceof ArrayBuffer) {
+          // Passthrough: acked in the SourceBuffer's updateend
+          appendQueueRef.current.push(event.data);
+          appendNext();
+        } else if (event.data instanceof Blob) {
+          // Ack every frame so the server only keeps a couple of frames in flight for us
+          if (ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ type: 'ack' }));
+          }
+          // Taken before the await, the next message may announce the next traced frame
+          const traceSeq = pendingTraceRef.current;
+          pendingTraceRef.current = null;
           const buffer = await event.data.arrayBuffer(); // Read Blob as ArrayBuffer
           const bytes = new Uint8Array(buffer);
+          if (traceSeq !== null) tracedFramesRef.current.set(bytes, traceSeq);
           setFrameQueue(prevQueue => {
             const newQueue = [...prevQueue, bytes];
             if (newQueue.length > STREAM_FRAMES.current * 2) newQueue.shift();
@@ -114,6 +242,24 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
     
             if (data?.type === 'stream_frame' && data.frame) {
               // Process JSON stream frame if needed
+            } else if (data.type === 'status' && data.renditions) {
+              setRenditions(data.renditions);
+              setRendition(current => current ?? data.renditions![0]);
+            } else if (data.type === 'rendition' && data.name) {
+              setRendition(data.name);
+              setDetectionWidth(data.detection_width ?? null);
+            } else if (data.type === 'passthrough' && data.mime) {
+              ws.binaryType = 'arraybuffer';
+              setPassthrough({ mime: data.mime, analysisWidth: data.analysis_width ?? 640 });
+            } else if (data.type === 'trace' && data.seq !== undefined) {
+              pendingTraceRef.current = data.seq;
+            } else if (data.type === 'detections' && data.faces) {
+              setFaces(data.faces);
+            } else if (data.type === 'stream_status' && data.state === 'reconnecting') {
+              setReconnecting(data.message ?? 'Reconnecting...');
+            } else if (data.type === 'stream_status' && data.state === 'live') {
+              setReconnecting(null);
+              setError(null);
             } else if (data.type === 'stream_error' && data.message) {
               setError(data.message);
             }
@@ -147,6 +293,14 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
     }
   };
 
+  const selectRendition = (name: string) => {
+    // The server keeps sending the current rendition until the new one is being encoded
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type: 'rendition', name }));
+    }
+  };
+
   const handleReconnect = () => {
     connectWebSocket();
   };
@@ -204,13 +358,70 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
           onMouseEnter={() => setShowControls(true)}
           onMouseLeave={() => setShowControls(false)}
         >
-          {currentFrame && !isPaused ? (
-            <img
-              src={currentFrame ? currentFrame : ''}
-              alt="RTSP Stream"
-              className="w-auto h-auto max-w-full max-h-full object-contain"
-              style={{ objectFit: 'contain' }}
-            />
+          {passthrough ? (
+            <div className="relative w-full h-full">
+              <video
+                ref={videoRef}
+                className="w-full h-full object-contain"
+                autoPlay
+                muted
+                playsInline
+                onLoadedMetadata={(e) => {
+                  const { videoWidth, videoHeight } = e.currentTarget;
+                  setFrameSize({ width: videoWidth, height: videoHeight });
+                }}
+              />
+              {frameSize && faces.length > 0 && (
+                // Boxes come from the analysis frames, scaled to analysisWidth
+                <svg
+                  className="absolute inset-0 w-full h-full pointer-events-none"
+                  viewBox={`0 0 ${passthrough.analysisWidth} ${passthrough.analysisWidth * frameSize.height / frameSize.width}`}
+                  preserveAspectRatio="xMidYMid meet"
+                >
+                  {faces.map((face, i) => {
+                    const [x, y, w, h] = face.box;
+                    return (
+                      <rect key={i} x={x} y={y} width={w} height={h} fill="none" stroke="#00ff00" strokeWidth={2} />
+                    );
+                  })}
+                </svg>
+              )}
+            </div>
+          ) : currentFrame && !isPaused ? (
+            <div className="relative w-full h-full">
+              <img
+                src={currentFrame ? currentFrame : ''}
+                alt="RTSP Stream"
+                className="w-full h-full object-contain"
+                style={{ objectFit: 'contain' }}
+                onLoad={(e) => {
+                  const { naturalWidth, naturalHeight } = e.currentTarget;
+                  if (frameSize?.width !== naturalWidth || frameSize?.height !== naturalHeight) {
+                    setFrameSize({ width: naturalWidth, height: naturalHeight });
+                  }
+                }}
+              />
+              {frameSize && faces.length > 0 && (
+                // Same letterboxing as object-contain, so boxes can use frame pixel coordinates
+                <svg
+                  className="absolute inset-0 w-full h-full pointer-events-none"
+                  viewBox={detectionWidth
+                    ? `0 0 ${detectionWidth} ${detectionWidth * frameSize.height / frameSize.width}`
+                    : `0 0 ${frameSize.width} ${frameSize.height}`}
+                  preserveAspectRatio="xMidYMid meet"
+                >
+                  {faces.map((face, i) => {
+                    const [x, y, w, h] = face.box;
+                    return (
+                      <g key={i}>
+                        <rect x={x} y={y} width={w} height={h} fill="none" stroke="#00ff00" strokeWidth={2} />
+                        <text x={x} y={y - 6} fill="#00ff00" fontSize={12}>{face.confidence.toFixed(2)}</text>
+                      </g>
+                    );
+                  })}
+                </svg>
+              )}
+            </div>
           ) : (
             <div className="flex flex-col items-center justify-center text-center text-foreground/50 p-4 w-full h-full">
               {error ? (
@@ -227,6 +438,13 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
             </div>
           )}
           
+          {reconnecting && (currentFrame || passthrough) && (
+            <div className="absolute bottom-2 left-2 flex items-center gap-2 rounded bg-black/60 px-2 py-1 text-xs text-white">
+              <RefreshCw className="h-3 w-3 animate-spin" />
+              {reconnecting}
+            </div>
+          )}
+
           {isPaused && (
             <div className="absolute inset-0 bg-black/50 flex items-center justify-center backdrop-blur-sm">
               <Pause className="h-16 w-16 text-white" />
@@ -250,10 +468,21 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
                 )}
               </div>
               <div className="flex items-center gap-2">
+                {renditions.length > 1 && !passthrough && (
+                  <select
+                    value={rendition ?? renditions[0]}
+                    onChange={(e) => selectRendition(e.target.value)}
+                    className="bg-black/50 text-white text-xs rounded px-1 py-0.5 border border-white/20"
+                  >
+                    {renditions.map(name => (
+                      <option key={name} value={name}>{name}</option>
+                    ))}
+                  </select>
+                )}
                 <Badge 
-                  variant={isConnected ? "success" : "destructive"}
+                  variant={!isConnected ? "destructive" : reconnecting ? "secondary" : "success"}
                 >
-                  {isConnected ? "Connected" : "Disconnected"}
+                  {!isConnected ? "Disconnected" : reconnecting ? "Reconnecting" : "Connected"}
                 </Badge>
                 <Button variant="ghost" size="icon" onClick={toggleFullscreen} className="text-white hover:bg-white/10">
                   {isFullscreen ? <Minimize className="h-4 w-4" /> : <Maximize className="h-4 w-4" />}
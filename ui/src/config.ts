@@ -1,6 +1,13 @@
 export const API_BASE_URL = 'http://127.0.01:8000';
 export const SOCKET_BASE_URL = "ws://localhost:8000/ws";
 
+// Opt-in: VITE_SIDECAR_OVERLAY=1 asks for untouched frames plus detection messages
+// and draws the face boxes in the browser, instead of the server burning them in
+export const SIDECAR_OVERLAY = import.meta.env.VITE_SIDECAR_OVERLAY === '1';
+// Opt-in: VITE_LATENCY_TRACE=1 echoes the frames the server samples for latency
+// tracing once they are on screen, adding network and render time to the trace
+export const LATENCY_TRACE = import.meta.env.VITE_LATENCY_TRACE === '1';
+
 // export const API_BASE_URL = window.location.origin;
 // export const SOCKET_BASE_URL = "wss://rtsp-stream-app.onrender.com/ws";
 // export const SOCKET_BASE_URL = "wss://localhost:8000/ws";
\ No newline at end of file